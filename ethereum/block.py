@@ -11,6 +11,7 @@ from ethereum.securetrie import SecureTrie
 from ethereum.config import default_config
 from ethereum.transactions import Transaction
 from ethereum.db import BaseDB
+from ethereum.fast_rlp import decode_lazy
 import sys
 if sys.version_info.major == 2:
     from repoze.lru import lru_cache
@@ -212,6 +213,16 @@ class Block(rlp.Serializable):
         return len(self.transactions)
 
 
+def decode_header_and_uncles(block_rlp):
+    """the header and uncles of an RLP encoded block
+
+    The transactions are skipped over without being decoded.
+    """
+    block = decode_lazy(block_rlp)
+    return (BlockHeader.deserialize(block[0].tolist()),
+            [BlockHeader.deserialize(u) for u in block[2].tolist()])
+
+
 BLANK_UNCLES_HASH = sha3(rlp.encode([]))
 
 
@@ -0,0 +1,118 @@
+import collections
+import os
+import threading
+from collections import OrderedDict
+
+# Database keys of persisted analyses, followed by the kind and code hash
+ANALYSIS_PREFIX = b'analysis:'
+
+# How to analyze code for one kind of analysis. size estimates the memory
+# an analysis takes; encode and decode, if set, turn it into bytes and
+# back for the database.
+Analysis = collections.namedtuple(
+    'Analysis', ['analyze', 'size', 'encode', 'decode'])
+
+# Kinds of analysis, registered by the engines using them
+analyses = {}
+
+
+def register_analysis(kind, analyze, size, encode=None, decode=None):
+    analyses[kind] = Analysis(analyze, size, encode, decode)
+
+
+class CodeCache(object):
+    """Analyses of contract code, shared by the EVM engines
+
+    Entries are keyed by code hash and kind of analysis, e.g. the jump
+    destinations and push values every engine needs, or fastvm's basic
+    blocks. Code never changes under its hash, so an entry never goes stale
+    and a contract is analyzed once for as long as it stays in the cache.
+    The cache is bounded by the estimated size of its entries, evicting the
+    least recently used first.
+
+    With a database, analyses that can be encoded are also written there
+    and read back on a miss, so they outlive the process. Only the process
+    that made the cache writes, not workers forked from it.
+
+    Lookups may come from several threads, e.g. those prefetching state.
+    """
+
+    def __init__(self, max_bytes, db=None):
+        self.max_bytes = max_bytes
+        self.db = db
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, code_hash, kind, code):
+        """the analysis of code, whose hash is code_hash
+
+        :param code: the code, or a function returning it, called if the
+            analysis has to be made
+        """
+        # A thread of the parent may have held the lock when a worker was
+        # forked; workers run on one thread
+        lock = self.lock if os.getpid() == self.pid else threading.Lock()
+        with lock:
+            return self._get(code_hash, kind, code)
+
+    def _get(self, code_hash, kind, code):
+        key = (code_hash, kind)
+        try:
+            value, size = self.entries.pop(key)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            analysis = analyses[kind]
+            value = self._load(code_hash, kind, analysis)
+            if value is None:
+                if callable(code):
+                    code = code()
+                value = analysis.analyze(code)
+                self._store(code_hash, kind, analysis, value)
+            size = analysis.size(code, value)
+            if size > self.max_bytes:
+                return value
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+        self.entries[key] = (value, size)
+        return value
+
+    def _load(self, code_hash, kind, analysis):
+        if self.db is None or analysis.decode is None:
+            return None
+        try:
+            encoded = self.db.get(ANALYSIS_PREFIX + kind + b':' + code_hash)
+        except KeyError:
+            return None
+        self.loads += 1
+        return analysis.decode(encoded)
+
+    def _store(self, code_hash, kind, analysis, value):
+        if self.db is None or analysis.encode is None or \
+                os.getpid() != self.pid:
+            return
+        self.db.put(ANALYSIS_PREFIX + kind + b':' + code_hash,
+                    analysis.encode(value))
+
+    def clear(self):
+        self.entries = OrderedDict()
+        self.size = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / float(lookups) if lookups else 0.0
+
+    def stats(self):
+        return dict(entries=len(self.entries), size=self.size,
+                    hits=self.hits, misses=self.misses, loads=self.loads,
+                    evictions=self.evictions, hit_rate=self.hit_rate)
@@ -148,9 +148,10 @@ def add_transactions(state, block, txqueue, min_gasprice=0):
 
 # Validate that the transaction list root is correct
 def validate_transaction_tree(state, block):
-    if block.header.tx_list_root != mk_transaction_sha(block.transactions):
+    tx_list_root = mk_transaction_sha(block.transactions)
+    if block.header.tx_list_root != tx_list_root:
         raise ValueError("Transaction root mismatch: header %s computed %s, %d transactions" %
-                         (encode_hex(block.header.tx_list_root), encode_hex(mk_transaction_sha(block.transactions)),
+                         (encode_hex(block.header.tx_list_root), encode_hex(tx_list_root),
                           len(block.transactions)))
     return True
 
@@ -161,7 +162,7 @@ def set_execution_results(state, block):
 
     block = block.copy(
         header = block.header.copy(
-            receipts_root = mk_receipt_sha(state.receipts),
+            receipts_root = state.receipts_trie.root_hash,
             tx_list_root = mk_transaction_sha(block.transactions),
             state_root = state.trie.root_hash,
             gas_used = state.gas_used,
@@ -181,9 +182,10 @@ def verify_execution_results(state, block):
     if block.header.state_root != state.trie.root_hash:
         raise ValueError("State root mismatch: header %s computed %s" %
                          (encode_hex(block.header.state_root), encode_hex(state.trie.root_hash)))
-    if block.header.receipts_root != mk_receipt_sha(state.receipts):
+    receipts_root = state.receipts_trie.root_hash
+    if block.header.receipts_root != receipts_root:
         raise ValueError("Receipt root mismatch: header %s computed %s, gas used header %d computed %d, %d receipts" %
-                         (encode_hex(block.header.receipts_root), encode_hex(mk_receipt_sha(state.receipts)),
+                         (encode_hex(block.header.receipts_root), encode_hex(receipts_root),
                           block.header.gas_used, state.gas_used, len(state.receipts)))
     if block.header.gas_used != state.gas_used:
         raise ValueError("Gas used mismatch: header %d computed %d" %
@@ -193,10 +195,9 @@ def verify_execution_results(state, block):
 
 # Make the root of a receipt tree
 def mk_receipt_sha(receipts):
-    t = trie.Trie(EphemDB())
-    for i, receipt in enumerate(receipts):
-        t.update(rlp.encode(i), rlp.encode(receipt))
-    return t.root_hash
+    items = sorted((rlp.encode(i), rlp.encode(receipt))
+                   for i, receipt in enumerate(receipts))
+    return trie.Trie.from_sorted_items(EphemDB(), items).root_hash
 
 
 # Make the root of a transaction tree
@@ -1,7 +1,13 @@
 from ethereum.utils import decode_hex
 
+import atexit
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from ethereum import utils
-from ethereum.db import BaseDB, EphemDB
+from ethereum.db import BaseDB, EphemDB, CachingDB, RefcountDB, OverlayDB
+from ethereum.flat_state import FlatState
+from ethereum.state_cache import StateCache
+from ethereum.code_cache import CodeCache
 from ethereum.child_dao_list import L as child_dao_list
 import copy
 
@@ -94,11 +100,47 @@ default_config = dict(
         '60ff331436604014161560155760203560003555005b6000355460205260206020f3'),
     # Custom specials
     CUSTOM_SPECIALS={},
+    # Byte budget of the decoded trie node cache
+    TRIE_NODE_CACHE_BYTES=32 * 1024 * 1024,
+    # Worker processes hashing large state commits, 0 to hash serially. Only
+    # worth it with cores to spare: on one core the pool is slower.
+    TRIE_COMMIT_PROCESSES=0,
+    # Recent blocks kept as in-memory flat state diffs, 0 to disable
+    FLAT_STATE_LAYERS=128,
+    # Decoded accounts and storage slots of the head state kept across
+    # commits, 0 to disable
+    STATE_CACHE_ACCOUNTS=50000,
+    STATE_CACHE_SLOTS=500000,
+    # Load the accounts and fixed storage slots a block touches before
+    # executing it, on this many threads if nonzero. Off by default: without
+    # threads there is nothing for the loads to overlap with.
+    PREFETCH_STATE=False,
+    PREFETCH_THREADS=0,
+    # Worker processes executing the transactions of a block speculatively,
+    # 0 or 1 to execute them serially
+    TX_EXECUTION_PROCESSES=0,
+    # EVM interpreter, a name in vm.VM_ENGINES or a module with vm_execute
+    VM_ENGINE='vm',
+    # Estimated memory budget of the analyses of contract code kept by code
+    # hash, 0 to analyze code on every call
+    CODE_CACHE_BYTES=16 * 1024 * 1024,
+    # Also keep jump destination and push tables in the database
+    PERSIST_CODE_ANALYSIS=False,
 )
 assert default_config['NEPHEW_REWARD'] == \
     default_config['BLOCK_REWARD'] // 32
 
 
+# Envs with worker pools, closed at exit unless closed before
+_open_envs = weakref.WeakSet()
+
+
+@atexit.register
+def _close_envs():
+    for env in list(_open_envs):
+        env.close()
+
+
 class Env(object):
 
     def __init__(self, db=None, config=None, global_config=None):
@@ -106,6 +148,64 @@ class Env(object):
         assert isinstance(self.db, BaseDB)
         self.config = config or dict(default_config)
         self.global_config = global_config or dict()
+        # Worker pools owned by this Env, shut down by close
+        self.executors = []
+        # Node database shared by the state trie and all storage tries
+        self.trie_db = CachingDB(
+            RefcountDB(self.db),
+            self.config.get('TRIE_NODE_CACHE_BYTES',
+                            default_config['TRIE_NODE_CACHE_BYTES']))
+        processes = self.config.get('TRIE_COMMIT_PROCESSES', 0)
+        self.trie_executor = self._own(ProcessPoolExecutor(processes)) \
+            if processes else None
+        # Flat account and storage tables, kept up to date by the chain
+        layers = self.config.get('FLAT_STATE_LAYERS', 0)
+        self.flat_state = FlatState(self.db, self.trie_db, layers) \
+            if layers else None
+        # Warm accounts and storage of the head state, shared with forks
+        accounts = self.config.get('STATE_CACHE_ACCOUNTS', 0)
+        slots = self.config.get('STATE_CACHE_SLOTS', 0)
+        self.state_cache = StateCache(accounts, slots) \
+            if accounts or slots else None
+        # Analyzed contract code, shared by the EVM engines
+        code_bytes = self.config.get('CODE_CACHE_BYTES',
+                                     default_config['CODE_CACHE_BYTES'])
+        self.code_cache = CodeCache(
+            code_bytes,
+            self.db if self.config.get('PERSIST_CODE_ANALYSIS') else None) \
+            if code_bytes else None
+        threads = self.config.get('PREFETCH_THREADS', 0)
+        self.prefetch_executor = self._own(ThreadPoolExecutor(threads)) \
+            if threads else None
+
+    def _own(self, executor):
+        if not self.executors:
+            _open_envs.add(self)
+        self.executors.append(executor)
+        return executor
+
+    def close(self):
+        """shut down the worker pools of this Env, once it is no longer used
+
+        Its forks use the same pools, so they are done with too.
+        """
+        executors, self.executors = self.executors, []
+        for executor in executors:
+            executor.shutdown()
+        _open_envs.discard(self)
+
+    def fork(self):
+        """an Env whose writes stay in memory, on top of this one
+
+        Reads of trie nodes go through this Env's node cache. The flat state
+        is shared for reading only; forks never publish layers to it.
+        Forks share the worker pools of this Env and do not own them.
+        """
+        env = copy.copy(self)
+        env.db = OverlayDB(self.db)
+        env.trie_db = OverlayDB(self.trie_db)
+        env.executors = []
+        return env
 
 
 config_frontier = copy.copy(default_config)
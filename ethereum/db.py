@@ -1,7 +1,13 @@
 from ethereum import utils
+from ethereum.fast_rlp import decode_optimized
 from ethereum.slogging import get_logger
 from ethereum.utils import str_to_bytes
+import os
+import struct
 import sys
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
 if sys.version_info.major == 2:
     from repoze.lru import lru_cache
 else:
@@ -12,9 +18,56 @@ log = get_logger('db')
 
 databases = {}
 
+DEFAULT_NODE_CACHE_BYTES = 32 * 1024 * 1024
+
 
 class BaseDB(object):
-    pass
+
+    # Pending writes of the active write batch, None when outside one
+    batch = None
+
+    @contextmanager
+    def write_batch(self):
+        """Coalesce puts and deletes into a single backend write
+
+        Inside the block writes are buffered (last write wins) and visible
+        to reads; on a clean exit they are applied with one `_write_batch`
+        call, on an exception they are discarded. Nested batches join the
+        outermost one.
+        """
+        if self.batch is not None:
+            yield self
+            return
+        self.batch = {}
+        try:
+            yield self
+            batch = self.batch
+        finally:
+            self.batch = None
+        if batch:
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        for key, value in batch.items():
+            if value is None:
+                self.delete(key)
+            else:
+                self.put(key, value)
+
+    def get_node(self, key):
+        """Get the decoded trie node stored under the given hash"""
+        return decode_optimized(self.get(key))
+
+    def _batch_get(self, key):
+        value = self.batch[key]
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def _batch_delete(self, key):
+        if not self._has_key(key):
+            raise KeyError(key)
+        self.batch[key] = None
 
 
 class _EphemDB(BaseDB):
@@ -24,18 +77,34 @@ class _EphemDB(BaseDB):
         self.kv = self.db
 
     def get(self, key):
+        if self.batch is not None and key in self.batch:
+            return self._batch_get(key)
         return self.db[key]
 
     def put(self, key, value):
-        self.db[key] = value
+        if self.batch is not None:
+            self.batch[key] = value
+        else:
+            self.db[key] = value
 
     def delete(self, key):
-        del self.db[key]
+        if self.batch is not None:
+            self._batch_delete(key)
+        else:
+            del self.db[key]
+
+    def _write_batch(self, batch):
+        self.db.update((k, v) for k, v in batch.items() if v is not None)
+        for key, value in batch.items():
+            if value is None:
+                self.db.pop(key, None)
 
     def commit(self):
         pass
 
     def _has_key(self, key):
+        if self.batch is not None and key in self.batch:
+            return self.batch[key] is not None
         return key in self.db
 
     def __contains__(self, key):
@@ -51,6 +120,184 @@ class _EphemDB(BaseDB):
 DB = EphemDB = _EphemDB
 
 
+# On-disk format: an 8-byte file header followed by a sequence of batches.
+# Each batch is (magic, payload length, crc32 of payload) followed by the
+# payload, which is a list of (op, key length, value length, key, value)
+# records. A batch is only considered written once its checksum matches, so
+# a crash halfway through a commit leaves the previous state intact.
+FILEDB_HEADER = b'PYETHDB\x01'
+FILEDB_BATCH_MAGIC = b'BTCH'
+FILEDB_BATCH = struct.Struct('>4sII')
+FILEDB_RECORD = struct.Struct('>BII')
+FILEDB_PUT, FILEDB_DELETE = 0, 1
+
+
+class FileDB(BaseDB):
+    """Persistent append-only key-value store backed by a single file
+
+    Writes are buffered in memory until `commit`, which appends them to the
+    file as one checksummed batch followed by a single fsync. Only an index
+    of value offsets is kept in memory; values are read from disk on demand.
+    """
+
+    def __init__(self, path, sync=True):
+        self.path = path
+        self.sync = sync
+        self.kv = None
+        self.uncommitted = {}
+        self.index = {}
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(FILEDB_HEADER)
+        self.f = open(path, 'r+b')
+        self._load()
+        databases[os.path.abspath(path)] = self
+
+    def _load(self):
+        header = self.f.read(len(FILEDB_HEADER))
+        if not header:
+            self.f.write(FILEDB_HEADER)
+            self.f.flush()
+        elif header != FILEDB_HEADER:
+            raise IOError("%s is not a FileDB file" % self.path)
+        pos = len(FILEDB_HEADER)
+        while True:
+            head = self.f.read(FILEDB_BATCH.size)
+            if len(head) < FILEDB_BATCH.size:
+                break
+            magic, length, checksum = FILEDB_BATCH.unpack(head)
+            payload = self.f.read(length)
+            if magic != FILEDB_BATCH_MAGIC or len(payload) < length or \
+                    zlib.crc32(payload) & 0xffffffff != checksum:
+                break
+            self._index_batch(payload, pos + FILEDB_BATCH.size)
+            pos += FILEDB_BATCH.size + length
+        # Drop a partially written trailing batch, if any
+        self.f.seek(0, os.SEEK_END)
+        if self.f.tell() != pos:
+            log.warn('truncating incomplete batch', path=self.path, pos=pos)
+            self.f.truncate(pos)
+
+    def _index_batch(self, payload, base):
+        i = 0
+        while i < len(payload):
+            op, klen, vlen = FILEDB_RECORD.unpack_from(payload, i)
+            i += FILEDB_RECORD.size
+            key = payload[i: i + klen]
+            i += klen
+            if op == FILEDB_PUT:
+                self.index[key] = (base + i, vlen)
+            else:
+                self.index.pop(key, None)
+            i += vlen
+
+    def get(self, key):
+        key = str_to_bytes(key)
+        if self.batch is not None and key in self.batch:
+            return self._batch_get(key)
+        if key in self.uncommitted:
+            if self.uncommitted[key] is None:
+                raise KeyError(key)
+            return self.uncommitted[key]
+        offset, length = self.index[key]
+        if hasattr(os, 'pread'):
+            # Positional reads are safe for prefetching threads
+            return os.pread(self.f.fileno(), length, offset)
+        self.f.seek(offset)
+        return self.f.read(length)
+
+    def put(self, key, value):
+        if self.batch is not None:
+            self.batch[str_to_bytes(key)] = str_to_bytes(value)
+        else:
+            self.uncommitted[str_to_bytes(key)] = str_to_bytes(value)
+
+    def delete(self, key):
+        key = str_to_bytes(key)
+        if self.batch is not None:
+            return self._batch_delete(key)
+        if not self._has_key(key):
+            raise KeyError(key)
+        self.uncommitted[key] = None
+
+    def _write_batch(self, batch):
+        self.uncommitted.update(batch)
+
+    def commit(self):
+        if not self.uncommitted:
+            return
+        payload = []
+        for key, value in self.uncommitted.items():
+            if value is None:
+                if key not in self.index:
+                    continue
+                payload.append(FILEDB_RECORD.pack(FILEDB_DELETE, len(key), 0))
+                payload.append(key)
+            else:
+                payload.append(
+                    FILEDB_RECORD.pack(FILEDB_PUT, len(key), len(value)))
+                payload.append(key)
+                payload.append(value)
+        payload = b''.join(payload)
+        self.f.seek(0, os.SEEK_END)
+        base = self.f.tell()
+        self.f.write(FILEDB_BATCH.pack(FILEDB_BATCH_MAGIC, len(payload),
+                                       zlib.crc32(payload) & 0xffffffff))
+        self.f.write(payload)
+        self.f.flush()
+        if self.sync:
+            os.fsync(self.f.fileno())
+        self._index_batch(payload, base + FILEDB_BATCH.size)
+        self.uncommitted = {}
+
+    def compact(self):
+        """Rewrite the file keeping only live values, then swap it in"""
+        self.commit()
+        tmp_path = self.path + '.compact'
+        with open(tmp_path, 'wb') as out:
+            out.write(FILEDB_HEADER)
+            payload = []
+            for key in self.index:
+                value = self.get(key)
+                payload.append(
+                    FILEDB_RECORD.pack(FILEDB_PUT, len(key), len(value)))
+                payload.append(key)
+                payload.append(value)
+            payload = b''.join(payload)
+            out.write(FILEDB_BATCH.pack(FILEDB_BATCH_MAGIC, len(payload),
+                                        zlib.crc32(payload) & 0xffffffff))
+            out.write(payload)
+            out.flush()
+            os.fsync(out.fileno())
+        self.f.close()
+        os.rename(tmp_path, self.path)
+        self.f = open(self.path, 'r+b')
+        self.index = {}
+        self._load()
+
+    def close(self):
+        self.f.close()
+        databases.pop(os.path.abspath(self.path), None)
+
+    def _has_key(self, key):
+        key = str_to_bytes(key)
+        if self.batch is not None and key in self.batch:
+            return self.batch[key] is not None
+        if key in self.uncommitted:
+            return self.uncommitted[key] is not None
+        return key in self.index
+
+    def __contains__(self, key):
+        return self._has_key(key)
+
+    def __eq__(self, other):
+        return isinstance(other, self.__class__) and \
+            os.path.abspath(self.path) == os.path.abspath(other.path)
+
+    def __hash__(self):
+        return utils.big_endian_to_int(str_to_bytes(self.__repr__()))
+
+
 # Used for SPV proof creation
 class ListeningDB(BaseDB):
 
@@ -72,6 +319,9 @@ class ListeningDB(BaseDB):
     def delete(self, key):
         self.parent.delete(key)
 
+    def write_batch(self):
+        return self.parent.write_batch()
+
     def _has_key(self, key):
         return self.parent._has_key(key)
 
@@ -94,22 +344,41 @@ class OverlayDB(BaseDB):
         self.overlay = {}
 
     def get(self, key):
+        if self.batch is not None and key in self.batch:
+            return self._batch_get(key)
         if key in self.overlay:
             if self.overlay[key] is None:
                 raise KeyError()
             return self.overlay[key]
         return self.db.get(key)
 
+    def get_node(self, key):
+        if (self.batch is not None and key in self.batch) or \
+                key in self.overlay:
+            return BaseDB.get_node(self, key)
+        return self.db.get_node(key)
+
     def put(self, key, value):
-        self.overlay[key] = value
+        if self.batch is not None:
+            self.batch[key] = value
+        else:
+            self.overlay[key] = value
 
     def delete(self, key):
-        self.overlay[key] = None
+        if self.batch is not None:
+            self.batch[key] = None
+        else:
+            self.overlay[key] = None
+
+    def _write_batch(self, batch):
+        self.overlay.update(batch)
 
     def commit(self):
         pass
 
     def _has_key(self, key):
+        if self.batch is not None and key in self.batch:
+            return self.batch[key] is not None
         if key in self.overlay:
             return self.overlay[key] is not None
         return key in self.db
@@ -124,6 +393,79 @@ class OverlayDB(BaseDB):
         return utils.big_endian_to_int(str_to_bytes(self.__repr__()))
 
 
+def copy_node(node):
+    return [x if not isinstance(x, list) else copy_node(x) for x in node]
+
+
+# Used in front of the trie databases
+class CachingDB(BaseDB):
+    """Read-through cache of decoded trie nodes in front of another database
+
+    Nodes are keyed by the hash of their encoding, so a cached node can never
+    go stale and entries are never invalidated. The cache is bounded by the
+    total encoded size of the nodes it holds, evicting the least recently
+    used node first. Callers get a copy, as the trie mutates nodes in place.
+    """
+
+    def __init__(self, db, max_bytes=DEFAULT_NODE_CACHE_BYTES):
+        self.db = db
+        self.kv = None
+        self.max_bytes = max_bytes
+        self.nodes = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        return self.db.get(key)
+
+    def get_node(self, key):
+        try:
+            node, size = self.nodes.pop(key)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            encoded = self.db.get(key)
+            node, size = decode_optimized(encoded), len(encoded)
+            if size > self.max_bytes:
+                return node
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self.nodes.popitem(last=False)
+                self.size -= evicted_size
+        self.nodes[key] = (node, size)
+        return copy_node(node)
+
+    def put(self, key, value):
+        self.db.put(key, value)
+
+    def delete(self, key):
+        self.db.delete(key)
+
+    def write_batch(self):
+        return self.db.write_batch()
+
+    def commit(self):
+        self.db.commit()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / float(lookups) if lookups else 0.0
+
+    def _has_key(self, key):
+        return self.db._has_key(key)
+
+    def __contains__(self, key):
+        return self._has_key(key)
+
+    def __eq__(self, other):
+        return isinstance(other, self.__class__) and self.db == other.db
+
+    def __hash__(self):
+        return utils.big_endian_to_int(str_to_bytes(self.__repr__()))
+
+
 @lru_cache(128)
 def add1(b):
     v = utils.big_endian_to_int(b)
@@ -170,6 +512,9 @@ class RefcountDB(BaseDB):
             # print(repr(existing[:4]))
             self.db.put(key, sub1(existing[:4]) + existing[4:])
 
+    def write_batch(self):
+        return self.db.write_batch()
+
     def commit(self):
         pass
 
@@ -7,47 +7,15 @@ from ethereum.utils import to_string
 from ethereum.utils import is_string
 from ethereum.utils import encode_hex
 import copy
-from ethereum.utils import decode_hex, ascii_chr, str_to_bytes
+from ethereum.utils import decode_hex, ascii_chr
 import sys
 from ethereum.fast_rlp import encode_optimized
+from ethereum.trie import (
+    NIBBLE_TERMINATOR, TERMINATOR_NIBBLES, bin_to_nibbles, nibbles_to_bin,
+    with_terminator, without_terminator, adapt_terminator, pack_nibbles,
+    unpack_to_nibbles, has_terminator, starts_with, common_prefix_length)
 rlp_encode = encode_optimized
 
-bin_to_nibbles_cache = {}
-
-hti = {}
-for i, c in enumerate(b'0123456789abcdef'):
-    hti[c] = i
-
-
-def bin_to_nibbles(s):
-    """convert string s to nibbles (half-bytes)
-
-    >>> bin_to_nibbles("")
-    []
-    >>> bin_to_nibbles("h")
-    [6, 8]
-    >>> bin_to_nibbles("he")
-    [6, 8, 6, 5]
-    >>> bin_to_nibbles("hello")
-    [6, 8, 6, 5, 6, 12, 6, 12, 6, 15]
-    """
-    return [hti[c] for c in encode_hex(s)]
-
-
-def nibbles_to_bin(nibbles):
-    if any(x > 15 or x < 0 for x in nibbles):
-        raise Exception("nibbles can only be [0,..15]")
-
-    if len(nibbles) % 2:
-        raise Exception("nibbles must be of even numbers")
-
-    res = b''
-    for i in range(0, len(nibbles), 2):
-        res += ascii_chr(16 * nibbles[i] + nibbles[i + 1])
-    return res
-
-
-NIBBLE_TERMINATOR = 16
 RECORDING = 1
 NONE = 0
 VERIFYING = -1
@@ -106,77 +74,6 @@ class InvalidSPVProof(Exception):
     pass
 
 
-def with_terminator(nibbles):
-    nibbles = nibbles[:]
-    if not nibbles or nibbles[-1] != NIBBLE_TERMINATOR:
-        nibbles.append(NIBBLE_TERMINATOR)
-    return nibbles
-
-
-def without_terminator(nibbles):
-    nibbles = nibbles[:]
-    if nibbles and nibbles[-1] == NIBBLE_TERMINATOR:
-        del nibbles[-1]
-    return nibbles
-
-
-def adapt_terminator(nibbles, has_terminator):
-    if has_terminator:
-        return with_terminator(nibbles)
-    else:
-        return without_terminator(nibbles)
-
-
-def pack_nibbles(nibbles):
-    """pack nibbles to binary
-
-    :param nibbles: a nibbles sequence. may have a terminator
-    """
-
-    if nibbles[-1:] == [NIBBLE_TERMINATOR]:
-        flags = 2
-        nibbles = nibbles[:-1]
-    else:
-        flags = 0
-
-    oddlen = len(nibbles) % 2
-    flags |= oddlen   # set lowest bit if odd number of nibbles
-    if oddlen:
-        nibbles = [flags] + nibbles
-    else:
-        nibbles = [flags, 0] + nibbles
-    o = b''
-    for i in range(0, len(nibbles), 2):
-        o += ascii_chr(16 * nibbles[i] + nibbles[i + 1])
-    return o
-
-
-def unpack_to_nibbles(bindata):
-    """unpack packed binary data to nibbles
-
-    :param bindata: binary packed from nibbles
-    :return: nibbles sequence, may have a terminator
-    """
-    o = bin_to_nibbles(bindata)
-    flags = o[0]
-    if flags & 2:
-        o.append(NIBBLE_TERMINATOR)
-    if flags & 1 == 1:
-        o = o[1:]
-    else:
-        o = o[2:]
-    return o
-
-
-def starts_with(full, part):
-    """ test whether the items in the part is
-    the leading items of the full
-    """
-    if len(full) < len(part):
-        return False
-    return full[:len(part)] == part
-
-
 (
     NODE_TYPE_BLANK,
     NODE_TYPE_LEAF,
@@ -360,9 +257,7 @@ class Trie(object):
             return NODE_TYPE_BLANK
 
         if len(node) == 2:
-            nibbles = unpack_to_nibbles(node[0])
-            has_terminator = (nibbles and nibbles[-1] == NIBBLE_TERMINATOR)
-            return NODE_TYPE_LEAF if has_terminator\
+            return NODE_TYPE_LEAF if has_terminator(node[0])\
                 else NODE_TYPE_EXTENSION
         if len(node) == 17:
             return NODE_TYPE_BRANCH
@@ -451,12 +346,7 @@ class Trie(object):
         is_inner = node_type == NODE_TYPE_EXTENSION
         # sys.stderr.write('ukv %r %r\n' % (key, value))
 
-        # find longest common prefix
-        prefix_length = 0
-        for i in range(min(len(curr_key), len(key))):
-            if key[i] != curr_key[i]:
-                break
-            prefix_length = i + 1
+        prefix_length = common_prefix_length(key, curr_key)
 
         # sys.stderr.write('pl: %d\n' % prefix_length)
 
@@ -464,7 +354,7 @@ class Trie(object):
         remain_curr_key = curr_key[prefix_length:]
         new_node_encoded = False
 
-        if remain_key == [] == remain_curr_key:
+        if not remain_key and not remain_curr_key:
             # sys.stderr.write('1111\n')
             if not is_inner:
                 o = [node[0], value]
@@ -474,7 +364,7 @@ class Trie(object):
                 self._decode_to_node(node[1]), remain_key, value)
             new_node_encoded = True
 
-        elif remain_curr_key == []:
+        elif not remain_curr_key:
             if is_inner:
                 # sys.stderr.write('22221\n')
                 new_node = self._update_and_delete_storage(
@@ -502,7 +392,7 @@ class Trie(object):
                     node[1]
                 ])
 
-            if remain_key == []:
+            if not remain_key:
                 new_node[-1] = value
             else:
                 new_node[remain_key[0]] = self._encode_node([
@@ -524,22 +414,22 @@ class Trie(object):
                 self._encode_node(new_node)
             return new_node
 
-    def _getany(self, node, reverse=False, path=[]):
+    def _getany(self, node, reverse=False, path=b''):
         node_type = self._get_node_type(node)
         if node_type == NODE_TYPE_BLANK:
             return None
         if node_type == NODE_TYPE_BRANCH:
             if node[16]:
-                return [16]
+                return TERMINATOR_NIBBLES
             scan_range = list(range(16))
             if reverse:
                 scan_range.reverse()
             for i in scan_range:
                 o = self._getany(
                     self._decode_to_node(
-                        node[i]), path=path + [i])
+                        node[i]), path=path + ascii_chr(i))
                 if o:
-                    return [i] + o
+                    return ascii_chr(i) + o
             return None
         curr_key = without_terminator(unpack_to_nibbles(node[0]))
         if node_type == NODE_TYPE_LEAF:
@@ -550,7 +440,7 @@ class Trie(object):
             sub_node = self._decode_to_node(node[1])
             return self._getany(sub_node, path=path + curr_key)
 
-    def _iter(self, node, key, reverse=False, path=[]):
+    def _iter(self, node, key, reverse=False, path=b''):
         node_type = self._get_node_type(node)
 
         if node_type == NODE_TYPE_BLANK:
@@ -559,20 +449,20 @@ class Trie(object):
         elif node_type == NODE_TYPE_BRANCH:
             if len(key):
                 sub_node = self._decode_to_node(node[key[0]])
-                o = self._iter(sub_node, key[1:], reverse, path + [key[0]])
+                o = self._iter(sub_node, key[1:], reverse, path + key[:1])
                 if o:
-                    return [key[0]] + o
+                    return key[:1] + o
             if reverse:
                 scan_range = list(range(key[0] if len(key) else 0))
             else:
                 scan_range = list(range(key[0] + 1 if len(key) else 0, 16))
             for i in scan_range:
                 sub_node = self._decode_to_node(node[i])
-                o = self._getany(sub_node, reverse, path + [i])
+                o = self._getany(sub_node, reverse, path + ascii_chr(i))
                 if o:
-                    return [i] + o
+                    return ascii_chr(i) + o
             if reverse and node[16]:
-                return [16]
+                return TERMINATOR_NIBBLES
             return None
 
         descend_key = without_terminator(unpack_to_nibbles(node[0]))
@@ -663,7 +553,7 @@ class Trie(object):
 
         # the value item is not blank
         if not_blank_index == 16:
-            o = [pack_nibbles(with_terminator([])), node[16]]
+            o = [pack_nibbles(TERMINATOR_NIBBLES), node[16]]
             self._encode_node(o)
             return o
 
@@ -675,13 +565,13 @@ class Trie(object):
             # collape subnode to this node, not this node will have same
             # terminator with the new sub node, and value does not change
             self._delete_node_storage(sub_node)
-            new_key = [not_blank_index] + \
+            new_key = ascii_chr(not_blank_index) + \
                 unpack_to_nibbles(sub_node[0])
             o = [pack_nibbles(new_key), sub_node[1]]
             self._encode_node(o)
             return o
         if sub_node_type == NODE_TYPE_BRANCH:
-            o = [pack_nibbles([not_blank_index]),
+            o = [pack_nibbles(ascii_chr(not_blank_index)),
                  node[not_blank_index]]
             self._encode_node(o)
             return o
@@ -849,18 +739,16 @@ class Trie(object):
         node_type = self._get_node_type(node)
 
         if is_key_value_type(node_type):
-            nibbles = without_terminator(unpack_to_nibbles(node[0]))
-            key = b'+'.join([to_string(x) for x in nibbles])
+            key = without_terminator(unpack_to_nibbles(node[0]))
             if node_type == NODE_TYPE_EXTENSION:
                 sub_dict = self._to_dict(self._decode_to_node(node[1]))
             else:
-                sub_dict = {to_string(NIBBLE_TERMINATOR): node[1]}
+                sub_dict = {TERMINATOR_NIBBLES: node[1]}
 
             # prepend key of this node to the keys of children
             res = {}
             for sub_key, sub_value in sub_dict.items():
-                full_key = (key + b'+' + sub_key).strip(b'+')
-                res[full_key] = sub_value
+                res[key + sub_key] = sub_value
             return res
 
         elif node_type == NODE_TYPE_BRANCH:
@@ -869,35 +757,22 @@ class Trie(object):
                 sub_dict = self._to_dict(self._decode_to_node(node[i]))
 
                 for sub_key, sub_value in sub_dict.items():
-                    full_key = (
-                        str_to_bytes(
-                            str(i)) +
-                        b'+' +
-                        sub_key).strip(b'+')
-                    res[full_key] = sub_value
+                    res[ascii_chr(i) + sub_key] = sub_value
 
             if node[16]:
-                res[to_string(NIBBLE_TERMINATOR)] = node[-1]
+                res[TERMINATOR_NIBBLES] = node[-1]
             return res
 
     def to_dict(self):
         d = self._to_dict(self.root_node)
         res = {}
-        for key_str, value in d.items():
-            if key_str:
-                nibbles = [int(x) for x in key_str.split(b'+')]
-            else:
-                nibbles = []
+        for nibbles, value in d.items():
             key = nibbles_to_bin(without_terminator(nibbles))
             res[key] = value
         return res
 
     def iter_branch(self):
-        for key_str, value in self._iter_branch(self.root_node):
-            if key_str:
-                nibbles = [int(x) for x in key_str.split(b'+')]
-            else:
-                nibbles = []
+        for nibbles, value in self._iter_branch(self.root_node):
             key = nibbles_to_bin(without_terminator(nibbles))
             yield key, value
 
@@ -914,30 +789,23 @@ class Trie(object):
         node_type = self._get_node_type(node)
 
         if is_key_value_type(node_type):
-            nibbles = without_terminator(unpack_to_nibbles(node[0]))
-            key = b'+'.join([to_string(x) for x in nibbles])
+            key = without_terminator(unpack_to_nibbles(node[0]))
             if node_type == NODE_TYPE_EXTENSION:
                 sub_tree = self._iter_branch(self._decode_to_node(node[1]))
             else:
-                sub_tree = [(to_string(NIBBLE_TERMINATOR), node[1])]
+                sub_tree = [(TERMINATOR_NIBBLES, node[1])]
 
             # prepend key of this node to the keys of children
             for sub_key, sub_value in sub_tree:
-                full_key = (key + b'+' + sub_key).strip(b'+')
-                yield (full_key, sub_value)
+                yield (key + sub_key, sub_value)
 
         elif node_type == NODE_TYPE_BRANCH:
             for i in range(16):
                 sub_tree = self._iter_branch(self._decode_to_node(node[i]))
                 for sub_key, sub_value in sub_tree:
-                    full_key = (
-                        str_to_bytes(
-                            str(i)) +
-                        b'+' +
-                        sub_key).strip(b'+')
-                    yield (full_key, sub_value)
+                    yield (ascii_chr(i) + sub_key, sub_value)
             if node[16]:
-                yield (to_string(NIBBLE_TERMINATOR), node[-1])
+                yield (TERMINATOR_NIBBLES, node[-1])
 
     def get(self, key):
         return self._get(self.root_node, bin_to_nibbles(to_string(key)))
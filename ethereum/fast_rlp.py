@@ -1,23 +1,27 @@
-import sys
 import rlp
-from ethereum.utils import ( 
+from rlp.exceptions import DecodingError, EncodingError
+from ethereum.utils import (
     int_to_big_endian,
     big_endian_to_int,
     safe_ord,
     to_string,
+    ascii_chr,
 )
-from ethereum import db
 
 
 def _encode_optimized(item):
     """RLP encode (a nested sequence of) bytes"""
-    if isinstance(item, bytes):
-        if len(item) == 1 and ord(item) < 128:
+    if isinstance(item, (bytes, bytearray)):
+        if len(item) == 1 and item[0] < 128:
             return item
         prefix = length_prefix(len(item), 128)
-    else:
+    elif isinstance(item, (list, tuple)):
         item = b''.join([_encode_optimized(x) for x in item])
         prefix = length_prefix(len(item), 192)
+    else:
+        # e.g. str, which would otherwise be iterated into str forever
+        raise EncodingError('Cannot RLP encode object of type %s' %
+                            type(item).__name__, item)
     return prefix + item
 
 
@@ -29,23 +33,65 @@ def length_prefix(length, offset):
                    list
     """
     if length < 56:
-        return chr(offset + length)
+        return ascii_chr(offset + length)
     else:
         length_string = int_to_big_endian(length)
-        return chr(offset + 56 - 1 + len(length_string)) + length_string
+        return ascii_chr(offset + 56 - 1 + len(length_string)) + length_string
 
 
 def _decode_optimized(rlp):
+    """RLP decode bytes to (a nested list of) bytes
+
+    The input is walked by offset, so only the decoded strings are copied
+    out of it, never the encodings of the nested lists.
+    """
+    if not isinstance(rlp, bytes):
+        rlp = bytes(rlp)
+    if not rlp:
+        raise DecodingError('RLP string must not be empty', rlp)
+    item, end = _decode_item(rlp, 0, len(rlp))
+    if end != len(rlp):
+        raise DecodingError('RLP string ends with superfluous bytes', rlp)
+    return item
+
+
+def _decode_item(rlp, pos, limit):
+    """Decode the item starting at `pos`, which must end before `limit`
+
+    :returns: a tuple ``(item, end)``, ``end`` being the position of the
+              first byte after the item
+    """
+    b0 = rlp[pos]
+    if b0 < 128:  # single byte
+        return rlp[pos:pos + 1], pos + 1
+    if b0 < 184 or 192 <= b0 < 248:  # short string or list
+        start = pos + 1
+        end = start + (b0 - 128 if b0 < 192 else b0 - 192)
+    else:  # long string or list
+        start = pos + 1 + (b0 - 183 if b0 < 192 else b0 - 247)
+        end = start + big_endian_to_int(rlp[pos + 1:start])
+    if end > limit:
+        raise DecodingError('RLP item exceeds its enclosing data', rlp)
+    if b0 < 192:
+        return rlp[start:end], end
     o = []
-    pos = 0
-    _typ, _len, pos = consume_length_prefix(rlp, pos)
-    if _typ != list:
-        return rlp[pos: pos + _len]
-    while pos < len(rlp):
-        _, _l, _p = consume_length_prefix(rlp, pos)
-        o.append(_decode_optimized(rlp[pos: _l + _p]))
-        pos = _l + _p
-    return o
+    pos = start
+    while pos < end:
+        b0 = rlp[pos]
+        # strings make up most list items, so decode short ones inline
+        if b0 < 128:
+            o.append(rlp[pos:pos + 1])
+            pos += 1
+        elif b0 < 184:
+            pos += b0 - 127
+            if pos > end:
+                raise DecodingError('RLP item exceeds its enclosing data',
+                                    rlp)
+            o.append(rlp[pos + 128 - b0:pos])
+        else:
+            item, pos = _decode_item(rlp, pos, end)
+            o.append(item)
+    return o, end
 
 
 def consume_length_prefix(rlp, start):
@@ -65,16 +111,94 @@ def consume_length_prefix(rlp, start):
         return (str, b0 - 128, start + 1)
     elif b0 < 192:  # long string
         ll = b0 - 128 - 56 + 1
-        l = big_endian_to_int(rlp[start + 1:start + 1 + ll])
+        l = big_endian_to_int(bytes(rlp[start + 1:start + 1 + ll]))
         return (str, l, start + 1 + ll)
     elif b0 < 192 + 56:  # short list
         return (list, b0 - 192, start + 1)
     else:  # long list
         ll = b0 - 192 - 56 + 1
-        l = big_endian_to_int(rlp[start + 1:start + 1 + ll])
+        l = big_endian_to_int(bytes(rlp[start + 1:start + 1 + ll]))
         return (list, l, start + 1 + ll)
 
 
+class RLPListView(object):
+    """A lazily decoded RLP list
+
+    Only the offsets of the direct items are read when the view is created.
+    Strings are copied out of the underlying buffer when accessed, and nested
+    lists are returned as views sharing the same buffer.
+    """
+    __slots__ = ('data', 'items')
+
+    def __init__(self, data, start, end):
+        self.data = data
+        self.items = []
+        pos = start
+        while pos < end:
+            typ, length, item_start = consume_length_prefix(data, pos)
+            pos = item_start + length
+            if pos > end:
+                raise DecodingError('RLP item exceeds its enclosing data',
+                                    data.tobytes())
+            self.items.append((typ, item_start, pos))
+
+    def _item(self, typ, start, end):
+        if typ is str:
+            return self.data[start:end].tobytes()
+        return RLPListView(self.data, start, end)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._item(*x) for x in self.items[i]]
+        return self._item(*self.items[i])
+
+    def __iter__(self):
+        for x in self.items:
+            yield self._item(*x)
+
+    def tolist(self):
+        """Fully decode the list"""
+        o = []
+        for typ, start, end in self.items:
+            if typ is str:
+                o.append(self.data[start:end].tobytes())
+            else:
+                o.append(RLPListView(self.data, start, end).tolist())
+        return o
+
+    def __eq__(self, other):
+        if isinstance(other, RLPListView):
+            other = other.tolist()
+        return self.tolist() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'RLPListView(%r)' % self.tolist()
+
+
+def decode_lazy(rlp):
+    """RLP decode bytes without decoding nested lists up front
+
+    :returns: bytes for an encoded string, an :class:`RLPListView` for an
+              encoded list
+    """
+    data = memoryview(rlp)
+    if not len(data):
+        raise DecodingError('RLP string must not be empty', rlp)
+    typ, length, start = consume_length_prefix(data, 0)
+    if start + length != len(data):
+        raise DecodingError('RLP string length does not match its prefix',
+                            rlp)
+    if typ is str:
+        return data[start:].tobytes()
+    return RLPListView(data, start, start + length)
+
+
 def optimized_decode_single(x, pos):
     z = safe_ord(x[pos])
     if z < 128:
@@ -96,42 +220,58 @@ def optimized_decode_list(rlp):
     return o
 
 
-#
-if sys.version_info.major == 2:
-    encode_optimized = _encode_optimized
-    decode_optimized = _decode_optimized
-else:
-    encode_optimized = rlp.codec.encode_raw
-    # rlp does not implement a decode_raw function.
-    # decode_optimized = rlp.codec.decode_raw
-    decode_optimized = _decode_optimized
+encode_optimized = _encode_optimized
+decode_optimized = _decode_optimized
 
 
 def main():
-    import trie
+    """Compare the fast codec with pyrlp on trie nodes, blocks and txs"""
     import time
+    from ethereum import db, trie, utils
+    from ethereum.block import Block, BlockHeader
+    from ethereum.transactions import Transaction
+
+    def bench(name, fn, items, rounds=3):
+        best = None
+        for _ in range(rounds):
+            st = time.time()
+            for x in items:
+                fn(x)
+            elapsed = time.time() - st
+            best = elapsed if best is None else min(best, elapsed)
+        print('%-40s %8.1f us/item' % (name, best * 1e6 / len(items)))
+
+    t = trie.Trie(db.EphemDB())
+    for i in range(10000):
+        t.update(utils.sha3(to_string(i)), to_string(i**3))
+    encoded_nodes = list(t.db.db.values())
+    nodes = [rlp.decode(x) for x in encoded_nodes]
+
+    key = utils.sha3(b'benchmark')
+    txs = [Transaction(i, 20 * 10**9, 21000, b'\x35' * 20, 10**18, b'')
+           .sign(key) for i in range(200)]
+    encoded_txs = [rlp.encode(tx) for tx in txs]
+    encoded_block = rlp.encode(Block(BlockHeader(), transactions=txs))
+
+    assert all(_decode_optimized(x) == rlp.decode(x) for x in encoded_nodes)
+    assert all(_encode_optimized(x) == rlp.encode(x) for x in nodes)
+    assert decode_lazy(encoded_block) == rlp.decode(encoded_block)
 
-    def run():
-        st = time.time()
-        x = trie.Trie(db.EphemDB())
-        for i in range(10000):
-            x.update(to_string(i), to_string(i**3))
-        print('elapsed', time.time() - st)
-        return x.root_hash
-
-    trie.rlp_encode = _encode_optimized
-    print('trie.rlp_encode = encode_optimized')
-    r3 = run()
-
-    trie.rlp_encode = rlp.codec.encode_raw
-    print('trie.rlp_encode = rlp.codec.encode_raw')
-    r2 = run()
-    assert r2 == r3
-
-    trie.rlp_encode = rlp.encode
-    print('trie.rlp_encode = rlp.encode')
-    r = run()
-    assert r == r2
+    bench('trie node encode: pyrlp encode', rlp.encode, nodes)
+    bench('trie node encode: encode_raw', rlp.codec.encode_raw, nodes)
+    bench('trie node encode: _encode_optimized', _encode_optimized, nodes)
+    bench('trie node decode: pyrlp decode', rlp.decode, encoded_nodes)
+    bench('trie node decode: _decode_optimized', _decode_optimized,
+          encoded_nodes)
+    bench('tx decode: pyrlp decode', rlp.decode, encoded_txs)
+    bench('tx decode: pyrlp decode (sedes)',
+          lambda x: rlp.decode(x, Transaction), encoded_txs)
+    bench('tx decode: _decode_optimized', _decode_optimized, encoded_txs)
+    bench('block decode: pyrlp decode', rlp.decode, [encoded_block], 20)
+    bench('block decode: _decode_optimized', _decode_optimized,
+          [encoded_block], 20)
+    bench('block decode: decode_lazy, header only',
+          lambda x: decode_lazy(x)[0], [encoded_block], 20)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,238 @@
+from ethereum import utils
+from ethereum.fast_rlp import decode_optimized
+from ethereum.securetrie import SecureTrie
+from ethereum.slogging import get_logger
+from ethereum.trie import Trie, BLANK_NODE, BLANK_ROOT
+
+log = get_logger('eth.flat_state')
+
+# Database keys of the flat tables
+FLAT_ROOT_KEY = b'flat:root'
+ACCOUNT_PREFIX = b'address:'
+STORAGE_PREFIX = b'storage:'
+
+
+class DiffLayer(object):
+    """Account and storage changes leading from one state root to another
+
+    :ivar accounts: RLP encoded account by address, BLANK_NODE if deleted
+    :ivar storage: RLP encoded value by 32 byte key, by address, BLANK_NODE
+        if cleared
+    :ivar wiped: addresses whose whole storage was cleared before the
+        changes in `storage` were made
+    """
+
+    def __init__(self, parent_root):
+        self.parent_root = parent_root
+        self.root = parent_root
+        self.accounts = {}
+        self.storage = {}
+        self.wiped = set()
+
+    def set_account(self, address, rlpdata):
+        self.accounts[address] = rlpdata
+
+    def wipe_storage(self, address):
+        self.storage.pop(address, None)
+        self.wiped.add(address)
+
+    def set_storage(self, address, key, rlpdata):
+        if address not in self.storage:
+            self.storage[address] = {}
+        self.storage[address][key] = rlpdata
+
+    def get_account(self, address):
+        """RLP encoded account, None if the layer does not change it"""
+        return self.accounts.get(address)
+
+    def get_storage(self, address, key):
+        """RLP encoded storage value, None if the layer does not change it"""
+        if address in self.storage and key in self.storage[address]:
+            return self.storage[address][key]
+        if address in self.wiped:
+            return BLANK_NODE
+        return None
+
+    def copy(self):
+        o = DiffLayer(self.parent_root)
+        o.root = self.root
+        o.accounts = dict(self.accounts)
+        o.storage = {address: dict(items)
+                     for address, items in self.storage.items()}
+        o.wiped = set(self.wiped)
+        return o
+
+
+class FlatState(object):
+    """Flat account and storage tables of recent states
+
+    A disk layer holds the accounts and storage of one state, keyed by
+    address (and storage key), in the main database. On top of it sit the
+    in-memory diff layers of the most recent blocks, each keyed by the state
+    root it leads to. A read at any root reachable from the disk layer is a
+    handful of dictionary lookups and at most one database read; for other
+    roots the getters return None and callers read the trie instead.
+
+    As layers are keyed by root rather than by height, the layers of
+    competing branches live side by side and a reorg needs no rewriting.
+    Once there are more than `max_layers` layers below the head, the oldest
+    one is written to the disk layer and layers of abandoned branches are
+    dropped.
+    """
+
+    def __init__(self, db, trie_db, max_layers):
+        self.db = db
+        self.trie_db = trie_db
+        self.max_layers = max_layers
+        self.layers = {}
+        self.disk_root = db.get(FLAT_ROOT_KEY) \
+            if FLAT_ROOT_KEY in db else None
+
+    def knows(self, root):
+        return root == self.disk_root or root in self.layers
+
+    def get_account(self, root, address):
+        """RLP encoded account at state root, None if root is unknown"""
+        layer = self.layers.get(root)
+        while layer is not None:
+            rlpdata = layer.get_account(address)
+            if rlpdata is not None:
+                return rlpdata
+            root = layer.parent_root
+            layer = self.layers.get(root)
+        if root != self.disk_root:
+            return None
+        try:
+            return self.db.get(ACCOUNT_PREFIX + address)
+        except KeyError:
+            return BLANK_NODE
+
+    def get_storage(self, root, address, key):
+        """RLP encoded storage value at state root, None if root is unknown
+
+        :param key: the 32 byte storage key
+        """
+        layer = self.layers.get(root)
+        while layer is not None:
+            rlpdata = layer.get_storage(address, key)
+            if rlpdata is not None:
+                return rlpdata
+            root = layer.parent_root
+            layer = self.layers.get(root)
+        if root != self.disk_root:
+            return None
+        try:
+            return self.db.get(STORAGE_PREFIX + address + key)
+        except KeyError:
+            return BLANK_NODE
+
+    def add_layer(self, layer):
+        """add the changes of a block, made on top of a known root"""
+        if layer is None or layer.root == layer.parent_root or \
+                layer.root in self.layers or not self.knows(layer.parent_root):
+            return
+        self.layers[layer.root] = layer
+
+    def cap(self, head_root):
+        """flatten the layers more than `max_layers` below the head"""
+        chain = []
+        root = head_root
+        while root in self.layers:
+            chain.append(self.layers[root])
+            root = self.layers[root].parent_root
+        if root != self.disk_root or len(chain) <= self.max_layers:
+            return
+        with self.db.write_batch():
+            for layer in reversed(chain[self.max_layers:]):
+                self._write_layer(layer)
+                del self.layers[layer.root]
+            self.db.put(FLAT_ROOT_KEY, self.disk_root)
+        # Drop the layers which no longer lead to the disk layer
+        live = {}
+        for layer in chain[:self.max_layers]:
+            live[layer.root] = layer
+        for root, layer in self.layers.items():
+            path = []
+            while root in self.layers and root not in live:
+                path.append(root)
+                root = self.layers[root].parent_root
+            if root in live or root == self.disk_root:
+                for r in path:
+                    live[r] = self.layers[r]
+        log.debug('flattened layers', disk_root=utils.encode_hex(
+            self.disk_root), dropped=len(self.layers) - len(live))
+        self.layers = live
+
+    def _write_layer(self, layer):
+        assert layer.parent_root == self.disk_root
+        for address in layer.wiped:
+            for key in self._disk_storage_keys(address):
+                self._delete(STORAGE_PREFIX + address + key)
+        for address, rlpdata in layer.accounts.items():
+            if rlpdata == BLANK_NODE:
+                self._delete(ACCOUNT_PREFIX + address)
+            else:
+                self.db.put(ACCOUNT_PREFIX + address, rlpdata)
+        for address, items in layer.storage.items():
+            for key, rlpdata in items.items():
+                if rlpdata != BLANK_NODE:
+                    self.db.put(STORAGE_PREFIX + address + key, rlpdata)
+                else:
+                    self._delete(STORAGE_PREFIX + address + key)
+        self.disk_root = layer.root
+
+    def _disk_storage_keys(self, address):
+        """the storage keys of an account in the disk layer"""
+        try:
+            rlpdata = self.db.get(ACCOUNT_PREFIX + address)
+        except KeyError:
+            return []
+        return [key for key, _ in self._trie_storage(rlpdata)]
+
+    def generate(self, root):
+        """build the disk layer from the state trie with the given root
+
+        If the flat tables hold another state, e.g. after a restart dropped
+        the diff layers, the entries of that state are deleted first. This
+        needs the trie nodes of the old disk layer; without them the tables
+        are left alone and reads keep going to the trie.
+        """
+        if self.knows(root):
+            return
+        try:
+            with self.db.write_batch():
+                if self.disk_root is not None:
+                    self._clear()
+                state = SecureTrie(Trie(self.trie_db, root))
+                for address, rlpdata in state.iter_range():
+                    self.db.put(ACCOUNT_PREFIX + address, rlpdata)
+                    for key, value in self._trie_storage(rlpdata):
+                        self.db.put(STORAGE_PREFIX + address + key, value)
+                self.db.put(FLAT_ROOT_KEY, root)
+        except KeyError:
+            log.warn('flat state does not match the head state and cannot '
+                     'be rebuilt, reading the trie instead',
+                     disk_root=utils.encode_hex(self.disk_root))
+            return
+        self.disk_root = root
+        self.layers = {}
+        log.debug('generated flat state', root=utils.encode_hex(root))
+
+    def _clear(self):
+        """delete the entries of the disk layer"""
+        state = SecureTrie(Trie(self.trie_db, self.disk_root))
+        for address, rlpdata in state.iter_range():
+            self._delete(ACCOUNT_PREFIX + address)
+            for key, _ in self._trie_storage(rlpdata):
+                self._delete(STORAGE_PREFIX + address + key)
+
+    def _delete(self, key):
+        if key in self.db:
+            self.db.delete(key)
+
+    def _trie_storage(self, rlpdata):
+        """the storage items of an RLP encoded account, from its trie"""
+        storage_root = decode_optimized(rlpdata)[2]
+        if storage_root == BLANK_ROOT:
+            return iter(())
+        return SecureTrie(Trie(self.trie_db, storage_root)).iter_range()
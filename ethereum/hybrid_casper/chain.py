@@ -19,7 +19,8 @@ from ethereum.exceptions import InvalidTransaction, VerificationFailed
 from ethereum.slogging import get_logger
 from ethereum.config import Env
 from ethereum.state import State, dict_to_prev_header
-from ethereum.block import Block, BlockHeader, BLANK_UNCLES_HASH
+from ethereum.block import Block, BlockHeader, BLANK_UNCLES_HASH, \
+    decode_header_and_uncles
 from ethereum.pow.consensus import initialize
 from ethereum.genesis_helpers import mk_basic_state, state_from_genesis_declaration, initialize_genesis_keys
 
@@ -240,7 +241,7 @@ class Chain(object):
             return False
         # Check that the block doesn't throw an exception
         if block.header.prevhash == self.head_hash:
-            temp_state = self.state.ephemeral_clone()
+            temp_state = self.state.fork()
         else:
             temp_state = self.mk_poststate_of_blockhash(block.header.prevhash)
         try:
@@ -292,7 +293,7 @@ class Chain(object):
             self.db.put(b'cp_subtree_score' + block.hash, 0)
         # Store the state root
         if block.header.prevhash == self.head_hash:
-            temp_state = self.state.ephemeral_clone()
+            temp_state = self.state.fork()
         else:
             temp_state = self.mk_poststate_of_blockhash(block.header.prevhash)
         apply_block(temp_state, block)
@@ -442,20 +443,22 @@ class Chain(object):
         state.txindex = len(block.transactions)
         state.recent_uncles = {}
         state.prev_headers = []
-        b = block
+        header, uncles = block.header, block.uncles
         header_depth = state.config['PREV_HEADER_DEPTH']
         for i in range(header_depth + 1):
-            state.prev_headers.append(b.header)
+            state.prev_headers.append(header)
             if i < 6:
                 state.recent_uncles[state.block_number - i] = []
-                for u in b.uncles:
+                for u in uncles:
                     state.recent_uncles[state.block_number - i].append(u.hash)
+            # Only the headers and uncles of the ancestors are needed
             try:
-                b = rlp.decode(state.db.get(b.header.prevhash), Block)
+                header, uncles = decode_header_and_uncles(
+                    state.db.get(header.prevhash))
             except:
                 break
         if i < header_depth:
-            if state.db.get(b.header.prevhash) == b'GENESIS':
+            if state.db.get(header.prevhash) == b'GENESIS':
                 jsondata = json.loads(state.db.get(b'GENESIS_STATE'))
                 for h in jsondata["prev_headers"][:header_depth - i]:
                     state.prev_headers.append(dict_to_prev_header(h))
@@ -76,7 +76,7 @@ class Validator(object):
             casper.get_validators__prev_commit_epoch(validator_index)
 
     def get_validator_index(self, state):
-        t = tester.State(state.ephemeral_clone())
+        t = tester.State(state.fork())
         t.state.gas_limit = 9999999999
         casper = tester.ABIContract(t, casper_utils.casper_abi, self.chain.casper_address)
         if self.valcode_addr is None:
@@ -202,7 +202,7 @@ class Validator(object):
             valcode_addr = utils.mk_contract_address(self.coinbase, self.nonce-1)
             deposit_tx = self.mk_deposit_tx(3 * 10**18, valcode_addr)
             # Verify the transactions pass
-            temp_state = self.chain.state.ephemeral_clone()
+            temp_state = self.chain.state.fork()
             valcode_success, o1 = apply_transaction(temp_state, valcode_tx)
             deposit_success, o2 = apply_transaction(temp_state, deposit_tx)
             if not (valcode_success and deposit_success):
@@ -223,7 +223,7 @@ class Validator(object):
         # Generate transactions
         logout_tx = self.mk_logout(logout_msg)
         # Verify the transactions pass
-        temp_state = self.chain.state.ephemeral_clone()
+        temp_state = self.chain.state.fork()
         logout_success, o1 = apply_transaction(temp_state, logout_tx)
         if not logout_success:
             self.nonce = self.chain.state.get_nonce(self.coinbase)
@@ -0,0 +1,210 @@
+"""EVM interpreter compiling hot code to Python
+
+Code starts out run by `ethereum.fastvm`. Once code with the same hash has
+been executed HOT_RUNS times, each of its basic blocks is turned into the
+source of a Python function, and those are compiled and kept in the code
+cache in place of the analysis counting the runs. Code is never compiled
+without a code cache, as there are no runs to count.
+
+In a compiled block, stack items are held in local variables and only
+written back to the stack when an instruction not compiled inline needs
+them, or at the end of the block. Push values are inlined and arithmetic
+on them is folded. Jumps to a constant destination are checked when
+compiling; blocks are still entered through fastvm's loop, which checks
+their gas and stack bounds and finds them by position.
+"""
+from ethereum import fastvm, vm
+from ethereum.code_cache import register_analysis
+from ethereum.utils import safe_ord
+from ethereum.vm import OP_FEES, OP_HANDLERS, OP_NAMES, TT256M1, \
+    get_analysis, log_vm_op, preprocess_code, vm_exception
+
+# Runs of a piece of code before it is compiled
+HOT_RUNS = 8
+
+# Instructions compiled inline, as expressions of the top stack items
+EXPRESSIONS = {
+    'ADD': '({0} + {1}) & TT256M1',
+    'MUL': '({0} * {1}) & TT256M1',
+    'SUB': '({0} - {1}) & TT256M1',
+    'DIV': '0 if {1} == 0 else {0} // {1}',
+    'MOD': '0 if {1} == 0 else {0} % {1}',
+    'LT': '1 if {0} < {1} else 0',
+    'GT': '1 if {0} > {1} else 0',
+    'EQ': '1 if {0} == {1} else 0',
+    'ISZERO': '0 if {0} else 1',
+    'AND': '{0} & {1}',
+    'OR': '{0} | {1}',
+    'XOR': '{0} ^ {1}',
+    'NOT': 'TT256M1 - {0}',
+    'BYTE': '0 if {0} >= 32 else ({1} // 256 ** (31 - {0})) % 256',
+}
+
+
+class HotCode(object):
+    """runs of a piece of code, and its blocks once compiled"""
+    __slots__ = ('runs', 'blocks')
+
+    def __init__(self, code):
+        self.runs = 0
+        self.blocks = None
+
+
+# Compiled code objects and their constants, once hot
+register_analysis(b'jit', HotCode, lambda code, hot: 4096 + 200 * len(code))
+
+
+class _BlockWriter(object):
+    """writes the source of the function running one block"""
+
+    def __init__(self, name, jumpdests):
+        self.lines = ['def %s(c, stk):' % name]
+        self.jumpdests = jumpdests
+        # Items above the part of stk left, as constants or local names
+        self.items = []
+        self.locals = 0
+
+    def emit(self, line, indent=1):
+        self.lines.append('    ' * indent + line)
+
+    def local(self, expr):
+        name = 's%d' % self.locals
+        self.locals += 1
+        self.emit('%s = %s' % (name, expr))
+        return name
+
+    def reach(self, n):
+        """makes the top n items locals or constants"""
+        while len(self.items) < n:
+            self.items.insert(0, self.local('stk.pop()'))
+
+    def take(self, n):
+        """the top n items, top first"""
+        self.reach(n)
+        taken = self.items[-n:][::-1]
+        del self.items[-n:]
+        return taken
+
+    def flush(self):
+        """writes the items back to stk"""
+        if len(self.items) == 1:
+            self.emit('stk.append(%s)' % self.items[0])
+        elif self.items:
+            self.emit('stk.extend((%s))' % ', '.join(map(str, self.items)))
+        self.items = []
+
+    def jump(self, dest, indent=1):
+        if isinstance(dest, str):
+            self.emit('c.pc = %s' % dest, indent)
+            self.emit('if %s not in JUMPDESTS:' % dest, indent)
+            self.emit("return vm_exception('BAD JUMPDEST')", indent + 1)
+        else:
+            self.emit('c.pc = %d' % dest, indent)
+            if dest not in self.jumpdests:
+                self.emit("return vm_exception('BAD JUMPDEST')", indent)
+
+
+def _block_source(name, code, start, end, pushcache, jumpdests):
+    w = _BlockWriter(name, jumpdests)
+    positions = []
+    pc = start
+    while pc < end:
+        positions.append(pc)
+        opcode = safe_ord(code[pc])
+        pc += opcode - 0x5e if 0x60 <= opcode <= 0x7f else 1
+    for i, pc in enumerate(positions):
+        opcode = safe_ord(code[pc])
+        op = OP_NAMES[opcode]
+        last = i == len(positions) - 1
+        if op is None:
+            w.flush()
+            w.emit("return vm_exception('INVALID OP')")
+        elif op.startswith('PUSH'):
+            w.items.append(pushcache[pc])
+        elif op.startswith('DUP'):
+            n = int(op[3:])
+            w.reach(n)
+            w.items.append(w.items[-n])
+        elif op.startswith('SWAP'):
+            n = int(op[4:])
+            w.reach(n + 1)
+            w.items[-1], w.items[-n - 1] = w.items[-n - 1], w.items[-1]
+        elif op == 'POP':
+            if w.items:
+                w.items.pop()
+            else:
+                w.emit('stk.pop()')
+        elif op == 'JUMPDEST':
+            pass
+        elif op == 'PC':
+            w.items.append(pc)
+        elif op == 'GAS':
+            # Before the base fees of the rest of the block would be paid
+            unpaid = sum(OP_FEES[safe_ord(code[p])]
+                         for p in positions[i + 1:])
+            w.items.append(w.local('c.gas + %d' % unpaid))
+        elif op in EXPRESSIONS:
+            args = w.take(2 if '{1}' in EXPRESSIONS[op] else 1)
+            expr = EXPRESSIONS[op].format(*args)
+            if all(isinstance(a, int) for a in args):
+                w.items.append(eval(expr, {'TT256M1': TT256M1}))
+            else:
+                w.items.append(w.local(expr))
+        elif op == 'JUMP':
+            dest, = w.take(1)
+            w.flush()
+            w.jump(dest)
+        elif op == 'JUMPI':
+            dest, cond = w.take(2)
+            w.flush()
+            if isinstance(cond, str):
+                w.emit('if %s:' % cond)
+                w.jump(dest, 2)
+            elif cond:
+                w.jump(dest)
+        else:
+            w.flush()
+            if last:
+                w.emit('return op_%s(c, stk)' % op)
+            else:
+                w.emit('result = op_%s(c, stk)' % op)
+                w.emit('if result is not None:')
+                w.emit('return result', 2)
+    w.flush()
+    if len(w.lines) == 1:
+        w.emit('pass')
+    return '\n'.join(w.lines)
+
+
+def compile_code(code):
+    """the basic blocks of code, each running a generated function"""
+    jumpdest_mask, pushcache = preprocess_code(code)
+    jumpdests = frozenset(
+        pc for pc in range(len(code)) if (1 << pc) & jumpdest_mask)
+    blocks = fastvm.compile_code(code, fuse=False)
+    namespace = dict(('op_' + name, handler) for name, handler in
+                     zip(OP_NAMES, OP_HANDLERS) if name is not None)
+    namespace.update(TT256M1=TT256M1, JUMPDESTS=jumpdests,
+                     vm_exception=vm_exception)
+    source = '\n\n'.join(
+        _block_source('block_%d' % start, code, start, block.end,
+                      pushcache, jumpdests)
+        for start, block in sorted(blocks.items()))
+    exec(compile(source, '<evm code>', 'exec'), namespace)
+    for start, block in blocks.items():
+        block.ops = [namespace['block_%d' % start]]
+    return blocks
+
+
+def vm_execute(ext, msg, code):
+    # Traces are made per instruction
+    if log_vm_op.is_active('trace'):
+        return vm.vm_execute(ext, msg, code)
+
+    hot = get_analysis(ext, msg, code, b'jit')
+    if hot.blocks is None:
+        hot.runs += 1
+        if hot.runs < HOT_RUNS:
+            return fastvm.vm_execute(ext, msg, code)
+        hot.blocks = compile_code(code)
+    return fastvm.run_blocks(ext, msg, code, hot.blocks)
@@ -19,6 +19,7 @@ from ethereum.consensus_strategy import get_consensus_strategy
 from ethereum import vm
 from ethereum.specials import specials as default_specials
 from ethereum.config import Env, default_config
+from ethereum.state import AccessSet
 from ethereum.db import BaseDB, EphemDB
 from ethereum.exceptions import InvalidNonce, InsufficientStartGas, UnsignedTransaction, \
     BlockGasLimitReached, InsufficientBalance, VerificationFailed, InvalidTransaction
@@ -181,7 +182,38 @@ def apply_message(state, msg=None, **kwargs):
     return bytearray_to_bytestr(data) if result else None
 
 
-def apply_transaction(state, tx):
+def apply_transaction(state, tx, record_access=False):
+    """apply a transaction to the state
+
+    :param record_access: also return the accounts, storage slots and code
+        the transaction read and wrote, as an `AccessSet`
+    :returns: (success, output), or (success, output, access)
+    """
+    if not record_access:
+        success, output, gas_used, _ = execute_transaction(state, tx)
+        finish_transaction(state, success, gas_used)
+        return success, output
+    outer = state.access
+    state.access = access = AccessSet()
+    try:
+        success, output, gas_used, _ = execute_transaction(state, tx)
+        finish_transaction(state, success, gas_used)
+    finally:
+        state.access = outer
+        if outer is not None:
+            outer.update(access)
+    return success, output, access
+
+
+def execute_transaction(state, tx, defer_fee=False):
+    """run a transaction, without the block level bookkeeping
+
+    :param defer_fee: leave the fee to the caller unless the transaction
+        accesses the coinbase itself, so that transactions executed on
+        separate states do not all write to the coinbase. Needs the state
+        to record its accesses.
+    :returns: (success, output, gas used, unpaid coinbase fee or None)
+    """
     state.logs = []
     state.suicides = []
     state.refunds = 0
@@ -236,7 +268,6 @@ def apply_transaction(state, tx):
         log_tx.debug('TX FAILED', reason='out of gas',
                      startgas=tx.startgas, gas_remained=gas_remained)
         state.delta_balance(tx.sender, tx.gasprice * gas_remained)
-        state.delta_balance(state.block_coinbase, tx.gasprice * gas_used)
         output = b''
         success = 0
     # Transaction success
@@ -254,14 +285,16 @@ def apply_transaction(state, tx):
             state.refunds = 0
         # sell remaining gas
         state.delta_balance(tx.sender, tx.gasprice * gas_remained)
-        state.delta_balance(state.block_coinbase, tx.gasprice * gas_used)
         if tx.to:
             output = bytearray_to_bytestr(data)
         else:
             output = data
         success = 1
 
-    state.gas_used += gas_used
+    fee = tx.gasprice * gas_used
+    if not defer_fee or state.block_coinbase in state.access.accounts:
+        state.delta_balance(state.block_coinbase, fee)
+        fee = None
 
     # Clear suicides
     suicides = state.suicides
@@ -270,6 +303,13 @@ def apply_transaction(state, tx):
         state.set_balance(s, 0)
         state.del_account(s)
 
+    return success, output, gas_used, fee
+
+
+def finish_transaction(state, success, gas_used):
+    """add the gas used and the receipt of an executed transaction"""
+    state.gas_used += gas_used
+
     # Pre-Metropolis: commit state after every tx
     if not state.is_METROPOLIS() and not SKIP_MEDSTATES:
         state.commit()
@@ -282,8 +322,6 @@ def apply_transaction(state, tx):
     state.set_param('bloom', state.bloom | r.bloom)
     state.set_param('txindex', state.txindex + 1)
 
-    return success, output
-
 
 # VM interface
 class VMExt():
@@ -292,8 +330,12 @@ class VMExt():
         self.specials = {k: v for k, v in default_specials.items()}
         for k, v in state.config['CUSTOM_SPECIALS']:
             self.specials[k] = v
+        self.vm_execute = vm.get_vm_engine(
+            state.config.get('VM_ENGINE', 'vm'))
         self._state = state
         self.get_code = state.get_code
+        self.get_code_hash = state.get_code_hash
+        self.code_cache = state.env.code_cache
         self.set_code = state.set_code
         self.get_balance = state.get_balance
         self.set_balance = state.set_balance
@@ -362,7 +404,7 @@ def _apply_msg(ext, msg, code):
     if msg.code_address in ext.specials:
         res, gas, dat = ext.specials[msg.code_address](ext, msg)
     else:
-        res, gas, dat = vm.vm_execute(ext, msg, code)
+        res, gas, dat = ext.vm_execute(ext, msg, code)
 
     if trace_msg:
         log_msg.debug('MSG APPLIED', gas_remained=gas,
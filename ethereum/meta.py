@@ -6,7 +6,8 @@ from ethereum.common import mk_block_from_prevstate, validate_header, \
     set_execution_results, add_transactions, post_finalize
 from ethereum.consensus_strategy import get_consensus_strategy
 from ethereum.messages import apply_transaction
-from ethereum.state import State
+from ethereum.prefetch import prefetch_block_state, store_prefetched
+from ethereum.speculation import apply_transactions
 from ethereum.utils import sha3, encode_hex
 import rlp
 
@@ -25,8 +26,17 @@ def apply_block(state, block):
         assert cs.validate_uncles(state, block)
         assert validate_transaction_tree(state, block)
         # Process transactions
-        for tx in block.transactions:
-            apply_transaction(state, tx)
+        processes = state.config.get('TX_EXECUTION_PROCESSES', 0)
+        if processes > 1 and len(block.transactions) > 1:
+            apply_transactions(state, block.transactions, processes)
+        else:
+            pending = prefetch_block_state(state, block) \
+                if state.config.get('PREFETCH_STATE') else []
+            for tx in block.transactions:
+                pending = store_prefetched(state, pending)
+                apply_transaction(state, tx)
+            for future in pending:
+                future.cancel()
         # Finalize (incl paying block rewards)
         cs.finalize(state, block)
         # Verify state root, tx list root, receipt root
@@ -49,9 +59,7 @@ def make_head_candidate(chain, txqueue=None,
                         min_gasprice=0):
     log.debug('Creating head candidate')
     if parent is None:
-        temp_state = State.from_snapshot(
-            chain.state.to_snapshot(
-                root_only=True), chain.env)
+        temp_state = chain.state.fork()
     else:
         temp_state = chain.mk_poststate_of_blockhash(parent.hash)
 
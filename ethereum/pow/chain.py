@@ -16,7 +16,8 @@ from ethereum.exceptions import InvalidNonce, InsufficientStartGas, UnsignedTran
 from ethereum.slogging import get_logger, configure_logging
 from ethereum.config import Env
 from ethereum.state import State, dict_to_prev_header
-from ethereum.block import Block, BlockHeader, BLANK_UNCLES_HASH, FakeHeader
+from ethereum.block import Block, BlockHeader, BLANK_UNCLES_HASH, FakeHeader, \
+    decode_header_and_uncles
 from ethereum.pow.consensus import initialize
 from ethereum.genesis_helpers import mk_basic_state, state_from_genesis_declaration, \
     initialize_genesis_keys
@@ -95,6 +96,9 @@ class Chain(object):
             self.genesis = self.get_block_by_number(0)
 
         self.head_hash = self.state.prev_headers[0].hash
+        if self.env.flat_state is not None:
+            self.env.flat_state.generate(self.state.trie.root_hash)
+        self.state.publish_flat_layer()
         self.time_queue = []
         self.parent_queue = {}
         self.localtime = time.time() if localtime is None else localtime
@@ -131,20 +135,22 @@ class Chain(object):
         state.txindex = len(block.transactions)
         state.recent_uncles = {}
         state.prev_headers = []
-        b = block
+        header, uncles = block.header, block.uncles
         header_depth = state.config['PREV_HEADER_DEPTH']
         for i in range(header_depth + 1):
-            state.prev_headers.append(b.header)
+            state.prev_headers.append(header)
             if i < 6:
                 state.recent_uncles[state.block_number - i] = []
-                for u in b.uncles:
+                for u in uncles:
                     state.recent_uncles[state.block_number - i].append(u.hash)
+            # Only the headers and uncles of the ancestors are needed
             try:
-                b = rlp.decode(state.db.get(b.header.prevhash), Block)
+                header, uncles = decode_header_and_uncles(
+                    state.db.get(header.prevhash))
             except BaseException:
                 break
         if i < header_depth:
-            if state.db.get(b.header.prevhash) == b'GENESIS':
+            if state.db.get(header.prevhash) == b'GENESIS':
                 jsondata = json.loads(state.db.get(b'GENESIS_STATE'))
                 for h in jsondata["prev_headers"][:header_depth - i]:
                     state.prev_headers.append(dict_to_prev_header(h))
@@ -291,6 +297,7 @@ class Chain(object):
                             tx.hash, rlp.encode([block.number, i]))
             assert self.get_blockhash_by_number(
                 block.header.number) == block.header.hash
+            self.state.publish_flat_layer()
             deletes = self.state.deletes
             changed = self.state.changed
         # Or is the block being added to a chain that is not currently the
@@ -306,6 +313,7 @@ class Chain(object):
                 log.info('Block %s with parent %s invalid, reason: %s' %
                     (encode_hex(block.header.hash[:4]), encode_hex(block.header.prevhash[:4]), str(e)))
                 return False
+            temp_state.publish_flat_layer()
             deletes = temp_state.deletes
             block_score = self.get_score(block)
             changed = temp_state.changed
@@ -326,11 +334,9 @@ class Chain(object):
                         break
                     b = self.get_parent(b)
                 replace_from = b.header.number
-                # Replace block index and tx indices, and edit the state cache
+                # Replace block index and tx indices; the flat state keeps
+                # the layers of both branches, keyed by state root
 
-                # Get a list of all accounts that have been edited along the old and
-                # new chains
-                changed_accts = {}
                 # Read: for i in range(common ancestor block number...new block
                 # number)
                 for i in itertools.count(replace_from):
@@ -351,11 +357,6 @@ class Chain(object):
                         for tx in orig_block_at_height.transactions:
                             if b'txindex:' + tx.hash in self.db:
                                 self.db.delete(b'txindex:' + tx.hash)
-                        # Add to changed list
-                        acct_list = self.db.get(
-                            b'changed:' + orig_block_at_height.hash)
-                        for j in range(0, len(acct_list), 20):
-                            changed_accts[acct_list[j: j + 20]] = True
                     # Add data for new blocks
                     if i in new_chain:
                         new_block_at_height = new_chain[i]
@@ -370,27 +371,8 @@ class Chain(object):
                                 new_block_at_height.transactions):
                             self.db.put(b'txindex:' + tx.hash,
                                         rlp.encode([new_block_at_height.number, j]))
-                        # Add to changed list
-                        if i < b.number:
-                            acct_list = self.db.get(
-                                b'changed:' + new_block_at_height.hash)
-                            for j in range(0, len(acct_list), 20):
-                                changed_accts[acct_list[j: j + 20]] = True
                     if i not in new_chain and not orig_at_height:
                         break
-                # Add changed list from new head to changed list
-                for c in changed.keys():
-                    changed_accts[c] = True
-                # Update the on-disk state cache
-                for addr in changed_accts.keys():
-                    data = temp_state.trie.get(addr)
-                    if data:
-                        self.state.db.put(b'address:' + addr, data)
-                    else:
-                        try:
-                            self.state.db.delete(b'address:' + addr)
-                        except KeyError:
-                            pass
                 self.head_hash = block.header.hash
                 self.state = temp_state
                 self.state.executing_on_head = True
@@ -403,6 +385,8 @@ class Chain(object):
                      (block.number, encode_hex(block.hash[:4]), encode_hex(block.prevhash[:4])))
             return False
         self.add_child(block)
+        if self.env.flat_state is not None:
+            self.env.flat_state.cap(self.state.trie.root_hash)
         
         self.db.put(b'head_hash', self.head_hash)
 
@@ -12,7 +12,7 @@ def initialize(state, block=None):
     state.txindex = 0
     state.gas_used = 0
     state.bloom = 0
-    state.receipts = []
+    state.reset_receipts()
 
     if block is not None:
         update_block_env_variables(state, block)
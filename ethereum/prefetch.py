@@ -0,0 +1,144 @@
+import rlp
+from ethereum import utils
+from ethereum.code_cache import register_analysis
+from ethereum.db import CachingDB, EphemDB
+from ethereum.exceptions import InvalidTransaction
+from ethereum.fast_rlp import decode_optimized
+from ethereum.slogging import get_logger
+from ethereum.trie import Trie, BLANK_NODE
+from ethereum.utils import safe_ord
+
+log = get_logger('eth.prefetch')
+
+BLANK_HASH = utils.sha3(b'')
+
+SLOAD, SSTORE = 0x54, 0x55
+PUSH1, PUSH32 = 0x60, 0x7f
+
+
+def static_storage_keys(code):
+    """storage keys pushed as constants right before an SLOAD or SSTORE
+
+    These are the fixed slots of a contract, e.g. its balances root or
+    owner; slots of mappings and arrays are hashed at runtime.
+    """
+    keys = set()
+    pushed = None
+    i = 0
+    while i < len(code):
+        op = safe_ord(code[i])
+        if PUSH1 <= op <= PUSH32:
+            width = op - PUSH1 + 1
+            pushed = utils.big_endian_to_int(code[i + 1: i + 1 + width])
+            i += width + 1
+            continue
+        if op in (SLOAD, SSTORE) and pushed is not None:
+            keys.add(pushed)
+        pushed = None
+        i += 1
+    return tuple(sorted(keys))
+
+
+# Kept in the code cache by code hash
+register_analysis(b'slots', static_storage_keys,
+                  lambda code, keys: 64 + 40 * len(keys))
+
+
+def _static_keys(code_cache, code_hash, get_code):
+    if code_cache is None:
+        return static_storage_keys(get_code())
+    return code_cache.get(code_hash, b'slots', get_code)
+
+
+def block_addresses(block):
+    """the accounts the transactions of a block are known to touch"""
+    addresses = [block.header.coinbase]
+    for tx in block.transactions:
+        try:
+            addresses.append(tx.sender)
+        except (InvalidTransaction, AssertionError):
+            # Left for apply_transaction to reject
+            pass
+        if tx.to:
+            addresses.append(tx.to)
+    seen = set()
+    return [a for a in addresses if not (a in seen or seen.add(a))]
+
+
+def prefetch_block_state(state, block):
+    """load the accounts and storage a block will likely read
+
+    With a thread pool (the PREFETCH_THREADS option) and a database that is
+    not in memory, the loads are queued on workers, which read the trie
+    nodes straight from the database, so that disk reads overlap with the
+    execution of earlier transactions. `store_prefetched` puts what they
+    read into the warm state cache. Otherwise the accounts and fixed
+    storage slots are loaded through the state before execution starts.
+
+    :returns: the futures of the queued loads, for `store_prefetched`
+    """
+    addresses = block_addresses(block)
+    env = state.env
+    if env.prefetch_executor is not None and \
+            env.state_cache is not None and \
+            isinstance(env.trie_db, CachingDB) and \
+            not isinstance(env.db, EphemDB):
+        # Bypass the node cache, which is not thread safe
+        node_db = env.trie_db.db
+        root = state.trie.root_hash
+        return [env.prefetch_executor.submit(
+                _load_account, node_db, env.db, env.code_cache, root, a)
+                for a in addresses]
+    for address in addresses:
+        acct = state.get_and_cache_account(address)
+        if acct.code_hash != BLANK_HASH:
+            for key in _static_keys(env.code_cache, acct.code_hash,
+                                    lambda: acct.code):
+                acct.get_storage_data(key)
+    return []
+
+
+def store_prefetched(state, pending):
+    """put the loads done so far into the warm state cache
+
+    Only what was read at the root the cache is at is kept, as a commit
+    since may have changed it.
+
+    :returns: the futures not done yet
+    """
+    warm = state.env.state_cache
+    left = []
+    for future in pending:
+        if not future.done():
+            left.append(future)
+            continue
+        if future.cancelled() or future.exception() is not None:
+            continue
+        root, address, fields, slots = future.result()
+        if fields is not None:
+            warm.put_account(root, address, fields)
+        for key, value in slots:
+            warm.put_storage(root, address, key, value)
+    return left
+
+
+def _load_account(node_db, code_db, code_cache, root, address):
+    """(root, address, account fields or None, [(key, value)] of its fixed
+    storage slots), read from the tries"""
+    rlpdata = Trie(node_db, root).get(utils.sha3(address))
+    if rlpdata == BLANK_NODE:
+        return root, address, None, []
+    # As state.decode_account, which cannot be imported here
+    nonce, balance, storage_root, code_hash = decode_optimized(rlpdata)
+    fields = (utils.big_endian_to_int(nonce),
+              utils.big_endian_to_int(balance), storage_root, code_hash)
+    if code_hash == BLANK_HASH:
+        return root, address, fields, []
+    storage = Trie(node_db, storage_root)
+    slots = []
+    for key in _static_keys(code_cache, code_hash,
+                            lambda: code_db.get(code_hash)):
+        value = storage.get(utils.sha3(utils.encode_int32(key)))
+        slots.append((key, utils.big_endian_to_int(
+            rlp.decode(value) if value else b'')))
+    return root, address, fields, slots
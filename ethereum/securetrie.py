@@ -1,4 +1,5 @@
 from ethereum import utils
+from ethereum.trie import Trie, BLANK_ROOT
 
 
 class SecureTrie(object):
@@ -15,6 +16,17 @@ class SecureTrie(object):
     def get(self, k):
         return self.trie.get(utils.sha3(k))
 
+    def update_all(self, items):
+        """fill an empty trie with (key, value) items in a single pass"""
+        assert self.trie.root_hash == BLANK_ROOT
+        hashed = []
+        for k, v in items:
+            h = utils.sha3(k)
+            self.db.put(h, utils.str_to_bytes(k))
+            hashed.append((h, v))
+        hashed.sort()
+        self.trie.root_hash = Trie.from_sorted_items(self.db, hashed).root_hash
+
     def delete(self, k):
         self.trie.delete(utils.sha3(k))
 
@@ -30,9 +42,28 @@ class SecureTrie(object):
             k = self.db.get(h)
             yield (k, v)
 
+    def iter_range(self, start=b'', end=None, limit=None):
+        """like `Trie.iter_range`, bounds are hashed keys"""
+        for h, v in self.trie.iter_range(start, end, limit):
+            yield (self.db.get(h), v)
+
+    def get_range(self, start=b'', end=None, limit=None, token=None):
+        items, token = self.trie.get_range(start, end, limit, token)
+        return [(self.db.get(h), v) for h, v in items], token
+
     def root_hash_valid(self):
         return self.trie.root_hash_valid()
 
+    def get_proof(self, k):
+        """proof for k, to be checked against the hashed key"""
+        return self.trie.get_proof(utils.sha3(k))
+
+    def get_multiproof(self, keys):
+        return self.trie.get_multiproof([utils.sha3(k) for k in keys])
+
+    def commit(self):
+        self.trie.commit()
+
     @property
     def root_hash(self):
         return self.trie.root_hash
@@ -3,7 +3,7 @@ from ethereum.block import BlockHeader, Block
 from ethereum.utils import is_numeric, is_string, encode_hex, decode_hex, zpad, scan_bin, big_endian_to_int
 from ethereum import common
 from ethereum.pow import consensus
-from ethereum.state import State, Account
+from ethereum.state import State, Account, decode_account
 from ethereum.securetrie import SecureTrie
 from ethereum.trie import BLANK_NODE, BLANK_ROOT
 from ethereum.experimental.pruning_trie import Trie
@@ -62,7 +62,7 @@ def create_state_snapshot(chain, block):
     state = State(block.state_root, env)
     alloc = dict()
     count = 0
-    for addr, account_rlp in state.trie.iter_branch():
+    for addr, account_rlp in state.trie.iter_range():
         alloc[encode_hex(addr)] = create_account_snapshot(env, account_rlp)
         count += 1
         print("[%d] created account snapshot %s" % (count, encode_hex(addr)))
@@ -179,9 +179,11 @@ def load_state(env, alloc):
 
 def get_account(env, rlpdata):
     if rlpdata != BLANK_NODE:
-        return rlp.decode(rlpdata, Account, env=env)
+        nonce, balance, storage, code_hash = decode_account(rlpdata)
+        return Account(nonce, balance, storage, code_hash, env, None)
     else:
-        return Account.blank_account(env, env.config['ACCOUNT_INITIAL_NONCE'])
+        return Account.blank_account(
+            env, None, env.config['ACCOUNT_INITIAL_NONCE'])
 
 
 def snapshot_form(val):
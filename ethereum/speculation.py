@@ -0,0 +1,183 @@
+import collections
+import os
+import pickle
+import signal
+
+from ethereum.messages import Log, apply_transaction, execute_transaction, \
+    finish_transaction, validate_transaction
+from ethereum.slogging import get_logger
+from ethereum.state import AccessSet
+
+log = get_logger('eth.speculation')
+
+# What a transaction did to a fork of the state the block started from.
+# accounts maps written addresses to (nonce, balance, code hash, deleted,
+# storage reset, touched); touched lists accounts that were only touched;
+# slots are (address, key, value) and code maps new code hashes to code.
+Speculation = collections.namedtuple('Speculation', [
+    'success', 'output', 'gas_used', 'fee', 'logs', 'read_accounts',
+    'read_slots', 'accounts', 'touched', 'slots', 'code'])
+
+
+def apply_transactions(state, transactions, processes):
+    """apply the transactions of a block, executing them speculatively
+
+    Worker processes run every transaction on its own fork of the state as
+    it is before the first one, recording what each reads and writes. The
+    results are applied to the state in block order as they come in. A
+    transaction that read an account or storage slot written by an earlier
+    transaction in the block is executed again on the state instead, so
+    the outcome is the same as applying the transactions one after the
+    other.
+
+    Coinbase fees are paid when the results are applied; a transaction
+    that accesses the coinbase otherwise is executed again if any earlier
+    transaction paid a fee.
+    """
+    if not hasattr(os, 'fork'):
+        for tx in transactions:
+            apply_transaction(state, tx)
+        return
+    # The workers are forked for each block, as that is how they get the
+    # state as it is in memory, uncommitted changes and all; a long-lived
+    # pool would have to be sent the trie nodes written since it started.
+    # Starting and stopping two forked workers takes about 3 ms, a
+    # multiprocessing.Pool over 100 ms (tools/speculation_benchmark)
+    processes = min(processes, len(transactions))
+    workers = []
+    try:
+        for first in range(processes):
+            workers.append(
+                _fork_worker(state, transactions, first, processes))
+        results = _results(workers, len(transactions))
+        written_accounts, written_slots = set(), set()
+        reexecuted = 0
+        for tx, result in zip(transactions, results):
+            if result is None or \
+                    not result.read_accounts.isdisjoint(written_accounts) or \
+                    not result.read_slots.isdisjoint(written_slots):
+                reexecuted += 1
+                _, _, access = apply_transaction(
+                    state, tx, record_access=True)
+                written_accounts |= access.written_accounts
+                written_slots |= access.written_slots
+            else:
+                # Only the block gas limit can fail here, the sender was
+                # not written by earlier transactions
+                validate_transaction(state, tx)
+                _apply_speculation(state, result)
+                written_accounts.update(result.accounts)
+                written_slots.update((a, k) for a, k, _ in result.slots)
+                if result.fee is not None:
+                    written_accounts.add(state.block_coinbase)
+                finish_transaction(state, result.success, result.gas_used)
+        log.debug('applied speculatively', txs=len(transactions),
+                  reexecuted=reexecuted)
+    finally:
+        for pid, stream in workers:
+            stream.close()
+            # Still running if a result was not needed
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+
+def _fork_worker(state, transactions, first, step):
+    """fork a process speculating every step-th transaction from first
+
+    :returns: the process id, and the stream its results are read from
+    """
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read)
+            stream = os.fdopen(write, 'wb')
+            # The pools of the parent have no threads or processes here
+            state.env.trie_executor = state.env.prefetch_executor = None
+            for index in range(first, len(transactions), step):
+                try:
+                    result = _speculate(state, transactions[index])
+                except Exception:
+                    result = None
+                pickle.dump(result, stream, pickle.HIGHEST_PROTOCOL)
+                stream.flush()
+        finally:
+            os._exit(0)
+    os.close(write)
+    return pid, os.fdopen(read, 'rb')
+
+
+def _results(workers, count):
+    """the results of the workers in transaction order"""
+    for index in range(count):
+        try:
+            yield pickle.load(workers[index % len(workers)][1])
+        except (EOFError, pickle.UnpicklingError):
+            # The worker died, the transaction is executed again
+            yield None
+
+
+def _speculate(base, tx):
+    state = base.fork()
+    state.access = AccessSet()
+    try:
+        success, output, gas_used, fee = execute_transaction(
+            state, tx, defer_fee=True)
+    except Exception:
+        # Executed again on the state, to fail there if it still does
+        return None
+    access = state.access
+    accounts, touched, slots, code = {}, [], [], {}
+    for address in access.written_accounts:
+        acct = state.cache[address]
+        before = base.get_and_cache_account(address)
+        reset = acct.storage_reset and not before.storage_reset
+        fields = (acct.nonce, acct.balance, acct.code_hash, acct.deleted)
+        # Touching a blank account decides whether it exists
+        if reset or fields != (before.nonce, before.balance,
+                               before.code_hash, before.deleted) or \
+                (acct.touched != before.touched and acct.is_blank()):
+            accounts[address] = fields + (reset, acct.touched)
+            if acct.code_hash != before.code_hash:
+                code[acct.code_hash] = state.db.get(acct.code_hash)
+        elif acct.touched:
+            touched.append(address)
+    for address, key in access.written_slots:
+        acct = state.cache[address]
+        if key not in acct.storage_cache:
+            # Cleared by a storage reset
+            continue
+        value = acct.storage_cache[key]
+        if address in accounts and accounts[address][4] or \
+                value != base.get_storage_data(address, key):
+            slots.append((address, key, value))
+    return Speculation(
+        success, output, gas_used, fee,
+        [(l.address, l.topics, l.data) for l in state.logs],
+        access.accounts, access.slots, accounts, touched, slots, code)
+
+
+def _apply_speculation(state, result):
+    for address, fields in result.accounts.items():
+        if fields[4]:
+            state.reset_storage(address)
+    for address, key, value in result.slots:
+        state.set_storage_data(address, key, value)
+    for code_hash, code in result.code.items():
+        state.db.put(code_hash, code)
+    for address, fields in result.accounts.items():
+        acct = state.get_mutable_account(address)
+        nonce, balance, code_hash, deleted, _, touched = fields
+        state.set_and_journal(acct, 'nonce', nonce)
+        state.set_and_journal(acct, 'balance', balance)
+        state.set_and_journal(acct, 'code_hash', code_hash)
+        state.set_and_journal(acct, 'deleted', deleted)
+        state.set_and_journal(acct, 'touched', touched)
+    for address in result.touched:
+        state.set_and_journal(
+            state.get_mutable_account(address), 'touched', True)
+    state.logs = []
+    for address, topics, data in result.logs:
+        state.add_log(Log(address, topics, data))
+    if result.fee is not None:
+        state.delta_balance(state.block_coinbase, result.fee)
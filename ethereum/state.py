@@ -2,7 +2,7 @@ import rlp
 from ethereum.utils import normalize_address, hash32, trie_root, \
     big_endian_int, address, int256, encode_hex, encode_int, \
     big_endian_to_int, int_to_addr, zpad, parse_as_bin, parse_as_int, \
-    decode_hex, sha3, is_string, is_numeric
+    decode_hex, sha3, is_string, is_numeric, int_to_big_endian
 from rlp.sedes import big_endian_int, Binary, binary, CountableList
 from ethereum import utils
 from ethereum import trie
@@ -11,9 +11,13 @@ from ethereum.securetrie import SecureTrie
 from ethereum.config import default_config, Env
 from ethereum.block import FakeHeader
 from ethereum.db import BaseDB, EphemDB, OverlayDB, RefcountDB
+from ethereum.flat_state import DiffLayer
+from ethereum.fast_rlp import encode_optimized, decode_optimized
 from ethereum.specials import specials as default_specials
 import copy
+import functools
 import sys
+import weakref
 if sys.version_info.major == 2:
     from repoze.lru import lru_cache
 else:
@@ -25,6 +29,14 @@ BLANK_ROOT = utils.sha3rlp(b'')
 
 THREE = b'\x00' * 19 + b'\x03'
 
+# Kinds of journal records, (kind, obj, field, previous value):
+# the attribute `field` of obj was set,
+JOURNAL_SET = 0
+# storage slot `field` of the account obj was set,
+JOURNAL_STORAGE = 1
+# or an item was appended to the list obj
+JOURNAL_APPEND = 2
+
 
 def snapshot_form(val):
     if is_numeric(val):
@@ -58,35 +70,113 @@ class _Account(rlp.Serializable):
         ('code_hash', hash32)
     ]
 
-class Account():
+def encode_account(nonce, balance, storage, code_hash):
+    """RLP encode an account, the fast path for `_Account`"""
+    return encode_optimized([
+        int_to_big_endian(nonce) if nonce else b'',
+        int_to_big_endian(balance) if balance else b'',
+        storage, code_hash])
+
+
+def decode_account(rlpdata):
+    """(nonce, balance, storage root, code hash) of an RLP encoded account"""
+    nonce, balance, storage, code_hash = decode_optimized(rlpdata)
+    assert len(storage) == 32 and len(code_hash) == 32
+    return (big_endian_to_int(nonce), big_endian_to_int(balance),
+            storage, code_hash)
+
+
+class Account(object):
+
+    __slots__ = ('env', 'address', 'nonce', 'balance', 'storage',
+                 'code_hash', 'storage_cache', 'dirty_storage',
+                 '_storage_trie', 'touched', 'existent_at_start', 'deleted',
+                 '_sharers', '_read_storage', '_cached_rlp')
 
     def __init__(self, nonce, balance, storage, code_hash, env, address):
         assert isinstance(env.db, BaseDB)
         self.env = env
         self.address = address
-
-        acc = _Account(nonce, balance, storage, code_hash)
-        self.nonce = acc.nonce
-        self.balance = acc.balance
-        self.storage = acc.storage
-        self.code_hash = acc.code_hash
+        self.nonce = nonce
+        self.balance = balance
+        self.storage = storage
+        self.code_hash = code_hash
 
         self.storage_cache = {}
-        self.storage_trie = SecureTrie(Trie(RefcountDB(self.env.db)))
-        self.storage_trie.root_hash = self.storage
+        # Storage keys written since the last commit
+        self.dirty_storage = set()
+        # Created on first use, most accounts never need one
+        self._storage_trie = None
         self.touched = False
         self.existent_at_start = True
-        self._mutable = True
         self.deleted = False
+        # The states holding it in their caches, once shared by a fork
+        self._sharers = None
+        # Set by State to read storage through its caches
+        self._read_storage = None
+        self._cached_rlp = None
+
+    @property
+    def storage_trie(self):
+        if self._storage_trie is None:
+            self._storage_trie = SecureTrie(Trie(
+                self.env.trie_db, self.storage, lazy=True,
+                executor=self.env.trie_executor))
+        return self._storage_trie
+
+    @property
+    def storage_reset(self):
+        """whether the storage was cleared since the last commit"""
+        return self._storage_trie is not None and \
+            self._storage_trie.root_hash != self.storage
+
+    def to_rlp(self):
+        return encode_account(
+            self.nonce, self.balance, self.storage, self.code_hash)
+
+    def dirty_storage_items(self):
+        """the written storage slots, as (key, value) pairs"""
+        # Keys written before a storage reset are no longer in the cache
+        cache = self.storage_cache
+        return [(k, cache[k]) for k in self.dirty_storage if k in cache]
 
     def commit(self):
-        for k, v in self.storage_cache.items():
-            if v:
-                self.storage_trie.update(utils.encode_int32(k), rlp.encode(v))
-            else:
-                self.storage_trie.delete(utils.encode_int32(k))
+        """write the storage changes to the storage trie
+
+        :returns: the hashes of trie nodes no longer referenced
+        """
+        items = self.dirty_storage_items()
         self.storage_cache = {}
-        self.storage = self.storage_trie.root_hash
+        self.dirty_storage = set()
+        if not items and not self.storage_reset:
+            return []
+        t = self.storage_trie
+        if t.root_hash == BLANK_ROOT:
+            # Fresh storage, e.g. of a new contract, is built in one pass
+            t.update_all(
+                (utils.encode_int32(k), rlp.encode(v))
+                for k, v in items if v)
+        else:
+            for k, v in items:
+                if v:
+                    t.update(utils.encode_int32(k), rlp.encode(v))
+                else:
+                    t.delete(utils.encode_int32(k))
+        self.storage = t.root_hash
+        return t.deletes
+
+    def copy(self, env):
+        o = Account(self.nonce, self.balance, self.storage, self.code_hash,
+                    env, self.address)
+        if self.storage_reset:
+            o.storage_trie.root_hash = self._storage_trie.root_hash
+        o.storage_cache = dict(self.storage_cache)
+        o.dirty_storage = set(self.dirty_storage)
+        o.touched = self.touched
+        o.existent_at_start = self.existent_at_start
+        o.deleted = self.deleted
+        # Storage reads of the copy are bound by the state caching it
+        return o
 
     @property
     def code(self):
@@ -102,13 +192,22 @@ class Account():
 
     def get_storage_data(self, key):
         if key not in self.storage_cache:
-            v = self.storage_trie.get(utils.encode_int32(key))
-            self.storage_cache[key] = utils.big_endian_to_int(
-                rlp.decode(v) if v else b'')
+            # The state caches hold the storage as of the last commit, so
+            # they do not apply once the storage has been reset
+            if self._read_storage is not None and not self.storage_reset:
+                self.storage_cache[key] = self._read_storage(self, key)
+            else:
+                self.storage_cache[key] = self.load_storage(key)
         return self.storage_cache[key]
 
+    def load_storage(self, key):
+        """the committed value of a storage slot, from the trie"""
+        v = self.storage_trie.get(utils.encode_int32(key))
+        return utils.big_endian_to_int(rlp.decode(v) if v else b'')
+
     def set_storage_data(self, key, value):
         self.storage_cache[key] = value
+        self.dirty_storage.add(key)
 
     @classmethod
     def blank_account(cls, env, address, initial_nonce=0):
@@ -128,7 +227,7 @@ class Account():
         return True
 
     def to_dict(self):
-        odict = self.storage_trie.to_dict()
+        odict = dict(self.storage_trie.iter_range())
         for k, v in self.storage_cache.items():
             odict[utils.encode_int(k)] = rlp.encode(utils.encode_int(v))
         return {'balance': str(self.balance), 'nonce': str(self.nonce), 'code': '0x' + encode_hex(self.code),
@@ -136,20 +235,75 @@ class Account():
                             '0x' + encode_hex(rlp.decode(val)) for key, val in odict.items()}}
 
 
+class AccessSet(object):
+    """the accounts, storage slots and code a state read and wrote
+
+    Accounts count as read whenever they are loaded, so every written
+    account was also read. Written accounts are those loaded for writing;
+    a write may have left the account unchanged.
+    """
+
+    def __init__(self):
+        self.accounts = set()
+        # (address, key) pairs
+        self.slots = set()
+        self.written_accounts = set()
+        self.written_slots = set()
+        # Addresses whose code was read
+        self.code = set()
+
+    def update(self, other):
+        self.accounts |= other.accounts
+        self.slots |= other.slots
+        self.written_accounts |= other.written_accounts
+        self.written_slots |= other.written_slots
+        self.code |= other.code
+
+    def to_dict(self):
+        """the accesses by account, with hex addresses and storage keys"""
+        o = {}
+        for addr in self.accounts:
+            o[encode_hex(addr)] = {
+                'written': addr in self.written_accounts,
+                'code_read': addr in self.code,
+                'storage_read': [],
+                'storage_written': []}
+        for (addr, key) in self.slots:
+            o[encode_hex(addr)]['storage_read'].append(
+                '0x' + encode_hex(utils.encode_int32(key)))
+        for (addr, key) in self.written_slots:
+            o[encode_hex(addr)]['storage_written'].append(
+                '0x' + encode_hex(utils.encode_int32(key)))
+        for d in o.values():
+            d['storage_read'].sort()
+            d['storage_written'].sort()
+        return o
+
+
 # from ethereum.state import State
 class State():
 
     def __init__(self, root=b'', env=Env(), executing_on_head=False, **kwargs):
         self.env = env
-        self.trie = SecureTrie(Trie(RefcountDB(self.db), root))
+        self.trie = SecureTrie(Trie(
+            self.env.trie_db, root, lazy=True,
+            executor=self.env.trie_executor))
         for k, v in STATE_DEFAULTS.items():
             setattr(self, k, kwargs.get(k, copy.copy(v)))
+        # The trie of the receipts, updated as they are added
+        self.receipts_trie = Trie(EphemDB())
         self.journal = []
         self.cache = {}
+        # Addresses of the cached accounts written since the last commit
+        self.dirty_accounts = set()
+        # An AccessSet while reads and writes are being recorded
+        self.access = None
         self.log_listeners = []
         self.deletes = []
         self.changed = {}
         self.executing_on_head = executing_on_head
+        # Changes committed since the last root handed to the flat state
+        self.flat_layer = DiffLayer(self.trie.root_hash)
 
     @property
     def db(self):
@@ -170,22 +324,30 @@ class State():
         self.prev_headers = [block_header] + self.prev_headers
 
     def get_and_cache_account(self, address):
+        if self.access is not None:
+            self.access.accounts.add(address)
         if address in self.cache:
             return self.cache[address]
-        if self.executing_on_head and False:
-            try:
-                rlpdata = self.db.get(b'address:' + address)
-            except KeyError:
-                rlpdata = b''
-        else:
-            rlpdata = self.trie.get(address)
-        if rlpdata != trie.BLANK_NODE:
-            o = rlp.decode(rlpdata, _Account)
+        self._sync_flat_layer()
+        root = self.flat_layer.root
+        warm = self.env.state_cache
+        fields = warm.get_account(root, address) \
+            if warm is not None else None
+        if fields is None:
+            rlpdata = self._get_flat_account(address)
+            if rlpdata is None:
+                rlpdata = self.trie.get(address)
+            if rlpdata != trie.BLANK_NODE:
+                fields = decode_account(rlpdata)
+                if warm is not None:
+                    warm.put_account(root, address, fields)
+        if fields is not None:
+            nonce, balance, storage, code_hash = fields
             o = Account(
-                nonce=o.nonce,
-                balance=o.balance,
-                storage=o.storage,
-                code_hash=o.code_hash,
+                nonce=nonce,
+                balance=balance,
+                storage=storage,
+                code_hash=code_hash,
                 env=self.env,
                 address=address
             )
@@ -193,115 +355,230 @@ class State():
             o = Account.blank_account(
                 self.env, address, self.config['ACCOUNT_INITIAL_NONCE'])
         self.cache[address] = o
-        o._mutable = True
-        o._cached_rlp = None
+        o._read_storage = functools.partial(self._read_storage, root)
         return o
 
+    def get_mutable_account(self, address):
+        """the cached account, copied first if it is shared with a fork"""
+        acct = self.get_and_cache_account(address)
+        self.dirty_accounts.add(address)
+        if self.access is not None:
+            self.access.written_accounts.add(address)
+        sharers = acct._sharers
+        if sharers is not None:
+            sharers.discard(self)
+            if sharers:
+                acct = acct.copy(self.env)
+                acct._read_storage = functools.partial(
+                    self._read_storage, self.flat_layer.root)
+                self.cache[address] = acct
+            else:
+                # The other states have dropped it or are gone
+                acct._sharers = None
+        return acct
+
+    def _drop_cache(self):
+        """empty the account cache, releasing accounts shared with forks"""
+        for acct in self.cache.values():
+            if acct._sharers is not None:
+                acct._sharers.discard(self)
+        self.cache = {}
+
+    def _sync_flat_layer(self):
+        # The trie root may have been set directly, e.g. by a revert or
+        # from a snapshot; start a fresh layer on top of it
+        root = self.trie.root_hash
+        if self.flat_layer.root != root:
+            self.flat_layer = DiffLayer(root)
+
+    def _get_flat_account(self, address):
+        """RLP encoded account from the flat tables, None to read the trie"""
+        if self.env.flat_state is None:
+            return None
+        self._sync_flat_layer()
+        rlpdata = self.flat_layer.get_account(address)
+        if rlpdata is None:
+            rlpdata = self.env.flat_state.get_account(
+                self.flat_layer.parent_root, address)
+        return rlpdata
+
+    def _read_storage(self, root, acct, key):
+        """the value of a storage slot of an account read at state root"""
+        warm = self.env.state_cache
+        if warm is not None:
+            value = warm.get_storage(root, acct.address, key)
+            if value is not None:
+                return value
+        rlpdata = self._get_flat_storage(
+            root, acct.address, utils.encode_int32(key))
+        if rlpdata is not None:
+            value = utils.big_endian_to_int(
+                rlp.decode(rlpdata) if rlpdata else b'')
+        else:
+            value = acct.load_storage(key)
+        if warm is not None:
+            warm.put_storage(root, acct.address, key, value)
+        return value
+
+    def _get_flat_storage(self, root, address, key):
+        # Accounts shared with a fork may outlive the root they were read at
+        if self.env.flat_state is None or self.flat_layer.root != root:
+            return None
+        rlpdata = self.flat_layer.get_storage(address, key)
+        if rlpdata is None:
+            rlpdata = self.env.flat_state.get_storage(
+                self.flat_layer.parent_root, address, key)
+        return rlpdata
+
+    def publish_flat_layer(self):
+        """hand the changes since the last published root to the flat state
+
+        Called once per block on states whose root is kept, e.g. by the
+        chain after applying a block.
+        """
+        self._sync_flat_layer()
+        if self.env.flat_state is not None:
+            self.env.flat_state.add_layer(self.flat_layer)
+        self.flat_layer = DiffLayer(self.flat_layer.root)
+
     def get_balance(self, address):
         return self.get_and_cache_account(
             utils.normalize_address(address)).balance
 
     def get_code(self, address):
+        address = utils.normalize_address(address)
+        if self.access is not None:
+            self.access.code.add(address)
+        return self.get_and_cache_account(address).code
+
+    def get_code_hash(self, address):
         return self.get_and_cache_account(
-            utils.normalize_address(address)).code
+            utils.normalize_address(address)).code_hash
 
     def get_nonce(self, address):
         return self.get_and_cache_account(
             utils.normalize_address(address)).nonce
 
     def set_and_journal(self, acct, param, val):
-        # self.journal.append((acct, param, getattr(acct, param)))
-        preval = getattr(acct, param)
-        self.journal.append(lambda: setattr(acct, param, preval))
+        self.journal.append((JOURNAL_SET, acct, param, getattr(acct, param)))
         setattr(acct, param, val)
 
     def set_balance(self, address, value):
-        acct = self.get_and_cache_account(utils.normalize_address(address))
+        acct = self.get_mutable_account(utils.normalize_address(address))
         self.set_and_journal(acct, 'balance', value)
         self.set_and_journal(acct, 'touched', True)
 
     def set_code(self, address, value):
         # assert is_string(value)
-        acct = self.get_and_cache_account(utils.normalize_address(address))
-        self.set_and_journal(acct, 'code', value)
+        acct = self.get_mutable_account(utils.normalize_address(address))
+        # The old code stays in the database, so only its hash is journaled
+        self.journal.append((JOURNAL_SET, acct, 'code_hash', acct.code_hash))
+        acct.code = value
         self.set_and_journal(acct, 'touched', True)
 
     def set_nonce(self, address, value):
-        acct = self.get_and_cache_account(utils.normalize_address(address))
+        acct = self.get_mutable_account(utils.normalize_address(address))
         self.set_and_journal(acct, 'nonce', value)
         self.set_and_journal(acct, 'touched', True)
 
     def delta_balance(self, address, value):
         address = utils.normalize_address(address)
-        acct = self.get_and_cache_account(address)
+        acct = self.get_mutable_account(address)
         newbal = acct.balance + value
         self.set_and_journal(acct, 'balance', newbal)
         self.set_and_journal(acct, 'touched', True)
 
     def increment_nonce(self, address):
         address = utils.normalize_address(address)
-        acct = self.get_and_cache_account(address)
+        acct = self.get_mutable_account(address)
         newnonce = acct.nonce + 1
         self.set_and_journal(acct, 'nonce', newnonce)
         self.set_and_journal(acct, 'touched', True)
 
     def get_storage_data(self, address, key):
-        return self.get_and_cache_account(
-            utils.normalize_address(address)).get_storage_data(key)
+        address = utils.normalize_address(address)
+        if self.access is not None:
+            self.access.slots.add((address, key))
+        return self.get_and_cache_account(address).get_storage_data(key)
 
     def set_storage_data(self, address, key, value):
-        acct = self.get_and_cache_account(utils.normalize_address(address))
+        address = utils.normalize_address(address)
+        if self.access is not None:
+            self.access.slots.add((address, key))
+            self.access.written_slots.add((address, key))
+        acct = self.get_mutable_account(address)
         preval = acct.get_storage_data(key)
         acct.set_storage_data(key, value)
-        self.journal.append(lambda: acct.set_storage_data(key, preval))
+        self.journal.append((JOURNAL_STORAGE, acct, key, preval))
         self.set_and_journal(acct, 'touched', True)
 
     def add_suicide(self, address):
         self.suicides.append(address)
-        self.journal.append(lambda: self.suicides.pop())
+        self.journal.append((JOURNAL_APPEND, self.suicides, None, None))
 
     def add_log(self, log):
         for listener in self.log_listeners:
             listener(log)
         self.logs.append(log)
-        self.journal.append(lambda: self.logs.pop())
+        self.journal.append((JOURNAL_APPEND, self.logs, None, None))
 
     def add_receipt(self, receipt):
         self.receipts.append(receipt)
-        self.journal.append(lambda: self.receipts.pop())
+        self.journal.append((JOURNAL_APPEND, self.receipts, None, None))
+        self.receipts_trie.update(
+            rlp.encode(len(self.receipts) - 1), rlp.encode(receipt))
+
+    def reset_receipts(self):
+        """start the receipts of a new block"""
+        self.receipts = []
+        self.receipts_trie = Trie(EphemDB())
 
     def add_refund(self, value):
-        preval = self.refunds
-        self.refunds += value
-        self.journal.append(lambda: setattr(self.refunds, preval))
+        self.set_and_journal(self, 'refunds', self.refunds + value)
 
     def snapshot(self):
-        return (self.trie.root_hash, len(self.journal), {
-                k: copy.copy(getattr(self, k)) for k in STATE_DEFAULTS})
+        """a checkpoint to revert to
+
+        Checkpoints nest: one is the journal length when it was taken, so a
+        successful inner call needs no cleanup and a revert undoes exactly
+        the records added since.
+        """
+        auxvars = {k: copy.copy(getattr(self, k)) for k in STATE_DEFAULTS}
+        # Restored with the receipts, even across a reset for a new block
+        auxvars['receipts_trie'] = (
+            self.receipts_trie, self.receipts_trie.root_hash)
+        return (self.trie.root_hash, len(self.journal), auxvars)
 
     def revert(self, snapshot):
         h, L, auxvars = snapshot
         # Compatibility with weird geth+parity bug
         three_touched = self.cache[THREE].touched if THREE in self.cache else False
-        while len(self.journal) > L:
-            try:
-                lastitem = self.journal.pop()
-                lastitem()
-            except Exception as e:
-                print(e)
+        journal = self.journal
+        while len(journal) > L:
+            kind, obj, field, preval = journal.pop()
+            if kind == JOURNAL_SET:
+                setattr(obj, field, preval)
+            elif kind == JOURNAL_STORAGE:
+                obj.set_storage_data(field, preval)
+            else:
+                # The list itself is recorded, as the attribute holding it
+                # may have been replaced since
+                obj.pop()
         if h != self.trie.root_hash:
             assert L == 0
             self.trie.root_hash = h
-            self.cache = {}
+            self._drop_cache()
+            self.dirty_accounts = set()
         for k in STATE_DEFAULTS:
             setattr(self, k, copy.copy(auxvars[k]))
+        self.receipts_trie, receipts_root = auxvars['receipts_trie']
+        if self.receipts_trie.root_hash != receipts_root:
+            self.receipts_trie.root_hash = receipts_root
         if three_touched and 2675000 < self.block_number < 2675200:  # Compatibility with weird geth+parity bug
             self.delta_balance(THREE, 0)
 
     def set_param(self, k, v):
-        preval = getattr(self, k)
-        self.journal.append(lambda: setattr(self, k, preval))
-        setattr(self, k, v)
+        self.set_and_journal(self, k, v)
 
     def is_SERENITY(self, at_fork_height=False):
         if at_fork_height:
@@ -372,31 +649,62 @@ class State():
             utils.normalize_address(address)).to_dict()
 
     def commit(self, allow_empties=False):
-        for addr, acct in self.cache.items():
-            if acct.touched or acct.deleted:
-                acct.commit()
-                self.deletes.extend(acct.storage_trie.deletes)
-                self.changed[addr] = True
-                if self.account_exists(addr) or allow_empties:
-                    _acct = _Account(acct.nonce, acct.balance, acct.storage, acct.code_hash)
-                    self.trie.update(addr, rlp.encode(_acct))
-
-                    if self.executing_on_head:
-                        self.db.put(b'address:' + addr, rlp.encode(_acct))
-                else:
-                    self.trie.delete(addr)
-                    if self.executing_on_head:
-                        try:
-                            self.db.delete(b'address:' + addr)
-                        except KeyError:
-                            pass
+        self._sync_flat_layer()
+        layer = self.flat_layer
+        parent_root = layer.root
+        # Changes for the warm cache: account fields, wiped storage, slots
+        accounts, wiped_accounts, slots = {}, [], []
+        # Trie nodes of the state and all storage go out as one database write
+        with self.db.write_batch():
+            # A fresh state, e.g. at genesis, is built in a single pass
+            bulk = self.trie.root_hash == BLANK_ROOT
+            new_accounts = []
+            for addr in self.dirty_accounts:
+                acct = self.cache[addr]
+                # A write may have been reverted since
+                if acct.touched or acct.deleted:
+                    wiped = acct.storage_reset
+                    storage = acct.dirty_storage_items()
+                    self.deletes.extend(acct.commit())
+                    self.changed[addr] = True
+                    if self.account_exists(addr) or allow_empties:
+                        rlpdata = acct.to_rlp()
+                        if bulk:
+                            new_accounts.append((addr, rlpdata))
+                        else:
+                            self.trie.update(addr, rlpdata)
+                        layer.set_account(addr, rlpdata)
+                        accounts[addr] = (acct.nonce, acct.balance,
+                                          acct.storage, acct.code_hash)
+                        if wiped:
+                            layer.wipe_storage(addr)
+                            wiped_accounts.append(addr)
+                        for k, v in storage:
+                            layer.set_storage(
+                                addr, utils.encode_int32(k),
+                                rlp.encode(v) if v else trie.BLANK_NODE)
+                            slots.append((addr, k, v))
+                    else:
+                        self.trie.delete(addr)
+                        layer.set_account(addr, trie.BLANK_NODE)
+                        layer.wipe_storage(addr)
+                        accounts[addr] = None
+                        wiped_accounts.append(addr)
+            if new_accounts:
+                self.trie.update_all(new_accounts)
+            self.trie.commit()
+        layer.root = self.trie.root_hash
+        if self.executing_on_head and self.env.state_cache is not None:
+            self.env.state_cache.advance(
+                parent_root, layer.root, accounts, wiped_accounts, slots)
         self.deletes.extend(self.trie.deletes)
         self.trie.deletes = []
-        self.cache = {}
+        self._drop_cache()
+        self.dirty_accounts = set()
         self.journal = []
 
     def to_dict(self):
-        for addr in self.trie.to_dict().keys():
+        for addr, _ in self.trie.iter_range():
             self.get_and_cache_account(addr)
         return {encode_hex(addr): acct.to_dict()
                 for addr, acct in self.cache.items()}
@@ -407,29 +715,21 @@ class State():
         self.set_code(address, b'')
         self.reset_storage(address)
         self.set_and_journal(
-            self.get_and_cache_account(
+            self.get_mutable_account(
                 utils.normalize_address(address)),
             'deleted',
             True)
         self.set_and_journal(
-            self.get_and_cache_account(
+            self.get_mutable_account(
                 utils.normalize_address(address)),
             'touched',
             False)
         # self.set_and_journal(self.get_and_cache_account(utils.normalize_address(address)), 'existent_at_start', False)
 
     def reset_storage(self, address):
-        acct = self.get_and_cache_account(address)
-        pre_cache = acct.storage_cache
-        acct.storage_cache = {}
-        self.journal.append(lambda: setattr(acct, 'storage_cache', pre_cache))
-        pre_root = acct.storage_trie.root_hash
-        self.journal.append(
-            lambda: setattr(
-                acct.storage_trie,
-                'root_hash',
-                pre_root))
-        acct.storage_trie.root_hash = BLANK_ROOT
+        acct = self.get_mutable_account(address)
+        self.set_and_journal(acct, 'storage_cache', {})
+        self.set_and_journal(acct.storage_trie, 'root_hash', BLANK_ROOT)
 
     # Creates a snapshot from a state
     def to_snapshot(self, root_only=False, no_prevblocks=False):
@@ -516,20 +816,51 @@ class State():
         state.changed = {}
         return state
 
-    def ephemeral_clone(self):
-        snapshot = self.to_snapshot(root_only=True, no_prevblocks=True)
-        env2 = Env(OverlayDB(self.env.db), self.env.config)
-        s = State.from_snapshot(snapshot, env2)
-        for param in STATE_DEFAULTS:
-            setattr(s, param, getattr(self, param))
-        s.recent_uncles = self.recent_uncles
-        s.prev_headers = self.prev_headers
-        for acct in self.cache.values():
-            assert not acct.touched or not acct.deleted
-        s.journal = copy.copy(self.journal)
+    def fork(self):
+        """a copy-on-write child of this state
+
+        The child writes to an in-memory overlay of the database and starts
+        with this state's cached accounts, including uncommitted changes.
+        Accounts without pending writes are shared by both states; a state
+        writing to one while another live state still caches it writes to
+        its own copy. Accounts with pending writes are copied for the child,
+        as this state's journal refers to them. The child
+        starts with an empty journal, so snapshots of this state cannot be
+        reverted in it.
+        """
+        s = State.__new__(State)
+        s.env = self.env.fork()
+        s.trie = SecureTrie(Trie(
+            s.env.trie_db, self.trie.root_hash, lazy=True,
+            executor=s.env.trie_executor))
+        for k in STATE_DEFAULTS:
+            setattr(s, k, copy.copy(getattr(self, k)))
+        s.receipts_trie = Trie(
+            self.receipts_trie.db, self.receipts_trie.root_hash)
+        s.journal = []
         s.cache = {}
+        s.dirty_accounts = set(self.dirty_accounts)
+        s.access = None
+        s.flat_layer = self.flat_layer.copy()
+        for addr, acct in self.cache.items():
+            if acct.touched or acct.deleted or acct.storage_reset:
+                o = acct.copy(s.env)
+                o._read_storage = functools.partial(
+                    s._read_storage, s.flat_layer.root)
+                s.cache[addr] = o
+            else:
+                if acct._sharers is None:
+                    acct._sharers = weakref.WeakSet([self])
+                acct._sharers.add(s)
+                s.cache[addr] = acct
+        s.log_listeners = []
+        s.deletes = []
+        s.changed = {}
+        s.executing_on_head = False
         return s
 
+    def ephemeral_clone(self):
+        return self.fork()
 
 def prev_header_to_dict(h):
     return {
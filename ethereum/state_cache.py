@@ -0,0 +1,125 @@
+from collections import OrderedDict
+
+from ethereum import utils
+from ethereum.slogging import get_logger
+
+log = get_logger('eth.state_cache')
+
+
+class StateCache(object):
+    """Decoded accounts and storage of the head state, kept across commits
+
+    All entries are valid at one state root, `root`. Any state at that root
+    reads and fills the cache; only the head state moves it forward, by
+    handing its changes to `advance` when it commits. If the head commits on
+    top of another root, e.g. after a reorg, the cache starts over.
+
+    Accounts are (nonce, balance, storage root, code hash) tuples and storage
+    values are ints, so entries are never shared mutable state. Both tables
+    are bounded LRUs.
+    """
+
+    def __init__(self, max_accounts, max_slots):
+        self.max_accounts = max_accounts
+        self.max_slots = max_slots
+        self.root = None
+        self.accounts = OrderedDict()
+        # Storage values by (address, key), and the cached keys by address
+        self.slots = OrderedDict()
+        self.slot_keys = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_account(self, root, address):
+        """account fields at state root, None if not cached"""
+        if root != self.root:
+            return None
+        try:
+            fields = self.accounts.pop(address)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.accounts[address] = fields
+        return fields
+
+    def put_account(self, root, address, fields):
+        if root != self.root or not self.max_accounts:
+            return
+        self.accounts.pop(address, None)
+        self.accounts[address] = fields
+        if len(self.accounts) > self.max_accounts:
+            self.accounts.popitem(last=False)
+
+    def get_storage(self, root, address, key):
+        """storage value at state root, None if not cached"""
+        if root != self.root:
+            return None
+        try:
+            value = self.slots.pop((address, key))
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.slots[(address, key)] = value
+        return value
+
+    def put_storage(self, root, address, key, value):
+        if root != self.root or not self.max_slots:
+            return
+        self._put_slot(address, key, value)
+
+    def _put_slot(self, address, key, value):
+        if (address, key) in self.slots:
+            del self.slots[(address, key)]
+        else:
+            self.slot_keys.setdefault(address, set()).add(key)
+        self.slots[(address, key)] = value
+        if len(self.slots) > self.max_slots:
+            (a, k), _ = self.slots.popitem(last=False)
+            self._forget_key(a, k)
+
+    def _forget_key(self, address, key):
+        keys = self.slot_keys[address]
+        keys.discard(key)
+        if not keys:
+            del self.slot_keys[address]
+
+    def advance(self, parent_root, root, accounts, wiped, storage):
+        """apply the changes of a commit from parent_root to root
+
+        :param accounts: account fields by address, None if deleted
+        :param wiped: addresses whose storage was cleared before the
+            changes in `storage` were made
+        :param storage: (address, key, value) of the written slots
+        """
+        if parent_root != self.root:
+            if self.root is not None:
+                log.debug('state cache reset', root=utils.encode_hex(root))
+            self.clear()
+        elif parent_root == root:
+            return
+        for address, fields in accounts.items():
+            self.accounts.pop(address, None)
+            if fields is not None and self.max_accounts:
+                self.accounts[address] = fields
+        while len(self.accounts) > self.max_accounts:
+            self.accounts.popitem(last=False)
+        for address in wiped:
+            for key in self.slot_keys.pop(address, ()):
+                del self.slots[(address, key)]
+        if self.max_slots:
+            for address, key, value in storage:
+                self._put_slot(address, key, value)
+        self.root = root
+
+    def clear(self):
+        self.root = None
+        self.accounts = OrderedDict()
+        self.slots = OrderedDict()
+        self.slot_keys = {}
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / float(lookups) if lookups else 0.0
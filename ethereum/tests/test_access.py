@@ -0,0 +1,30 @@
+from ethereum.messages import apply_transaction
+from ethereum.tools import tester
+from ethereum.transactions import Transaction
+from ethereum.utils import big_endian_to_int, encode_hex
+
+# Deploys code storing the call value at the caller's slot:
+# CALLVALUE CALLER SSTORE
+STORE_VALUE = b'\x62\x34\x33\x55\x60\x00\x52\x60\x03\x60\x1d\xf3'
+
+
+def test_transaction_access_record():
+    c = tester.Chain()
+    contract = c.contract(STORE_VALUE, language='evm')
+    state = c.head_state
+    tx = Transaction(state.get_nonce(tester.a1), tester.GASPRICE,
+                     tester.STARTGAS, contract, 5, b'').sign(tester.k1)
+    success, _, access = apply_transaction(state, tx, record_access=True)
+    assert success
+    assert state.access is None
+    slot = (contract, big_endian_to_int(tester.a1))
+    assert access.written_slots == {slot}
+    assert slot in access.slots
+    assert contract in access.code
+    assert {tester.a1, contract, state.block_coinbase} <= \
+        access.written_accounts
+    report = access.to_dict()
+    assert report[encode_hex(contract)]['code_read']
+    assert report[encode_hex(contract)]['storage_written'] == \
+        ['0x' + encode_hex(b'\x00' * 12 + tester.a1)]
+    assert not report[encode_hex(tester.a1)]['code_read']
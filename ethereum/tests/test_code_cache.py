@@ -0,0 +1,53 @@
+from ethereum import fastvm, utils, vm  # noqa: registers fastvm analyses
+from ethereum.code_cache import CodeCache
+from ethereum.config import Env, config_metropolis
+from ethereum.db import EphemDB
+from ethereum.messages import apply_message
+from ethereum.state import State
+
+# mstore(0, 0x2a) return(0, 32), with a JUMPDEST to keep
+CODE = bytes(bytearray([0x5b, 0x60, 0x2a, 0x60, 0, 0x52,
+                        0x60, 32, 0x60, 0, 0xf3]))
+
+
+def test_lru_budget():
+    codes = [CODE + bytes(bytearray([i])) for i in range(4)]
+    size = len(codes[0]) // 8 + 120 * 4
+    cache = CodeCache(3 * size)
+    for code in codes:
+        cache.get(utils.sha3(code), b'jumpdests', code)
+    assert len(cache.entries) == 3 and cache.evictions == 1
+    assert cache.get(utils.sha3(codes[3]), b'jumpdests', codes[3]) == \
+        vm.preprocess_code(codes[3])
+    assert cache.hits == 1 and cache.misses == 4
+    # Too large to cache at all
+    assert CodeCache(1).get(b'\x00' * 32, b'jumpdests', CODE)[0] == 1
+
+
+def test_persistence():
+    db = EphemDB()
+    code_hash = utils.sha3(CODE)
+    analysis = CodeCache(1024, db).get(code_hash, b'jumpdests', CODE)
+    cache = CodeCache(1024, db)
+    assert cache.get(code_hash, b'jumpdests', b'') == analysis
+    assert cache.loads == 1
+    # Blocks are not persisted
+    cache.get(code_hash, b'blocks', CODE)
+    assert cache.loads == 1
+
+
+def test_shared_by_code_hash():
+    for engine in sorted(vm.VM_ENGINES):
+        state = State(env=Env(config=dict(config_metropolis,
+                                          VM_ENGINE=engine)))
+        a, b = b'\x01' * 20, b'\x02' * 20
+        state.set_code(a, CODE)
+        state.set_code(b, CODE)
+        for to in (a, b, a):
+            output = apply_message(state, sender=b'\x03' * 20, to=to,
+                                   gas=100000)
+            assert utils.big_endian_to_int(output) == 0x2a
+        cache = state.env.code_cache
+        # Jump destinations, fastvm's blocks, and jitvm's runs
+        assert len(cache.entries) == {'vm': 1, 'jitvm': 3}.get(engine, 2)
+        assert cache.misses == len(cache.entries)
@@ -1,8 +1,10 @@
 import itertools
+import os
 import random
 import pytest
-from ethereum.db import _EphemDB
-from ethereum.utils import ascii_chr
+import rlp
+from ethereum.db import _EphemDB, CachingDB, FileDB, OverlayDB
+from ethereum.utils import ascii_chr, sha3
 
 random.seed(0)
 
@@ -35,3 +37,136 @@ def test_ephem():
         assert key not in db
         with pytest.raises(KeyError):
             db.get(key)
+
+
+def test_file_db(tmpdir):
+    path = str(tmpdir.join('chain.db'))
+    db = FileDB(path)
+    for key, value in content.items():
+        db.put(key, value)
+        assert key in db
+        assert db.get(key) == value
+    db.commit()
+    db.close()
+
+    # Only committed writes survive a reopen
+    db = FileDB(path)
+    for key, value in content.items():
+        assert db.get(key) == value
+    for key in content:
+        db.put(key, alt_content[key])
+    db.close()
+    db = FileDB(path)
+    for key, value in content.items():
+        assert db.get(key) == value
+
+    deleted = list(content)[:3]
+    for key in deleted:
+        db.delete(key)
+        assert key not in db
+    db.commit()
+    db.compact()
+    db.close()
+    db = FileDB(path)
+    for key, value in content.items():
+        if key in deleted:
+            with pytest.raises(KeyError):
+                db.get(key)
+        else:
+            assert db.get(key) == value
+    db.close()
+
+
+def test_file_db_torn_batch(tmpdir):
+    path = str(tmpdir.join('chain.db'))
+    db = FileDB(path)
+    db.put(b'a', b'1')
+    db.commit()
+    db.put(b'b', b'2')
+    db.commit()
+    size = os.path.getsize(path)
+    db.close()
+    # Simulate a crash halfway through writing the second batch
+    with open(path, 'r+b') as f:
+        f.truncate(size - 1)
+    db = FileDB(path)
+    assert db.get(b'a') == b'1'
+    assert b'b' not in db
+    db.put(b'c', b'3')
+    db.commit()
+    db.close()
+    db = FileDB(path)
+    assert db.get(b'c') == b'3'
+    db.close()
+
+
+@pytest.mark.parametrize('mk_db', [
+    _EphemDB,
+    lambda: OverlayDB(_EphemDB()),
+])
+def test_write_batch(mk_db):
+    db = mk_db()
+    db.put(b'old', b'x')
+    with db.write_batch():
+        db.put(b'a', b'1')
+        db.put(b'a', b'2')
+        db.put(b'b', b'3')
+        db.delete(b'b')
+        db.delete(b'old')
+        # Buffered writes are visible to reads inside the batch
+        assert db.get(b'a') == b'2'
+        assert b'b' not in db
+        assert b'old' not in db
+    assert db.get(b'a') == b'2'
+    assert b'b' not in db
+    assert b'old' not in db
+
+    with pytest.raises(ValueError):
+        with db.write_batch():
+            db.put(b'c', b'4')
+            raise ValueError()
+    assert b'c' not in db
+
+
+def test_write_batch_single_write():
+    db = _EphemDB()
+    writes = []
+    apply_batch = db._write_batch
+    db._write_batch = lambda batch: writes.append(batch) or apply_batch(batch)
+    with db.write_batch():
+        with db.write_batch():
+            db.put(b'a', b'1')
+        db.put(b'b', b'2')
+        with pytest.raises(KeyError):
+            db.delete(b'missing')
+        assert not writes
+    assert writes == [{b'a': b'1', b'b': b'2'}]
+    assert db.get(b'b') == b'2'
+
+
+def test_caching_db():
+    nodes = {sha3(rlp.encode(n)): n for n in
+             [[b'\x20' + random_string(31), random_string(40)]
+              for _ in range(10)]}
+    backend = _EphemDB()
+    for key, node in nodes.items():
+        backend.put(key, rlp.encode(node))
+    size = len(rlp.encode(list(nodes.values())[0]))
+    db = CachingDB(backend, max_bytes=size * 4)
+    for key, node in nodes.items():
+        assert db.get_node(key) == node
+    assert (db.hits, db.misses) == (0, 10)
+    assert len(db.nodes) == 4
+    assert db.size <= db.max_bytes
+
+    # Recently used nodes are served from the cache, without a backend read
+    recent = list(nodes)[-4:]
+    for key in recent:
+        backend.delete(key)
+        assert db.get_node(key) == nodes[key]
+    assert (db.hits, db.misses) == (4, 10)
+    assert db.hit_rate == 4 / 14.
+
+    # Callers may mutate the node they get without corrupting the cache
+    db.get_node(recent[0])[1] = b''
+    assert db.get_node(recent[0]) == nodes[recent[0]]
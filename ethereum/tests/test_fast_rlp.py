@@ -0,0 +1,71 @@
+import random
+import pytest
+import rlp
+from rlp.exceptions import DecodingError, EncodingError
+from ethereum import fast_rlp
+from ethereum.block import Block, BlockHeader, decode_header_and_uncles
+from ethereum.transactions import Transaction
+
+
+def random_item(rng, depth=0):
+    if depth < 3 and rng.random() < 0.4:
+        return [random_item(rng, depth + 1)
+                for _ in range(rng.choice([0, 1, 2, 17, 30]))]
+    length = rng.choice([0, 1, 1, 2, 31, 32, 55, 56, 300])
+    return bytes(bytearray(rng.randrange(256) for _ in range(length)))
+
+
+def test_roundtrip_matches_pyrlp():
+    rng = random.Random(1)
+    for _ in range(300):
+        item = random_item(rng)
+        encoded = rlp.encode(item)
+        assert fast_rlp.encode_optimized(item) == encoded
+        assert fast_rlp.decode_optimized(encoded) == rlp.decode(encoded)
+        assert fast_rlp.decode_lazy(encoded) == rlp.decode(encoded)
+        assert fast_rlp.decode_optimized(bytearray(encoded)) == item
+
+
+def test_length_prefix_is_bytes():
+    assert fast_rlp.length_prefix(3, 128) == b'\x83'
+    assert fast_rlp.length_prefix(1024, 192) == b'\xf9\x04\x00'
+
+
+def test_decode_lazy_views():
+    encoded = rlp.encode([b'cat', [b'dog', [b'x' * 60]], b''])
+    view = fast_rlp.decode_lazy(encoded)
+    assert len(view) == 3
+    assert view[0] == b'cat'
+    assert view[-1] == b''
+    assert isinstance(view[1], fast_rlp.RLPListView)
+    assert view[1][1][0] == b'x' * 60
+    assert view.tolist() == rlp.decode(encoded)
+    assert fast_rlp.decode_lazy(rlp.encode(b'dog')) == b'dog'
+
+
+@pytest.mark.parametrize('item', ['dog', [b'cat', 'dog'], 3, None])
+def test_encode_unsupported(item):
+    with pytest.raises(EncodingError):
+        fast_rlp.encode_optimized(item)
+
+
+def test_decode_header_and_uncles():
+    uncle = BlockHeader(number=3, extra_data=b'uncle')
+    txs = [Transaction(i, 1, 21000, b'\x35' * 20, 1, b'') for i in range(3)]
+    block = Block(BlockHeader(number=4), txs, [uncle])
+    header, uncles = decode_header_and_uncles(rlp.encode(block))
+    assert header == block.header
+    assert uncles == [uncle]
+
+
+@pytest.mark.parametrize('encoded', [
+    b'',
+    b'\x83do',
+    b'\xc4\x83dog\x01',
+    b'\x83dog\x01',
+    b'\xc2\x83dog',
+    b'\xb9\x01',
+])
+def test_decode_invalid(encoded):
+    with pytest.raises(DecodingError):
+        fast_rlp.decode_optimized(encoded)
@@ -0,0 +1,112 @@
+from ethereum import fastvm, vm
+from ethereum.config import Env, config_metropolis
+from ethereum.messages import VMExt
+from ethereum.state import State
+from ethereum.tools.vm_benchmark import BenchExt
+
+# Counts down from 10 in storage slot 0, pushing GAS and PC on the way, and
+# returns the last word stored in memory
+LOOP = bytes(bytearray([
+    0x60, 10, 0x60, 0, 0x55,        # sstore(0, 10)
+    0x5b,                           # 5: JUMPDEST
+    0x5a, 0x58, 0x01,               # GAS PC ADD
+    0x60, 0, 0x52,                  # mstore(0, _)
+    0x60, 1, 0x60, 0, 0x54, 0x03,   # sload(0) - 1
+    0x80, 0x60, 0, 0x55,            # sstore(0, _), keeping it
+    0x60, 5, 0x57,                  # jumpi(5, _)
+    0x60, 32, 0x60, 0, 0xf3,        # return(0, 32)
+]))
+
+
+def run(execute, code, gas):
+    ext = BenchExt()
+    msg = vm.Message(b'\x00' * 20, b'\x00' * 20, 0, gas, vm.CallData([]))
+    return execute(ext, msg, code), ext.storage
+
+
+def test_matches_vm():
+    for gas in [10 ** 6, 200000, 100000, 50000, 30000, 21000, 100, 3]:
+        assert run(fastvm.vm_execute, LOOP, gas) == \
+            run(vm.vm_execute, LOOP, gas)
+    success, gas, data = run(fastvm.vm_execute, LOOP, 10 ** 6)[0]
+    assert success == 1 and gas > 0 and len(data) == 32
+
+
+def test_blocks():
+    blocks = fastvm.compile_code(LOOP)
+    assert sorted(blocks) == [0, 5, 25]
+    assert blocks[0].end == 5
+    assert blocks[5].end == 25 and blocks[5].needs == 0
+    # Jumping into push data or past the code
+    for target in (1, 4, 100):
+        code = bytes(bytearray([0x60, target, 0x56, 0x5b, 0x00]))
+        assert run(fastvm.vm_execute, code, 1000) == \
+            run(vm.vm_execute, code, 1000)
+    # Invalid opcodes end a block, the code after it is still reachable
+    code = bytes(bytearray([0x60, 4, 0x56, 0xfe, 0x5b, 0x00]))
+    assert run(fastvm.vm_execute, code, 1000)[0][0] == 1
+    assert run(fastvm.vm_execute, code[3:], 1000)[0][0] == 0
+
+
+def test_stack_effect_of_handlers():
+    # CALLBLACKBOX takes 7 items by the opcode table, but its handler
+    # leaves them on the stack for the DUP7 after it
+    code = bytes(bytearray([0x60, 0x80] + [0x80] * 7 +
+                           [0xf5, 0x86, 0x60, 0, 0x55]))
+    assert fastvm.compile_code(code)[0].needs == 0
+    expected = run(vm.vm_execute, code, 10 ** 6)
+    assert expected[0][0] == 1 and expected[1] == {0: 128}
+    assert run(fastvm.vm_execute, code, 10 ** 6) == expected
+
+    # Exactly the opcodes whose handler does nothing
+    assert fastvm.NO_STACK_EFFECT == frozenset(
+        vm.OP_NAMES.index(name) for name in ('JUMPDEST', 'CALLBLACKBOX'))
+    empty = vm._op_nothing.__code__.co_code
+    for op, handler in enumerate(vm.OP_HANDLERS):
+        no_op = getattr(handler, '__code__', None) is not None and \
+            handler.__code__.co_code == empty
+        assert (op in fastvm.NO_STACK_EFFECT) == no_op, vm.OP_NAMES[op]
+    for op in fastvm.NO_STACK_EFFECT:
+        stk = [1, 2, 3]
+        vm.OP_HANDLERS[op](None, stk)
+        assert stk == [1, 2, 3]
+
+
+def test_engine_setting():
+    config = dict(config_metropolis, VM_ENGINE='fastvm')
+    ext = VMExt(State(env=Env(config=config)), None)
+    assert ext.vm_execute is fastvm.vm_execute
+    ext = VMExt(State(env=Env(config=config_metropolis)), None)
+    assert ext.vm_execute is vm.vm_execute
+
+
+
+# Stores 3 + 4 * 2 in slot 1, passes two jumps not taken and jumps to STOP
+FUSED = bytes(bytearray([
+    0x60, 3, 0x60, 4, 0x60, 2,      # PUSH PUSH PUSH
+    0x90, 0x80, 0x50,               # SWAP1 DUP1 POP
+    0x02, 0x01, 0x60, 0, 0x01,      # MUL ADD PUSH ADD
+    0x60, 1, 0x55,                  # sstore(1, _)
+    0x60, 1, 0x15, 0x60, 0, 0x57,   # ISZERO PUSH JUMPI
+    0x60, 0, 0x60, 99, 0x57,        # PUSH JUMPI
+    0x60, 33, 0x56,                 # PUSH JUMP
+    0x5b, 0xfe,                     # 31: JUMPDEST INVALID
+    0x5b, 0x00,                     # 33: JUMPDEST STOP
+]))
+
+
+def test_fusion():
+    assert fastvm.dispatch_counts(FUSED) == (5, 25, 15)
+    assert run(fastvm.vm_execute, FUSED, 10 ** 6)[1] == {1: 11}
+    # Good, bad and invalid jump destinations, taken or not
+    variants = [FUSED, FUSED[:29] + b'\x1f' + FUSED[30:],
+                FUSED[:29] + b'\x20' + FUSED[30:],
+                FUSED[:24] + b'\x01\x60\x21' + FUSED[27:],
+                FUSED[:24] + b'\x01' + FUSED[25:]]
+    for code in variants:
+        for gas in [10 ** 6, 20100, 20081, 20080, 100, 10]:
+            result, storage = run(fastvm.vm_execute, code, gas)
+            expected, expected_storage = run(vm.vm_execute, code, gas)
+            # Failures revert storage, vm may get further into a block first
+            assert result == expected
+            assert not result[0] or storage == expected_storage
@@ -0,0 +1,67 @@
+from ethereum.config import Env, default_config
+from ethereum.db import EphemDB
+from ethereum.state import State
+from ethereum.trie import BLANK_NODE
+
+A = b'\x11' * 20
+B = b'\x22' * 20
+
+
+def mk_state(layers=2):
+    config = dict(default_config)
+    config['FLAT_STATE_LAYERS'] = layers
+    env = Env(EphemDB(), config)
+    state = State(env=env)
+    state.set_balance(A, 100)
+    state.set_storage_data(A, 1, 7)
+    state.commit()
+    env.flat_state.generate(state.trie.root_hash)
+    state.publish_flat_layer()
+    return state
+
+
+def block(state, f):
+    f(state)
+    state.commit()
+    state.publish_flat_layer()
+    state.env.flat_state.cap(state.trie.root_hash)
+    return state.trie.root_hash
+
+
+def test_reads_match_trie():
+    state = mk_state()
+    flat = state.env.flat_state
+    genesis = state.trie.root_hash
+    r1 = block(state, lambda s: s.set_balance(B, 5))
+    r2 = block(state, lambda s: s.set_storage_data(A, 1, 0))
+    assert flat.get_account(r2, B) == state.trie.get(B)
+    assert flat.get_account(genesis, B) == BLANK_NODE
+    assert flat.get_storage(r1, A, b'\x00' * 31 + b'\x01') != BLANK_NODE
+    assert flat.get_storage(r2, A, b'\x00' * 31 + b'\x01') == BLANK_NODE
+    assert flat.get_account(b'\x00' * 32, A) is None
+
+    # a fresh state at a known root reads through the flat tables
+    s = State(r1, state.env)
+    assert s.get_balance(B) == 5
+    assert s.get_storage_data(A, 1) == 7
+
+
+def test_cap_and_reorg():
+    state = mk_state(layers=1)
+    flat = state.env.flat_state
+    genesis = state.trie.root_hash
+    fork = State(genesis, state.env)
+    r1 = block(state, lambda s: s.set_balance(B, 5))
+    assert flat.disk_root == genesis
+    f1 = block(fork, lambda s: s.set_balance(B, 9))
+    assert flat.get_account(f1, B) == fork.trie.get(B)
+
+    r2 = block(state, lambda s: s.del_account(A))
+    assert flat.disk_root == r1
+    # the fork no longer leads to the disk layer
+    assert not flat.knows(f1)
+    assert flat.get_account(r2, A) == BLANK_NODE
+    assert flat.get_storage(r2, A, b'\x00' * 31 + b'\x01') == BLANK_NODE
+    block(state, lambda s: s.set_balance(A, 1))
+    assert flat.disk_root == r2
+    assert State(r2, state.env).get_storage_data(A, 1) == 0
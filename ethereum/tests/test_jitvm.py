@@ -0,0 +1,74 @@
+import random
+
+from ethereum import fastvm, jitvm, opcodes, vm
+from ethereum.tools.vm_benchmark import BenchExt
+from ethereum.tests.test_fastvm import FUSED, LOOP
+
+# Random programs use every opcode but these, which need a full state
+UNSUPPORTED = {'CREATE', 'CALL', 'CALLCODE', 'DELEGATECALL', 'STATICCALL',
+               'SUICIDE'}
+OPCODES = dict((name, op) for op, (name, _, _, _) in opcodes.opcodes.items()
+               if name not in UNSUPPORTED and not name.startswith('PUSH'))
+# More of them than the others, to have places to jump to
+NAMES = sorted(OPCODES) + ['JUMPDEST'] * 4
+
+
+def random_code(rnd):
+    code = bytearray()
+    for i in range(rnd.randint(1, 40) + 10):
+        # Something on the stack to start with
+        if i < 10 or rnd.random() < 0.4:
+            value = rnd.choice([0, 1, 2, 3, 31, 32, 2 ** 255, 2 ** 256 - 1,
+                                rnd.randint(0, 60)])
+            size = max(1, (value.bit_length() + 7) // 8)
+            code.append(0x5f + size)
+            code += value.to_bytes(size, 'big')
+        elif rnd.random() < 0.02:
+            code.append(0xfe)
+        else:
+            code.append(OPCODES[rnd.choice(NAMES)])
+    return bytes(code)
+
+
+def run(execute, code, gas):
+    ext = BenchExt()
+    msg = vm.Message(b'\x00' * 20, b'\x00' * 20, 0, gas,
+                     vm.CallData(list(range(40))))
+    return execute(ext, msg, code), ext.storage
+
+
+def run_compiled(ext, msg, code):
+    return fastvm.run_blocks(ext, msg, code, jitvm.compile_code(code))
+
+
+def check(code, gas):
+    expected, expected_storage = run(vm.vm_execute, code, gas)
+    for execute in (fastvm.vm_execute, run_compiled):
+        result, storage = run(execute, code, gas)
+        assert result == expected, code
+        # Failures revert storage, vm may get further into a block first
+        assert not result[0] or storage == expected_storage, code
+
+
+def test_matches_vm():
+    for code in (LOOP, FUSED):
+        for gas in [10 ** 6, 30000, 20081, 100, 3]:
+            check(code, gas)
+    rnd = random.Random(1)
+    for _ in range(1000):
+        check(random_code(rnd), rnd.choice([10 ** 6, 30000, 500, 30]))
+
+
+def test_tier_up():
+    ext = BenchExt(LOOP)
+    msg = vm.Message(b'\x00' * 20, b'\x00' * 20, 0, 10 ** 6, vm.CallData([]))
+    for _ in range(jitvm.HOT_RUNS - 1):
+        assert jitvm.vm_execute(ext, msg, LOOP)[0] == 1
+    hot = vm.get_analysis(ext, msg, LOOP, b'jit')
+    assert hot.blocks is None
+    result = jitvm.vm_execute(ext, msg, LOOP)
+    assert hot.blocks is not None
+    assert result == vm.vm_execute(BenchExt(LOOP), msg, LOOP)
+    # Never compiled without a cache to count runs in
+    for _ in range(jitvm.HOT_RUNS):
+        assert jitvm.vm_execute(BenchExt(), msg, LOOP) == result
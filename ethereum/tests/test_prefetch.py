@@ -0,0 +1,93 @@
+from concurrent.futures import wait
+
+import pytest
+
+from ethereum import utils
+from ethereum.config import Env, default_config
+from ethereum.db import EphemDB, FileDB
+from ethereum.prefetch import static_storage_keys, prefetch_block_state, \
+    store_prefetched
+from ethereum.state import State
+
+A = b'\x11' * 20
+B = b'\x22' * 20
+C = b'\x33' * 20
+
+# PUSH1 3 SLOAD, PUSH1 1 PUSH2 0x0105 SSTORE, CALLER SLOAD
+CODE = b'\x60\x03\x54\x60\x01\x61\x01\x05\x55\x33\x54'
+
+
+class FakeTx(object):
+    def __init__(self, sender, to):
+        self.sender = sender
+        self.to = to
+
+
+class FakeBlock(object):
+    def __init__(self, coinbase, transactions):
+        self.header = type('Header', (object,), {'coinbase': coinbase})
+        self.transactions = transactions
+
+
+def test_static_storage_keys():
+    assert static_storage_keys(CODE) == (3, 0x105)
+    assert static_storage_keys(b'') == ()
+    # truncated push at the end of the code
+    assert static_storage_keys(b'\x54\x7f\x01') == ()
+
+
+def test_prefetch_loads_touched_state():
+    env = Env(EphemDB(), dict(default_config))
+    state = State(env=env)
+    state.set_code(B, CODE)
+    state.set_storage_data(B, 3, 9)
+    state.commit()
+    state = State(state.trie.root_hash, env)
+    block = FakeBlock(C, [FakeTx(A, B)])
+    assert prefetch_block_state(state, block) == []
+    assert set(state.cache) == {A, B, C}
+    assert state.cache[B].storage_cache[3] == 9
+    assert state.cache[B].storage_cache[0x105] == 0
+    # The scan is kept in the code cache by code hash
+    assert env.code_cache.entries[(utils.sha3(CODE), b'slots')][0] == \
+        (3, 0x105)
+    state = State(state.trie.root_hash, env)
+    prefetch_block_state(state, block)
+    assert env.code_cache.hits == 1
+    assert state.cache[B].storage_cache[3] == 9
+
+
+def test_prefetch_threads_fill_state_cache(tmpdir):
+    config = dict(default_config, PREFETCH_THREADS=2)
+    env = Env(FileDB(str(tmpdir.join('chain.db'))), config)
+    state = State(env=env, executing_on_head=True)
+    state.set_code(B, CODE)
+    state.set_storage_data(B, 3, 9)
+    state.commit()
+    root = state.trie.root_hash
+    # A head whose warm entries were all evicted
+    env.state_cache.clear()
+    env.state_cache.root = root
+    state = State(root, env, executing_on_head=True)
+    block = FakeBlock(C, [FakeTx(A, B)])
+    pending = prefetch_block_state(state, block)
+    assert len(pending) == 3
+    wait(pending)
+    assert store_prefetched(state, pending) == []
+    warm = env.state_cache
+    assert warm.get_account(root, B)[3] == utils.sha3(CODE)
+    assert warm.get_account(root, A) is None
+    assert warm.get_storage(root, B, 3) == 9
+    assert warm.get_storage(root, B, 0x105) == 0
+    # Loads read at an older root are dropped
+    pending = prefetch_block_state(state, block)
+    wait(pending)
+    state.set_balance(A, 1)
+    state.commit()
+    warm.clear()
+    warm.root = state.trie.root_hash
+    store_prefetched(state, pending)
+    assert warm.get_account(warm.root, B) is None
+    env.close()
+    with pytest.raises(RuntimeError):
+        prefetch_block_state(state, block)
@@ -0,0 +1,34 @@
+from ethereum import utils
+from ethereum.common import mk_receipt_sha
+from ethereum.config import Env
+from ethereum.db import EphemDB
+from ethereum.state import State
+from ethereum.trie import BLANK_ROOT
+
+
+def test_root_follows_receipts():
+    items = [utils.sha3(utils.encode_int(i)) for i in range(40)]
+    state = State(env=Env(EphemDB()))
+    assert state.receipts_trie.root_hash == BLANK_ROOT
+    for item in items[:5]:
+        state.add_receipt(item)
+    snapshot = state.snapshot()
+    # appended, as during block execution
+    for item in items[5:]:
+        state.add_receipt(item)
+    assert state.receipts_trie.root_hash == mk_receipt_sha(items)
+    # reverted, within the block and across the start of the next one
+    state.revert(snapshot)
+    assert state.receipts_trie.root_hash == mk_receipt_sha(items[:5])
+    state.reset_receipts()
+    state.add_receipt(b'other')
+    assert state.receipts_trie.root_hash == mk_receipt_sha([b'other'])
+    state.revert(snapshot)
+    assert state.receipts == items[:5]
+    assert state.receipts_trie.root_hash == mk_receipt_sha(items[:5])
+    # a fork adds its own
+    child = state.fork()
+    child.add_receipt(b'other')
+    assert child.receipts_trie.root_hash == \
+        mk_receipt_sha(items[:5] + [b'other'])
+    assert state.receipts_trie.root_hash == mk_receipt_sha(items[:5])
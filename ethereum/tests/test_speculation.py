@@ -0,0 +1,34 @@
+from ethereum.config import Env, config_metropolis
+from ethereum.tools import tester
+from ethereum.utils import big_endian_to_int
+
+# Deploys code storing the call value at the caller's slot:
+# CALLVALUE CALLER SSTORE
+STORE_VALUE = b'\x62\x34\x33\x55\x60\x00\x52\x60\x03\x60\x1d\xf3'
+
+
+def test_speculative_block_matches_serial():
+    config = dict(config_metropolis)
+    config['TX_EXECUTION_PROCESSES'] = 2
+    c = tester.Chain(env=Env(config=config))
+    contract = c.contract(STORE_VALUE, language='evm')
+    c.mine()
+    # The tester executes these serially; the chain executes the mined
+    # block speculatively and checks the roots, receipts and bloom
+    c.tx(tester.k1, tester.a2, 10)
+    # reads an account written by the previous transaction
+    c.tx(tester.k2, tester.a3, 5)
+    # different slots of the same contract
+    c.tx(tester.k3, contract, 7)
+    c.tx(tester.k4, contract, 8)
+    # the same slot again
+    c.tx(tester.k4, contract, 9)
+    # accesses the coinbase, which earlier fees were paid to
+    c.tx(tester.k0, tester.a5, 1)
+    block = c.mine()
+    assert c.chain.head_hash == block.hash
+    state = c.chain.state
+    assert state.get_storage_data(
+        contract, big_endian_to_int(tester.a3)) == 7
+    assert state.get_storage_data(
+        contract, big_endian_to_int(tester.a4)) == 9
@@ -0,0 +1,76 @@
+from ethereum.config import Env
+from ethereum.state import State
+
+A = b'\x11' * 20
+B = b'\x22' * 20
+
+
+def test_commit_visits_writes_only():
+    state = State(env=Env())
+    state.set_balance(A, 1)
+    state.set_storage_data(A, 1, 5)
+    state.set_storage_data(A, 2, 6)
+    state.commit()
+    root = state.trie.root_hash
+
+    state.get_balance(B)
+    assert state.get_storage_data(A, 1) == 5
+    state.set_storage_data(A, 2, 7)
+    assert state.dirty_accounts == {A}
+    assert state.cache[A].dirty_storage_items() == [(2, 7)]
+    state.commit()
+    assert state.get_storage_data(A, 1) == 5
+    assert state.get_storage_data(A, 2) == 7
+
+    # a reverted write leaves the state as it was
+    snapshot = state.snapshot()
+    state.set_balance(B, 3)
+    state.revert(snapshot)
+    state.commit()
+    state.set_storage_data(A, 2, 6)
+    state.commit()
+    assert state.trie.root_hash == root
+
+
+def test_warm_cache():
+    state = State(env=Env(), executing_on_head=True)
+    state.set_balance(A, 1)
+    state.set_storage_data(A, 1, 5)
+    state.commit()
+    warm = state.env.state_cache
+    assert warm.root == state.trie.root_hash
+    assert state.get_balance(A) == 1
+    assert state.get_storage_data(A, 1) == 5
+    assert (warm.hits, warm.misses) == (2, 0)
+
+    # only the head state moves the cache forward
+    other = State(state.trie.root_hash, state.env)
+    other.set_balance(A, 2)
+    other.commit()
+    assert warm.root == state.trie.root_hash
+    assert State(other.trie.root_hash, state.env).get_balance(A) == 2
+
+    # the head committing on top of another root starts over
+    head = State(other.trie.root_hash, state.env, executing_on_head=True)
+    head.set_balance(B, 1)
+    head.commit()
+    assert warm.root == head.trie.root_hash
+    assert A not in warm.accounts
+
+
+def test_account_rlp():
+    from ethereum.state import _Account, encode_account, decode_account
+    import rlp
+    for fields in [(0, 0, b'\x01' * 32, b'\x02' * 32),
+                   (7, 10 ** 20, b'\x03' * 32, b'\x04' * 32)]:
+        rlpdata = encode_account(*fields)
+        assert rlpdata == rlp.encode(_Account(*fields))
+        assert decode_account(rlpdata) == fields
+
+    # storage tries are only created when needed
+    state = State(env=Env())
+    state.set_balance(A, 1)
+    state.commit()
+    acct = state.get_and_cache_account(A)
+    assert acct._storage_trie is None
+    assert not hasattr(acct, '__dict__')
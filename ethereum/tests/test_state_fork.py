@@ -0,0 +1,80 @@
+import gc
+
+from ethereum.config import Env
+from ethereum.state import State
+
+A = b'\x11' * 20
+B = b'\x22' * 20
+
+
+def mk_state():
+    state = State(env=Env())
+    state.set_balance(A, 100)
+    state.set_storage_data(A, 1, 7)
+    state.commit()
+    return state
+
+
+def test_fork_isolation():
+    state = mk_state()
+    state.get_balance(A)
+    state.set_balance(B, 3)
+    child = state.fork()
+    # uncommitted changes of the parent are visible in the fork
+    assert child.get_balance(B) == 3
+    # the unchanged account is shared until written
+    assert child.cache[A] is state.cache[A]
+
+    child.set_balance(A, 1)
+    child.set_storage_data(A, 1, 8)
+    child.set_balance(B, 4)
+    assert state.get_balance(A) == 100
+    assert state.get_storage_data(A, 1) == 7
+    assert state.get_balance(B) == 3
+
+    state.set_storage_data(A, 1, 9)
+    assert child.get_storage_data(A, 1) == 8
+
+    child.commit()
+    state.commit()
+    assert child.trie.root_hash != state.trie.root_hash
+    assert child.trie.root_hash in child.env.trie_db
+    assert child.trie.root_hash not in state.env.trie_db
+
+
+def test_fork_revert():
+    state = mk_state()
+    child = state.fork()
+    snapshot = child.snapshot()
+    child.set_storage_data(A, 1, 0)
+    child.add_log('log')
+    child.revert(snapshot)
+    assert child.get_storage_data(A, 1) == 7
+    assert child.logs == [] and state.logs == []
+
+
+def test_parent_writes_after_fork():
+    state = mk_state()
+    state.get_balance(A)
+    state.get_balance(B)
+    child = state.fork()
+    # while the fork caches it, the parent writes to its own copy
+    shared = state.cache[A]
+    state.set_balance(A, 1)
+    assert state.cache[A] is not shared
+    assert child.get_balance(A) == 100
+    # once the fork is gone the parent writes in place, copying nothing
+    shared = state.cache[B]
+    del child
+    gc.collect()
+    state.set_balance(B, 2)
+    assert state.cache[B] is shared
+
+    state.commit()
+    state.get_balance(A)
+    child = state.fork()
+    shared = child.cache[A]
+    child.commit()
+    state.set_balance(A, 5)
+    assert state.cache[A] is shared
+    assert child.get_balance(A) == 1
@@ -0,0 +1,33 @@
+from ethereum.config import Env
+from ethereum.state import State
+
+A = b'\x11' * 20
+
+
+def test_nested_revert():
+    state = State(env=Env())
+    state.set_balance(A, 10)
+    state.set_storage_data(A, 1, 5)
+    outer = state.snapshot()
+    state.set_code(A, b'\x60\x00')
+    state.add_log('a')
+    logs = state.logs
+    state.add_refund(3)
+    inner = state.snapshot()
+    state.set_storage_data(A, 1, 6)
+    state.reset_storage(A)
+    state.add_refund(4)
+    state.revert(inner)
+    assert state.get_storage_data(A, 1) == 5
+    assert state.refunds == 3
+    assert state.get_code(A) == b'\x60\x00'
+
+    # the list an append went to is undone even after it was replaced, here
+    # by restoring the inner snapshot
+    assert state.logs is not logs
+    state.revert(outer)
+    assert logs == []
+    assert state.refunds == 0
+    assert state.get_code(A) == b''
+    assert state.get_balance(A) == 10
+    assert len(state.journal) == outer[1]
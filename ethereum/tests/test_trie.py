@@ -50,7 +50,8 @@ def run_test(name, pairs):
     for i, permut in enumerate(itertools.permutations(pairs['in'])):
         if i > N_PERMUTATIONS:
             break
-        t = trie.Trie(db.EphemDB())
+        # lazy tries must come to the same root as eagerly hashed ones
+        t = trie.Trie(db.EphemDB(), lazy=bool(i % 2))
         for k, v in permut:
             #logger.debug('updating with (%s, %s)' %(k, v))
             if v is not None:
@@ -64,6 +65,25 @@ def run_test(name, pairs):
             raise Exception("Mismatch: %r %r %r %r" % (
                 name, pairs['root'], '0x' + encode_hex(t.root_hash), (i, list(permut) + deletes)))
 
+    # building from the sorted final contents must give the same root
+    t = trie.Trie.from_sorted_items(db.EphemDB(), sorted(t.to_dict().items()))
+    if pairs['root'] != '0x' + encode_hex(t.root_hash):
+        raise Exception("Sorted build mismatch: %r %r %r" % (
+            name, pairs['root'], '0x' + encode_hex(t.root_hash)))
+
+
+def test_nibble_paths():
+    nibbles = trie.bin_to_nibbles(b'\x01\x23\xab')
+    assert nibbles == b'\x00\x01\x02\x03\x0a\x0b'
+    assert trie.nibbles_to_bin(nibbles) == b'\x01\x23\xab'
+    for path in (nibbles, nibbles[1:], trie.with_terminator(nibbles[1:])):
+        assert trie.unpack_to_nibbles(trie.pack_nibbles(path)) == path
+    assert trie.without_terminator(trie.with_terminator(nibbles)) == nibbles
+    assert trie.common_prefix_length(nibbles, nibbles) == 6
+    assert trie.common_prefix_length(nibbles, nibbles[:3] + b'\x0f') == 3
+    assert trie.common_prefix_length(nibbles, b'\x01') == 0
+    assert trie.common_prefix_length(nibbles, b'') == 0
+
 
 if __name__ == '__main__':
     for name, pairs in load_tests().items():
@@ -0,0 +1,43 @@
+import random
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+import ethereum.trie as trie
+from ethereum.config import Env, default_config
+from ethereum.db import EphemDB, RefcountDB
+from ethereum.utils import sha3
+
+
+def test_parallel_commit():
+    rng = random.Random(3)
+    items = [(sha3(str(i).encode()), b'v' * rng.randrange(1, 50))
+             for i in range(3000)]
+    serial = trie.Trie(RefcountDB(EphemDB()), lazy=True)
+    with ProcessPoolExecutor(2) as executor:
+        parallel = trie.Trie(RefcountDB(EphemDB()), lazy=True,
+                             executor=executor)
+        for t in (serial, parallel):
+            for k, v in items:
+                t.update(k, v)
+            t.commit()
+        assert parallel.root_hash == serial.root_hash
+        # node reference counts must match too
+        assert parallel.db.db.db == serial.db.db.db
+
+        # too few updates for the executor to be worthwhile
+        for t in (serial, parallel):
+            for k, v in items[:10]:
+                t.update(k, b'changed')
+        assert parallel.root_hash == serial.root_hash
+
+
+def test_env_owns_commit_pool():
+    config = dict(default_config, TRIE_COMMIT_PROCESSES=2)
+    env = Env(config=config)
+    assert env.trie_executor is not Env(config=config).trie_executor
+    fork = env.fork()
+    assert fork.trie_executor is env.trie_executor
+    fork.close()
+    assert env.trie_executor.submit(abs, -1).result() == 1
+    env.close()
+    with pytest.raises(RuntimeError):
+        env.trie_executor.submit(abs, -1)
@@ -46,3 +46,29 @@ def run_test(name):
 
 def test_basic():
     run_test('basic')
+
+
+def test_iter_range():
+    t = trie.Trie(EphemDB())
+    words = [b'cat', b'cattle', b'dog', b'doge', b'do', b'horse', b'ox']
+    for w in words:
+        t.update(w, w.upper())
+    assert list(t.iter_range()) == [(w, w.upper()) for w in sorted(words)]
+    assert [k for k, _ in t.iter_range(b'cau', b'horse')] == \
+        [b'do', b'dog', b'doge']
+    assert [k for k, _ in t.iter_range(b'd', limit=2)] == [b'do', b'dog']
+    assert list(t.iter_range(b'p')) == []
+
+
+def test_get_range_pages():
+    t = trie.Trie(EphemDB())
+    for i in range(100):
+        t.update(to_string(i), to_string(i))
+    keys, token = [], None
+    while True:
+        page, token = t.get_range(limit=7, token=token)
+        assert len(page) <= 7
+        keys.extend(k for k, _ in page)
+        if token is None:
+            break
+    assert keys == sorted(to_string(i) for i in range(100))
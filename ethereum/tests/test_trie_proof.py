@@ -0,0 +1,66 @@
+import random
+import pytest
+import ethereum.trie as trie
+from ethereum.db import EphemDB
+from ethereum.securetrie import SecureTrie
+from ethereum.utils import sha3
+
+
+def mk_trie(n, lazy=False):
+    rng = random.Random(n)
+    t = trie.Trie(EphemDB(), lazy=lazy)
+    items = {}
+    for _ in range(n):
+        k = bytes(bytearray(rng.randrange(256)
+                            for _ in range(rng.choice([1, 2, 32]))))
+        items[k] = k * rng.choice([1, 3])
+        t.update(k, items[k])
+    return t, items
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_proof(lazy):
+    t, items = mk_trie(200, lazy)
+    root = t.root_hash
+    for k, v in items.items():
+        assert trie.verify_proof(root, k, t.get_proof(k)) == v
+    # absence proofs
+    for k in (b'', b'\x00' * 33, b'\xff\xff\xff'):
+        if k not in items:
+            proof = t.get_proof(k)
+            assert trie.verify_proof(root, k, proof) == trie.BLANK_NODE
+
+
+def test_proof_missing_node():
+    t, items = mk_trie(200)
+    k = sorted(items)[100]
+    proof = t.get_proof(k)
+    assert len(proof) > 1
+    with pytest.raises(trie.InvalidProof):
+        trie.verify_proof(t.root_hash, k, proof[:-1])
+    with pytest.raises(trie.InvalidProof):
+        trie.verify_proof(sha3(b'other root'), k, proof)
+
+
+def test_multiproof():
+    t, items = mk_trie(300)
+    keys = sorted(items)[::7] + [b'\x42' * 5]
+    proof = t.get_multiproof(keys)
+    assert len(proof) == len(set(proof))
+    assert len(proof) < sum(len(t.get_proof(k)) for k in keys)
+    values = trie.verify_multiproof(t.root_hash, keys, proof)
+    assert values == [items.get(k, trie.BLANK_NODE) for k in keys]
+
+
+def test_blank_trie_proof():
+    t = trie.Trie(EphemDB())
+    assert t.get_proof(b'dog') == []
+    assert trie.verify_proof(trie.BLANK_ROOT, b'dog', []) == trie.BLANK_NODE
+
+
+def test_secure_trie_proof():
+    t = SecureTrie(trie.Trie(EphemDB()))
+    for i in range(50):
+        t.update(str(i).encode(), b'value %d' % i)
+    proof = t.get_proof(b'7')
+    assert trie.verify_proof(t.root_hash, sha3(b'7'), proof) == b'value 7'
@@ -0,0 +1,32 @@
+from ethereum import opcodes, vm
+from ethereum.tools import vm_benchmark
+
+
+def test_handler_table_covers_opcodes():
+    for op in range(256):
+        if op in opcodes.opcodes:
+            name, ins, outs, fee = opcodes.opcodes[op]
+            assert vm.OP_NAMES[op] == name
+            assert vm.OP_HANDLERS[op] is not None
+            assert vm.OP_FEES[op] == fee
+            assert vm.OP_INS[op] == ins
+            assert vm.OP_GROWTH[op] == outs - ins
+        else:
+            assert vm.OP_HANDLERS[op] is None
+
+
+def test_stack_ops():
+    ext = vm_benchmark.BenchExt()
+    msg = vm.Message(b'\x00' * 20, b'\x00' * 20, 0, 10 ** 6, vm.CallData([]))
+    # 1 2 3 DUP3 SWAP1 SUB leaves 3 - 1 on top, which is returned
+    code = bytes(bytearray([0x60, 1, 0x60, 2, 0x60, 3, 0x82, 0x90, 0x03,
+                            0x60, 0, 0x52, 0x60, 32, 0x60, 0, 0xf3]))
+    success, gas, data = vm.vm_execute(ext, msg, code)
+    assert success == 1
+    assert data[-1] == 2
+
+
+def test_benchmark_runs(capsys):
+    vm_benchmark.main(['--rounds', '1', 'ADD', 'DUP2'])
+    out = capsys.readouterr()[0]
+    assert 'ADD' in out and 'DUP2' in out
@@ -0,0 +1,38 @@
+import ethereum.tools.new_statetest_utils as new_statetest_utils
+import ethereum.tools.testutils as testutils
+from ethereum.vm import VM_ENGINES
+
+from ethereum.slogging import get_logger
+logger = get_logger()
+
+place_to_check = 'GeneralStateTests'
+
+
+def test_state(filename, testname, testdata):
+    for engine in sorted(VM_ENGINES):
+        if engine == 'vm':
+            # Run by test_state.py
+            continue
+        logger.debug('running test:%r in %r with %s' %
+                     (testname, filename, engine))
+        try:
+            new_statetest_utils.verify_state_test(testdata, engine)
+        except new_statetest_utils.EnvNotFoundException:
+            pass
+
+
+def pytest_generate_tests(metafunc):
+    testutils.generate_test_params(
+        place_to_check,
+        metafunc,
+        exclude_func=lambda filename, _, __: (
+            'stQuadraticComplexityTest' in filename or  # Takes too long
+            'stMemoryStressTest' in filename or  # We run out of memory
+            'MLOAD_Bounds.json' in filename or  # We run out of memory
+            # Not passed by the default engine either, see test_state.py
+            'failed_tx_xcf416c53' in filename or
+            'RevertDepthCreateAddressCollision.json' in filename or
+            'pairingTest.json' in filename or
+            'createJS_ExampleContract' in filename
+        )
+    )
@@ -154,7 +154,7 @@ class EnvNotFoundException(Exception):
 # Verify a state test
 
 
-def verify_state_test(test):
+def verify_state_test(test, vm_engine=None):
     print("Verifying state test")
     if "env" not in test:
         raise EnvNotFoundException("Env not found")
@@ -163,6 +163,9 @@ def verify_state_test(test):
         # Old protocol versions may not be supported
         if config_name not in configs:
             continue
+        config = configs[config_name]
+        if vm_engine is not None:
+            config = dict(config, VM_ENGINE=vm_engine)
         print("Testing for %s" % config_name)
         for result in results:
             data = test["transaction"]['data'][result["indexes"]["data"]]
@@ -178,7 +181,7 @@ def verify_state_test(test):
                   result["indexes"]["value"],
                   result["indexes"]["data"]))
             computed = compute_state_test_unit(
-                _state, test["transaction"], result["indexes"], configs[config_name])
+                _state, test["transaction"], result["indexes"], config)
             if computed["hash"][-64:] != result["hash"][-64:]:
                 for k in computed["diff"]:
                     print(k, computed["diff"][k])
@@ -0,0 +1,110 @@
+"""Time of applying a block with and without speculative execution
+
+A block of transactions from different senders, each running a loop in
+the same contract, is applied serially and with each given number of
+worker processes. The cost of starting and stopping the workers of one
+block is timed on its own as well, next to that of a multiprocessing.Pool
+of the same size. Usage:
+
+    python -m ethereum.tools.speculation_benchmark [--txs N]
+        [--loops N] [--rounds N] [PROCESSES...]
+
+Speculation only gains with a core free for each worker; on fewer cores
+the workers take turns, and the block takes at least as long as serially.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import timeit
+
+from ethereum.config import Env, config_metropolis
+from ethereum.meta import apply_block
+from ethereum.speculation import _fork_worker
+from ethereum.tools import tester
+
+
+def mk_loop(loops):
+    """init code deploying code that counts down from loops to zero"""
+    # PUSH3 loops, JUMPDEST, PUSH1 1 SWAP1 SUB DUP1 PUSH1 4 JUMPI, STOP
+    runtime = b'\x62' + loops.to_bytes(3, 'big') + \
+        b'\x5b\x60\x01\x90\x03\x80\x60\x04\x57\x00'
+    size = len(runtime)
+    return bytes(bytearray([0x60, size, 0x60, 12, 0x60, 0, 0x39,
+                            0x60, size, 0x60, 0, 0xf3])) + runtime
+
+
+def mk_block(txs, loops):
+    """a chain, and a block calling the loop once from each of txs keys"""
+    c = tester.Chain(env=Env(config=config_metropolis))
+    contract = c.contract(mk_loop(loops), language='evm')
+    c.mine()
+    for key in tester.keys[:txs]:
+        c.tx(key, contract, startgas=30 * loops + 50000)
+    return c.chain, c.mine()
+
+
+def time_block(chain, block, processes, rounds):
+    best = None
+    for _ in range(rounds):
+        state = chain.mk_poststate_of_blockhash(block.header.prevhash).fork()
+        state.env.config = dict(state.env.config,
+                                TX_EXECUTION_PROCESSES=processes)
+        start = timeit.default_timer()
+        apply_block(state, block)
+        elapsed = timeit.default_timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def time_workers(chain, block, processes, rounds):
+    """the least time to start and stop the workers of a block
+
+    Forked workers, given no transactions to execute, and a Pool.
+    """
+    state = chain.mk_poststate_of_blockhash(block.header.prevhash)
+    ctx = multiprocessing.get_context('fork')
+
+    def fork():
+        workers = [_fork_worker(state, [], first, processes)
+                   for first in range(processes)]
+        for pid, stream in workers:
+            stream.close()
+            os.waitpid(pid, 0)
+
+    def pool():
+        p = ctx.Pool(processes)
+        p.map(abs, range(processes))
+        p.terminate()
+    return tuple(min(timeit.repeat(f, number=1, repeat=rounds))
+                 for f in (fork, pool))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--txs', type=int, default=len(tester.keys))
+    parser.add_argument('--loops', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('processes', type=int, nargs='*', default=[2, 4])
+    args = parser.parse_args(args)
+    if not 1 < args.txs <= len(tester.keys):
+        parser.error('--txs must be 2 to %d' % len(tester.keys))
+    if not hasattr(os, 'fork'):
+        parser.error('speculation needs os.fork')
+
+    chain, block = mk_block(args.txs, args.loops)
+    print('%d cores, %d transactions' % (multiprocessing.cpu_count(),
+                                         len(block.transactions)))
+    print('%-10s%12s%12s%12s' % ('processes', 'block ms', 'workers ms',
+                                 'Pool ms'))
+    serial = time_block(chain, block, 0, args.rounds)
+    print('%-10s%12.1f' % ('serial', serial * 1e3))
+    for processes in args.processes:
+        times = (time_block(chain, block, processes, args.rounds),) + \
+            time_workers(chain, block, processes, args.rounds)
+        print('%-10d%12.1f%12.1f%12.1f' % ((processes,) +
+                                           tuple(t * 1e3 for t in times)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -149,7 +149,7 @@ class State(object):
         self.state.commit()
         sender_addr = privtoaddr(sender)
         result = apply_message(
-            self.state.ephemeral_clone(),
+            self.state.fork(),
             sender=sender_addr,
             to=to,
             code_address=to,
@@ -175,7 +175,7 @@ class Chain(object):
         self.cs = get_consensus_strategy(self.chain.env.config)
         self.block = mk_block_from_prevstate(
             self.chain, timestamp=self.chain.state.timestamp + 1)
-        self.head_state = self.chain.state.ephemeral_clone()
+        self.head_state = self.chain.state.fork()
         self.cs.initialize(self.head_state, self.block)
         self.last_sender = None
         self.last_tx = None
@@ -208,7 +208,7 @@ class Chain(object):
         to = normalize_address(to)
         sender_addr = privtoaddr(sender)
         result = apply_message(
-            self.head_state.ephemeral_clone(),
+            self.head_state.fork(),
             sender=sender_addr,
             to=to,
             code_address=to,
@@ -275,7 +275,7 @@ class Chain(object):
 
     def change_head(self, parent, coinbase=a0):
         self.head_state = self.chain.mk_poststate_of_blockhash(
-            parent).ephemeral_clone()
+            parent).fork()
         self.block = mk_block_from_prevstate(
             self.chain,
             self.head_state,
@@ -0,0 +1,207 @@
+"""Per-opcode throughput of EVM interpreters
+
+Every opcode is timed on straight-line code repeating it, with the pushes
+of its arguments and the pops of its results; times are per repetition of
+the opcode and those pushes and pops. Usage:
+
+    python -m ethereum.tools.vm_benchmark [--engine NAME ...]
+        [--baseline OLD_VM_PY] [--fixtures PATH] [OPS...]
+    python -m ethereum.tools.vm_benchmark --dispatch HEX_FILE...
+
+Engines are named as in the VM_ENGINE setting. With --baseline, the
+vm_execute of another copy of vm.py, e.g. one saved with
+`git show <rev>:ethereum/vm.py`, is timed as well for comparison. With
+--fixtures, state test fixtures are run with each engine instead, and the
+time per fixture file is shown. With --dispatch, fastvm's basic blocks of
+contract code, given as hex, are counted along with the handler calls per
+block before and after superinstruction fusion.
+"""
+import argparse
+import contextlib
+import os
+import sys
+import timeit
+
+from ethereum import opcodes, vm
+from ethereum.code_cache import CodeCache
+from ethereum.utils import decode_hex, encode_int32, \
+    remove_0x_head, sha3
+
+# Not timed: they leave the code, or need a full state behind them
+SKIPPED = {'STOP', 'RETURN', 'REVERT', 'SUICIDE', 'JUMP', 'JUMPI',
+           'CREATE', 'CALL', 'CALLCODE', 'DELEGATECALL', 'STATICCALL',
+           'CALLBLACKBOX', 'RETURNDATACOPY'}
+REPEAT = 2000
+# Untimed runs first, for engines compiling code once it has run often
+WARMUP = 10
+
+
+class BenchExt(object):
+    """the environment of a contract, without a state behind it"""
+
+    def __init__(self, code=None):
+        self.storage = {}
+        # Analyses are cached if the code run is known
+        self.code_cache = CodeCache(16 * 1024 * 1024) \
+            if code is not None else None
+        self.get_code_hash = lambda addr: sha3(code)
+        self.get_code = lambda addr: b'\x00' * 64
+        self.get_balance = lambda addr: 10 ** 18
+        self.set_balance = lambda addr, balance: None
+        self.get_storage_data = lambda addr, key: self.storage.get(key, 0)
+        self.set_storage_data = lambda addr, key, value: \
+            self.storage.__setitem__(key, value)
+        self.add_refund = lambda x: None
+        self.log = lambda addr, topics, data: None
+        self.log_storage = lambda addr: {}
+        self.block_hash = lambda n: b'\x00' * 32
+        self.block_coinbase = b'\x00' * 20
+        self.block_timestamp = 0
+        self.block_number = 0
+        self.block_difficulty = 0
+        self.block_gas_limit = 0
+        self.tx_origin = b'\x00' * 20
+        self.tx_gasprice = 0
+        self.account_exists = lambda addr: True
+        self.post_homestead_hardfork = lambda: True
+        self.post_anti_dos_hardfork = lambda: True
+        self.post_spurious_dragon_hardfork = lambda: True
+        self.post_metropolis_hardfork = lambda: True
+        self.post_constantinople_hardfork = lambda: False
+
+
+def mk_code(opcode, repeat=REPEAT):
+    """straight-line code running an opcode `repeat` times"""
+    name, ins, outs, _ = opcodes.opcodes[opcode]
+    body = bytearray([opcode])
+    if name.startswith('PUSH'):
+        body += b'\x01' * (opcode - 0x5f)
+    # Small arguments keep memory offsets, sizes and exponents cheap
+    pushes = b'\x60\x01' * ins
+    pops = b'\x50' * outs
+    return bytes(bytearray(pushes + body + pops) * repeat)
+
+
+def time_code(execute, code, rounds):
+    ext = BenchExt(code)
+    best = None
+    for i in range(WARMUP + rounds):
+        msg = vm.Message(b'\x00' * 20, b'\x00' * 20, 0, 10 ** 12,
+                         vm.CallData(list(encode_int32(1))))
+        start = timeit.default_timer()
+        result = execute(ext, msg, code)
+        elapsed = timeit.default_timer() - start
+        assert result[0] == 1, 'benchmark code failed'
+        if i >= WARMUP:
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+@contextlib.contextmanager
+def _quiet():
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def time_fixtures(engine, tests, rounds):
+    from ethereum.tools import new_statetest_utils
+    best = None
+    for _ in range(rounds):
+        start = timeit.default_timer()
+        with _quiet():
+            for test in tests.values():
+                try:
+                    new_statetest_utils.verify_state_test(test, engine)
+                except new_statetest_utils.EnvNotFoundException:
+                    pass
+        elapsed = timeit.default_timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def load_vm(path):
+    import imp
+    return imp.load_source('baseline_vm', path)
+
+
+def print_row(label, times, unit):
+    line = '%-14s' % label + ''.join('%12.0f' % (t * unit) for t in times)
+    # Speedups over the first engine
+    line += ''.join('%9.2fx' % (times[0] / t) if t else '%10s' % '-'
+                    for t in times[1:])
+    print(line)
+
+
+def count_dispatches(paths):
+    from ethereum import fastvm
+    print('%-14s%8s%8s%10s%10s%8s' % (
+        'code', 'blocks', 'ops', 'ops/blk', 'fused/blk', 'saved'))
+    total = [0, 0, 0]
+    for path in paths:
+        with open(path) as f:
+            code = decode_hex(remove_0x_head(''.join(f.read().split())))
+        counts = fastvm.dispatch_counts(code)
+        total = [a + b for a, b in zip(total, counts)]
+        label = os.path.splitext(os.path.basename(path))[0]
+        print_counts(label[:14], *counts)
+    print_counts('(total)', *total)
+
+
+def print_counts(label, blocks, ops, fused):
+    print('%-14s%8d%8d%10.2f%10.2f%7.1f%%' % (
+        label, blocks, ops, ops / float(blocks or 1),
+        fused / float(blocks or 1), 100 - 100.0 * fused / (ops or 1)))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--engine', action='append',
+                        help='engine to time, see vm.VM_ENGINES')
+    parser.add_argument('--baseline', help='path of another vm.py')
+    parser.add_argument('--fixtures', help='state test file or directory')
+    parser.add_argument('--dispatch', nargs='+', metavar='HEX_FILE',
+                        help='count dispatches in contract code')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('ops', nargs='*', help='opcode names, e.g. ADD')
+    args = parser.parse_args(args)
+    if args.dispatch:
+        return count_dispatches(args.dispatch)
+
+    engines = [(e, vm.get_vm_engine(e)) for e in args.engine or ['vm']]
+    if args.baseline:
+        if args.fixtures:
+            parser.error('--baseline only times opcodes')
+        engines.insert(0, ('baseline', load_vm(args.baseline).vm_execute))
+    header = ''.join('%12s' % e for e, _ in engines) + \
+        ''.join('%10s' % e for e, _ in engines[1:])
+
+    if args.fixtures:
+        from ethereum.tools import testutils
+        print('%-14s' % 'ms/file' + header)
+        fixtures = testutils.get_tests_from_file_or_dir(args.fixtures, True)
+        total = [0] * len(engines)
+        for filename, tests in sorted(fixtures.items()):
+            times = [time_fixtures(e, tests, args.rounds) for e, _ in engines]
+            total = [a + b for a, b in zip(total, times)]
+            print_row(os.path.basename(filename)[:14], times, 1e3)
+        print_row('(total)', total, 1e3)
+        return
+
+    names = set(args.ops)
+    selected = [o for o in sorted(opcodes.opcodes)
+                if opcodes.opcodes[o][0] not in SKIPPED and
+                (not names or opcodes.opcodes[o][0] in names)]
+    print('%-14s' % 'ns/op' + header)
+    for opcode in selected:
+        code = mk_code(opcode)
+        times = [time_code(f, code, args.rounds) for _, f in engines]
+        print_row(opcodes.opcodes[opcode][0], times, 1e9 / REPEAT)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
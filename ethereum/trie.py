@@ -1,66 +1,66 @@
 #!/usr/bin/env python
+import binascii
 import os
 import rlp
 from ethereum import utils
 from ethereum.utils import to_string
 from ethereum.abi import is_string
 import copy
-from ethereum.utils import decode_hex, ascii_chr, str_to_bytes
+from ethereum.utils import decode_hex, ascii_chr, str_to_bytes, safe_ord
 from ethereum.utils import encode_hex
-from ethereum.fast_rlp import encode_optimized
+from ethereum.fast_rlp import encode_optimized, decode_optimized
+from ethereum.db import EphemDB
 rlp_encode = encode_optimized
 
-bin_to_nibbles_cache = {}
-
-hti = {}
-for i, c in enumerate(b'0123456789abcdef'):
-    hti[c] = i
-for i, c in enumerate('0123456789abcdef'):
-    hti[c] = i
+# Nibble paths are bytes objects holding one nibble (0..15, or the
+# terminator 16) per byte, so that slicing, concatenation, comparison and
+# prefix tests all run in C instead of building lists of ints
+NIBBLES_TO_HEX = bytes.maketrans(bytes(bytearray(range(16))),
+                                 b'0123456789abcdef')
+HEX_TO_NIBBLES = bytes.maketrans(b'0123456789abcdef',
+                                 bytes(bytearray(range(16))))
 
 
 def bin_to_nibbles(s):
     """convert string s to nibbles (half-bytes)
 
     >>> bin_to_nibbles("")
-    []
+    b''
     >>> bin_to_nibbles("h")
-    [6, 8]
+    b'\\x06\\x08'
     >>> bin_to_nibbles("he")
-    [6, 8, 6, 5]
+    b'\\x06\\x08\\x06\\x05'
     >>> bin_to_nibbles("hello")
-    [6, 8, 6, 5, 6, 12, 6, 12, 6, 15]
+    b'\\x06\\x08\\x06\\x05\\x06\\x0c\\x06\\x0c\\x06\\x0f'
     """
-    return [hti[c] for c in encode_hex(s)]
+    return binascii.hexlify(str_to_bytes(s)).translate(HEX_TO_NIBBLES)
 
 
 def nibbles_to_bin(nibbles):
-    if any(x > 15 or x < 0 for x in nibbles):
+    if not isinstance(nibbles, bytes):
+        nibbles = bytes(bytearray(nibbles))
+    if nibbles and max(nibbles) > 15:
         raise Exception("nibbles can only be [0,..15]")
 
     if len(nibbles) % 2:
         raise Exception("nibbles must be of even numbers")
 
-    res = b''
-    for i in range(0, len(nibbles), 2):
-        res += ascii_chr(16 * nibbles[i] + nibbles[i + 1])
-    return res
+    return binascii.unhexlify(nibbles.translate(NIBBLES_TO_HEX))
 
 
 NIBBLE_TERMINATOR = 16
+TERMINATOR_NIBBLES = b'\x10'
 
 
 def with_terminator(nibbles):
-    nibbles = nibbles[:]
-    if not nibbles or nibbles[-1] != NIBBLE_TERMINATOR:
-        nibbles.append(NIBBLE_TERMINATOR)
-    return nibbles
+    if nibbles[-1:] == TERMINATOR_NIBBLES:
+        return nibbles
+    return nibbles + TERMINATOR_NIBBLES
 
 
 def without_terminator(nibbles):
-    nibbles = nibbles[:]
-    if nibbles and nibbles[-1] == NIBBLE_TERMINATOR:
-        del nibbles[-1]
+    if nibbles[-1:] == TERMINATOR_NIBBLES:
+        return nibbles[:-1]
     return nibbles
 
 
@@ -77,7 +77,7 @@ def pack_nibbles(nibbles):
     :param nibbles: a nibbles sequence. may have a terminator
     """
 
-    if nibbles[-1:] == [NIBBLE_TERMINATOR]:
+    if nibbles[-1:] == TERMINATOR_NIBBLES:
         flags = 2
         nibbles = nibbles[:-1]
     else:
@@ -86,13 +86,10 @@ def pack_nibbles(nibbles):
     oddlen = len(nibbles) % 2
     flags |= oddlen   # set lowest bit if odd number of nibbles
     if oddlen:
-        nibbles = [flags] + nibbles
+        nibbles = ascii_chr(flags) + nibbles
     else:
-        nibbles = [flags, 0] + nibbles
-    o = b''
-    for i in range(0, len(nibbles), 2):
-        o += ascii_chr(16 * nibbles[i] + nibbles[i + 1])
-    return o
+        nibbles = ascii_chr(flags) + b'\x00' + nibbles
+    return binascii.unhexlify(nibbles.translate(NIBBLES_TO_HEX))
 
 
 def unpack_to_nibbles(bindata):
@@ -103,22 +100,37 @@ def unpack_to_nibbles(bindata):
     """
     o = bin_to_nibbles(bindata)
     flags = o[0]
-    if flags & 2:
-        o.append(NIBBLE_TERMINATOR)
     if flags & 1 == 1:
         o = o[1:]
     else:
         o = o[2:]
+    if flags & 2:
+        o += TERMINATOR_NIBBLES
     return o
 
 
+def has_terminator(bindata):
+    """test the terminator flag of packed nibbles without unpacking them
+    """
+    return bool(safe_ord(bindata[0]) & 0x20)
+
+
 def starts_with(full, part):
     """ test whether the items in the part is
     the leading items of the full
     """
-    if len(full) < len(part):
-        return False
-    return full[:len(part)] == part
+    return full.startswith(part)
+
+
+def common_prefix_length(a, b):
+    """length of the longest common prefix of two nibble paths
+    """
+    n = min(len(a), len(b))
+    diff = int.from_bytes(a[:n], 'big') ^ int.from_bytes(b[:n], 'big')
+    if not diff:
+        return n
+    # nibbles are stored one per byte, the highest differing byte wins
+    return n - 1 - (diff.bit_length() - 1) // 8
 
 
 (
@@ -136,17 +148,39 @@ def is_key_value_type(node_type):
 
 BLANK_NODE = b''
 BLANK_ROOT = utils.sha3rlp(b'')
+# Updates since the last commit from which an executor is used to commit
+PARALLEL_COMMIT_MIN_UPDATES = 1000
+
+
+class InvalidProof(Exception):
+    pass
+
+
+class DirtyNode(list):
+    """A node modified since the last commit of a lazy trie
+
+    Dirty nodes are referenced by their parent directly instead of by hash,
+    and are only encoded, hashed and stored when the trie is committed.
+    """
+    pass
 
 
 class Trie(object):
 
-    def __init__(self, db, root_hash=BLANK_ROOT):
+    def __init__(self, db, root_hash=BLANK_ROOT, lazy=False, executor=None):
         """it also present a dictionary like interface
 
         :param db key value database
         :root: blank or trie node in form of [key, value] or [v0,v1..v15,v]
+        :param lazy: keep modified nodes in memory and only hash and store
+            them when the root hash is requested or `commit` is called
+        :param executor: a `concurrent.futures` process pool, used by a lazy
+            trie to hash the subtrees below the root in parallel when
+            committing many updates
         """
         self.db = db  # Pass in a database object directly
+        self.lazy = lazy
+        self.executor = executor
         self.set_root_hash(root_hash)
         self.deletes = []
 
@@ -167,17 +201,86 @@ class Trie(object):
     def root_hash(self):
         """always empty or a 32 bytes string
         """
+        if self._dirty:
+            self.commit()
         return self._root_hash
 
     def get_root_hash(self):
-        return self._root_hash
+        return self.root_hash
 
     def _update_root_hash(self):
+        if self.lazy:
+            if not isinstance(self.root_node, DirtyNode) and \
+                    self.root_node != BLANK_NODE:
+                self.root_node = DirtyNode(self.root_node)
+            self._dirty = True
+            self._pending_updates += 1
+            return
         val = rlp_encode(self.root_node)
         key = utils.sha3(val)
         self.db.put(key, str_to_bytes(val))
         self._root_hash = key
 
+    def commit(self):
+        """hash and store all dirty nodes of a lazy trie
+        """
+        if not self._dirty:
+            return
+        with self.db.write_batch():
+            if self.executor is not None and \
+                    self._pending_updates >= PARALLEL_COMMIT_MIN_UPDATES:
+                self.root_node = self._commit_node_parallel(self.root_node)
+            else:
+                self.root_node = self._commit_node(self.root_node)
+            self._dirty = False
+            self._pending_updates = 0
+            val = rlp_encode(self.root_node)
+            key = utils.sha3(val)
+            self.db.put(key, str_to_bytes(val))
+            self._root_hash = key
+
+    def _commit_node(self, node):
+        """replace the in-memory children of a node by their encoding,
+        storing every child which is hashed
+
+        :param node: node in form of list, or BLANK_NODE
+        :return: the node, as it is stored in the database
+        """
+        node_type = self._get_node_type(node)
+        if node_type == NODE_TYPE_BRANCH:
+            return [self._commit_child(x) for x in node[:16]] + [node[16]]
+        if node_type == NODE_TYPE_EXTENSION:
+            return [node[0], self._commit_child(node[1])]
+        if node_type == NODE_TYPE_LEAF:
+            return list(node)
+        return node
+
+    def _commit_child(self, encoded):
+        if isinstance(encoded, list):
+            return self._hash_node(self._commit_node(encoded))
+        return encoded
+
+    def _commit_node_parallel(self, node):
+        """commit a node, hashing its dirty children in the executor
+
+        The subtrees below a branch node are independent, so each dirty
+        child is committed by a worker and the nodes it returns are stored
+        here.
+        """
+        if self._get_node_type(node) != NODE_TYPE_BRANCH:
+            return self._commit_node(node)
+        dirty = [i for i in range(16) if isinstance(node[i], DirtyNode)]
+        if len(dirty) < 2:
+            return self._commit_node(node)
+        node = list(node)
+        results = self.executor.map(
+            _commit_subtree, [node[i] for i in dirty])
+        for i, (encoded, puts) in zip(dirty, results):
+            for key, value in puts:
+                self.db.put(key, value)
+            node[i] = encoded
+        return self._commit_node(node)
+
     @root_hash.setter
     def root_hash(self, value):
         self.set_root_hash(value)
@@ -185,6 +288,8 @@ class Trie(object):
     def set_root_hash(self, root_hash):
         assert is_string(root_hash)
         assert len(root_hash) in [0, 32]
+        self._dirty = False
+        self._pending_updates = 0
         if root_hash == BLANK_ROOT:
             self.root_node = BLANK_NODE
             self._root_hash = BLANK_ROOT
@@ -199,6 +304,8 @@ class Trie(object):
         self._delete_node_storage(self.root_node)
         self.root_node = BLANK_NODE
         self._root_hash = BLANK_ROOT
+        self._dirty = False
+        self._pending_updates = 0
 
     def _delete_child_storage(self, node):
         node_type = self._get_node_type(node)
@@ -211,6 +318,12 @@ class Trie(object):
     def _encode_node(self, node, put_in_db=True):
         if node == BLANK_NODE:
             return BLANK_NODE
+        if self.lazy and put_in_db:
+            # Reference the node itself until the trie is committed
+            return node if isinstance(node, DirtyNode) else DirtyNode(node)
+        return self._hash_node(node, put_in_db)
+
+    def _hash_node(self, node, put_in_db=True):
         # assert isinstance(node, list)
         rlpnode = rlp_encode(node)
         if len(rlpnode) < 32:
@@ -225,9 +338,12 @@ class Trie(object):
         if encoded == BLANK_NODE:
             return BLANK_NODE
         if isinstance(encoded, list):
+            if self.lazy and not isinstance(encoded, DirtyNode):
+                # Embedded nodes are shared with the committed parent, so
+                # they must not be modified in place
+                return encoded[:]
             return encoded
-        o = rlp.decode(self.db.get(encoded))
-        return o
+        return self.db.get_node(encoded)
 
     def _get_node_type(self, node):
         """ get node type and content
@@ -239,9 +355,7 @@ class Trie(object):
             return NODE_TYPE_BLANK
 
         if len(node) == 2:
-            nibbles = unpack_to_nibbles(node[0])
-            has_terminator = (nibbles and nibbles[-1] == NIBBLE_TERMINATOR)
-            return NODE_TYPE_LEAF if has_terminator\
+            return NODE_TYPE_LEAF if has_terminator(node[0])\
                 else NODE_TYPE_EXTENSION
         if len(node) == 17:
             return NODE_TYPE_BRANCH
@@ -250,7 +364,7 @@ class Trie(object):
         """ get value inside a node
 
         :param node: node in form of list, or BLANK_NODE
-        :param key: nibble list without terminator
+        :param key: nibble path without terminator
         :return:
             BLANK_NODE if does not exist, otherwise value or hash
         """
@@ -283,8 +397,8 @@ class Trie(object):
         """ update item inside a node
 
         :param node: node in form of list, or BLANK_NODE
-        :param key: nibble list without terminator
-            .. note:: key may be []
+        :param key: nibble path without terminator
+            .. note:: key may be empty
         :param value: value string
         :return: new node
 
@@ -311,6 +425,9 @@ class Trie(object):
             return self._update_kv_node(node, key, value)
 
     def _update_and_delete_storage(self, node, key, value):
+        if isinstance(node, DirtyNode):
+            # Never stored, so there is nothing to delete
+            return self._update(node, key, value)
         old_node = node[:]
         new_node = self._update(node, key, value)
         if old_node != new_node:
@@ -322,23 +439,17 @@ class Trie(object):
         curr_key = without_terminator(unpack_to_nibbles(node[0]))
         is_inner = node_type == NODE_TYPE_EXTENSION
 
-        # find longest common prefix
-        prefix_length = 0
-        for i in range(min(len(curr_key), len(key))):
-            if key[i] != curr_key[i]:
-                break
-            prefix_length = i + 1
-
+        prefix_length = common_prefix_length(key, curr_key)
         remain_key = key[prefix_length:]
         remain_curr_key = curr_key[prefix_length:]
 
-        if remain_key == [] == remain_curr_key:
+        if not remain_key and not remain_curr_key:
             if not is_inner:
                 return [node[0], value]
             new_node = self._update_and_delete_storage(
                 self._decode_to_node(node[1]), remain_key, value)
 
-        elif remain_curr_key == []:
+        elif not remain_curr_key:
             if is_inner:
                 new_node = self._update_and_delete_storage(
                     self._decode_to_node(node[1]), remain_key, value)
@@ -361,7 +472,7 @@ class Trie(object):
                     node[1]
                 ])
 
-            if remain_key == []:
+            if not remain_key:
                 new_node[-1] = value
             else:
                 new_node[remain_key[0]] = self._encode_node([
@@ -375,7 +486,7 @@ class Trie(object):
         else:
             return new_node
 
-    def _getany(self, node, reverse=False, path=[]):
+    def _getany(self, node, reverse=False, path=b''):
         # print('getany', node, 'reverse=', reverse, path)
         node_type = self._get_node_type(node)
         if node_type == NODE_TYPE_BLANK:
@@ -383,7 +494,7 @@ class Trie(object):
         if node_type == NODE_TYPE_BRANCH:
             if node[16] and not reverse:
                 # print('found!', [16], path)
-                return [16]
+                return TERMINATOR_NIBBLES
             scan_range = list(range(16))
             if reverse:
                 scan_range.reverse()
@@ -392,13 +503,13 @@ class Trie(object):
                     self._decode_to_node(
                         node[i]),
                     reverse=reverse,
-                    path=path + [i])
+                    path=path + ascii_chr(i))
                 if o is not None:
                     # print('found@', [i] + o, path)
-                    return [i] + o
+                    return ascii_chr(i) + o
             if node[16] and reverse:
                 # print('found!', [16], path)
-                return [16]
+                return TERMINATOR_NIBBLES
             return None
         curr_key = without_terminator(unpack_to_nibbles(node[0]))
         if node_type == NODE_TYPE_LEAF:
@@ -473,8 +584,11 @@ class Trie(object):
     def split(self, key):
         key = bin_to_nibbles(key)
         r1, r2 = self._split(self.root_node, key)
-        t1, t2 = Trie(self.db), Trie(self.db)
+        t1, t2 = Trie(self.db, lazy=self.lazy), Trie(self.db, lazy=self.lazy)
         t1.root_node, t2.root_node = r1, r2
+        if self.lazy:
+            t1._update_root_hash()
+            t2._update_root_hash()
         return t1, t2
 
     def _merge(self, node1, node2):
@@ -489,12 +603,7 @@ class Trie(object):
         if node_type1 != NODE_TYPE_BRANCH and node_type2 != NODE_TYPE_BRANCH:
             descend_key1 = unpack_to_nibbles(node1[0])
             descend_key2 = unpack_to_nibbles(node2[0])
-            # find longest common prefix
-            prefix_length = 0
-            for i in range(min(len(descend_key1), len(descend_key2))):
-                if descend_key1[i] != descend_key2[i]:
-                    break
-                prefix_length = i + 1
+            prefix_length = common_prefix_length(descend_key1, descend_key2)
             if prefix_length:
                 sub1 = self._decode_to_node(
                     node1[1]) if node_type1 == NODE_TYPE_EXTENSION else node1[1]
@@ -533,11 +642,76 @@ class Trie(object):
 
     @classmethod
     def unsafe_merge(cls, trie1, trie2):
-        t = Trie(trie1.db)
+        t = Trie(trie1.db, lazy=trie1.lazy)
         t.root_node = t._merge(trie1.root_node, trie2.root_node)
+        if t.lazy:
+            t._update_root_hash()
+        return t
+
+    @classmethod
+    def from_sorted_items(cls, db, items):
+        """build a trie from (key, value) pairs in ascending key order
+
+        The branch nodes on the path of the latest key are kept on a stack
+        and a node is encoded and stored as soon as no later key can fall
+        below it, so every node is written exactly once.
+        """
+        t = cls(db)
+        with db.write_batch():
+            stack = []
+            prev_key = prev_value = None
+            for key, value in items:
+                key = bin_to_nibbles(to_string(key))
+                if prev_key is not None:
+                    if key <= prev_key:
+                        raise Exception("Keys must be sorted and unique")
+                    prefix_length = common_prefix_length(key, prev_key)
+                    t._add_sorted_item(stack, prev_key, prev_value,
+                                       prefix_length)
+                prev_key, prev_value = key, to_string(value)
+            if prev_key is not None:
+                t.root_node = t._add_sorted_item(stack, prev_key, prev_value)
+                t._update_root_hash()
         return t
 
-    def _iter(self, node, key, reverse=False, path=[]):
+    def _add_sorted_item(self, stack, key, value, next_prefix_length=None):
+        """add an item to the open branch nodes of a sorted build
+
+        :param stack: [depth, path, children] of the open branch nodes
+        :param next_prefix_length: length of the common prefix with the
+            next key, None for the last key
+        :return: the root node, once the last key has been added
+        """
+        limit = -1 if next_prefix_length is None else next_prefix_length
+        if limit >= 0 and (not stack or stack[-1][0] < limit):
+            stack.append([limit, key[:limit], [BLANK_NODE] * 17])
+        if not stack:
+            return [pack_nibbles(with_terminator(key)), value]
+        depth, path, children = stack[-1]
+        if len(key) == depth:
+            children[16] = value
+        else:
+            children[key[depth]] = self._encode_node(
+                [pack_nibbles(with_terminator(key[depth + 1:])), value])
+        # close the branch nodes the next key does not pass through
+        while stack and stack[-1][0] > limit:
+            depth, path, children = stack.pop()
+            if not stack:
+                if limit < 0:
+                    if not depth:
+                        return children
+                    return [pack_nibbles(path), self._encode_node(children)]
+                stack.append([limit, path[:limit], [BLANK_NODE] * 17])
+            elif stack[-1][0] < limit:
+                stack.append([limit, path[:limit], [BLANK_NODE] * 17])
+            parent_depth = stack[-1][0]
+            sub_node = children
+            if depth > parent_depth + 1:
+                sub_node = [pack_nibbles(path[parent_depth + 1:depth]),
+                            self._encode_node(children)]
+            stack[-1][2][path[parent_depth]] = self._encode_node(sub_node)
+
+    def _iter(self, node, key, reverse=False, path=b''):
         # print('iter', node, key, 'reverse =', reverse, 'path =', path)
         node_type = self._get_node_type(node)
 
@@ -548,10 +722,10 @@ class Trie(object):
             # print('b')
             if len(key):
                 sub_node = self._decode_to_node(node[key[0]])
-                o = self._iter(sub_node, key[1:], reverse, path + [key[0]])
+                o = self._iter(sub_node, key[1:], reverse, path + key[:1])
                 if o is not None:
                     # print('returning', [key[0]] + o, path)
-                    return [key[0]] + o
+                    return key[:1] + o
             if reverse:
                 scan_range = reversed(list(range(key[0] if len(key) else 0)))
             else:
@@ -559,13 +733,13 @@ class Trie(object):
             for i in scan_range:
                 sub_node = self._decode_to_node(node[i])
                 # print('prelim getany', path+[i])
-                o = self._getany(sub_node, reverse, path + [i])
+                o = self._getany(sub_node, reverse, path + ascii_chr(i))
                 if o is not None:
                     # print('returning', [i] + o, path)
-                    return [i] + o
+                    return ascii_chr(i) + o
             if reverse and key and node[16]:
                 # print('o')
-                return [16]
+                return TERMINATOR_NIBBLES
             return None
 
         descend_key = without_terminator(unpack_to_nibbles(node[0]))
@@ -597,6 +771,73 @@ class Trie(object):
             # print('returning@', descend_key + o if o else None, path)
             return descend_key + o if o else None
 
+    def iter_range(self, start=b'', end=None, limit=None):
+        """yield the (key, value) pairs with start <= key < end, in key order
+
+        The trie is walked once, depth first, keeping only the unvisited
+        siblings of the current path on a stack, and subtrees lying wholly
+        before start are never loaded.
+
+        :param end: exclusive upper bound, None for no bound
+        :param limit: maximum number of pairs, None for no limit
+        """
+        start = bin_to_nibbles(to_string(start))
+        end = None if end is None else bin_to_nibbles(to_string(end))
+        if limit is not None and limit <= 0:
+            return
+        count = 0
+        stack = [(self.root_node, b'')]
+        while stack:
+            node, path = stack.pop()
+            # all keys below path sort before start, or after end
+            if path < start[:len(path)]:
+                continue
+            if end is not None and path > end[:len(path)]:
+                return
+            node = self._decode_to_node(node)
+            node_type = self._get_node_type(node)
+            if node_type == NODE_TYPE_BLANK:
+                continue
+            if node_type == NODE_TYPE_EXTENSION:
+                stack.append((node[1], path + unpack_to_nibbles(node[0])))
+                continue
+            if node_type == NODE_TYPE_BRANCH:
+                for i in range(15, -1, -1):
+                    if node[i] != BLANK_NODE:
+                        stack.append((node[i], path + ascii_chr(i)))
+                if node[16] == BLANK_NODE:
+                    continue
+                key, value = path, node[16]
+            else:
+                key = path + without_terminator(unpack_to_nibbles(node[0]))
+                value = node[1]
+            if key < start:
+                continue
+            if end is not None and key >= end:
+                return
+            yield nibbles_to_bin(key), value
+            count += 1
+            if count == limit:
+                return
+
+    def get_range(self, start=b'', end=None, limit=None, token=None):
+        """get a page of (key, value) pairs of `iter_range`
+
+        :param token: continuation token of the previous page, which
+            replaces start
+        :return: the pairs and the token of the next page, None if this
+            was the last page
+        """
+        if token is not None:
+            root_hash, start = decode_optimized(token)
+            if root_hash != self.root_hash:
+                raise Exception("Range token belongs to another root")
+        items = list(self.iter_range(
+            start, end, None if limit is None else limit + 1))
+        if limit is None or len(items) <= limit:
+            return items, None
+        return items[:limit], rlp_encode([self.root_hash, items[limit][0]])
+
     def next(self, key):
         # print('nextting')
         key = bin_to_nibbles(key)
@@ -615,7 +856,7 @@ class Trie(object):
         """delete storage
         :param node: node in form of list, or BLANK_NODE
         """
-        if node == BLANK_NODE:
+        if node == BLANK_NODE or isinstance(node, DirtyNode):
             return
         # assert isinstance(node, list)
         encoded = self._encode_node(node, put_in_db=False)
@@ -633,8 +874,8 @@ class Trie(object):
         """ update item inside a node
 
         :param node: node in form of list, or BLANK_NODE
-        :param key: nibble list without terminator
-            .. note:: key may be []
+        :param key: nibble path without terminator
+            .. note:: key may be empty
         :return: new node
 
         if this node is changed to a new node, it's parent will take the
@@ -665,7 +906,7 @@ class Trie(object):
 
         # the value item is not blank
         if not_blank_index == 16:
-            return [pack_nibbles(with_terminator([])), node[16]]
+            return [pack_nibbles(TERMINATOR_NIBBLES), node[16]]
 
         # normal item is not blank
         sub_node = self._decode_to_node(node[not_blank_index])
@@ -674,15 +915,17 @@ class Trie(object):
         if is_key_value_type(sub_node_type):
             # collape subnode to this node, not this node will have same
             # terminator with the new sub node, and value does not change
-            new_key = [not_blank_index] + \
+            new_key = ascii_chr(not_blank_index) + \
                 unpack_to_nibbles(sub_node[0])
             return [pack_nibbles(new_key), sub_node[1]]
         if sub_node_type == NODE_TYPE_BRANCH:
-            return [pack_nibbles([not_blank_index]),
+            return [pack_nibbles(ascii_chr(not_blank_index)),
                     self._encode_node(sub_node)]
         assert False
 
     def _delete_and_delete_storage(self, node, key):
+        if isinstance(node, DirtyNode):
+            return self._delete(node, key)
         old_node = node[:]
         new_node = self._delete(node, key)
         if old_node != new_node:
@@ -759,10 +1002,11 @@ class Trie(object):
         if len(key) > 32:
             raise Exception("Max key length is 32")
 
-        self.root_node = self._delete_and_delete_storage(
-            self.root_node,
-            bin_to_nibbles(to_string(key)))
-        self._update_root_hash()
+        with self.db.write_batch():
+            self.root_node = self._delete_and_delete_storage(
+                self.root_node,
+                bin_to_nibbles(to_string(key)))
+            self._update_root_hash()
 
     def _get_size(self, node):
         """Get counts of (key, value) stored in this and the descendant nodes
@@ -799,37 +1043,26 @@ class Trie(object):
         node_type = self._get_node_type(node)
 
         if is_key_value_type(node_type):
-            nibbles = without_terminator(unpack_to_nibbles(node[0]))
-            key = b'+'.join([to_string(x) for x in nibbles])
+            key = without_terminator(unpack_to_nibbles(node[0]))
             if node_type == NODE_TYPE_EXTENSION:
                 sub_tree = self._iter_branch(self._decode_to_node(node[1]))
             else:
-                sub_tree = [(to_string(NIBBLE_TERMINATOR), node[1])]
+                sub_tree = [(TERMINATOR_NIBBLES, node[1])]
 
             # prepend key of this node to the keys of children
             for sub_key, sub_value in sub_tree:
-                full_key = (key + b'+' + sub_key).strip(b'+')
-                yield (full_key, sub_value)
+                yield (key + sub_key, sub_value)
 
         elif node_type == NODE_TYPE_BRANCH:
             for i in range(16):
                 sub_tree = self._iter_branch(self._decode_to_node(node[i]))
                 for sub_key, sub_value in sub_tree:
-                    full_key = (
-                        str_to_bytes(
-                            str(i)) +
-                        b'+' +
-                        sub_key).strip(b'+')
-                    yield (full_key, sub_value)
+                    yield (ascii_chr(i) + sub_key, sub_value)
             if node[16]:
-                yield (to_string(NIBBLE_TERMINATOR), node[-1])
+                yield (TERMINATOR_NIBBLES, node[-1])
 
     def iter_branch(self):
-        for key_str, value in self._iter_branch(self.root_node):
-            if key_str:
-                nibbles = [int(x) for x in key_str.split(b'+')]
-            else:
-                nibbles = []
+        for nibbles, value in self._iter_branch(self.root_node):
             key = nibbles_to_bin(without_terminator(nibbles))
             yield key, value
 
@@ -849,18 +1082,16 @@ class Trie(object):
         node_type = self._get_node_type(node)
 
         if is_key_value_type(node_type):
-            nibbles = without_terminator(unpack_to_nibbles(node[0]))
-            key = b'+'.join([to_string(x) for x in nibbles])
+            key = without_terminator(unpack_to_nibbles(node[0]))
             if node_type == NODE_TYPE_EXTENSION:
                 sub_dict = self._to_dict(self._decode_to_node(node[1]))
             else:
-                sub_dict = {to_string(NIBBLE_TERMINATOR): node[1]}
+                sub_dict = {TERMINATOR_NIBBLES: node[1]}
 
             # prepend key of this node to the keys of children
             res = {}
             for sub_key, sub_value in sub_dict.items():
-                full_key = (key + b'+' + sub_key).strip(b'+')
-                res[full_key] = sub_value
+                res[key + sub_key] = sub_value
             return res
 
         elif node_type == NODE_TYPE_BRANCH:
@@ -869,25 +1100,16 @@ class Trie(object):
                 sub_dict = self._to_dict(self._decode_to_node(node[i]))
 
                 for sub_key, sub_value in sub_dict.items():
-                    full_key = (
-                        str_to_bytes(
-                            str(i)) +
-                        b'+' +
-                        sub_key).strip(b'+')
-                    res[full_key] = sub_value
+                    res[ascii_chr(i) + sub_key] = sub_value
 
             if node[16]:
-                res[to_string(NIBBLE_TERMINATOR)] = node[-1]
+                res[TERMINATOR_NIBBLES] = node[-1]
             return res
 
     def to_dict(self):
         d = self._to_dict(self.root_node)
         res = {}
-        for key_str, value in d.items():
-            if key_str:
-                nibbles = [int(x) for x in key_str.split(b'+')]
-            else:
-                nibbles = []
+        for nibbles, value in d.items():
             key = nibbles_to_bin(without_terminator(nibbles))
             res[key] = value
         return res
@@ -929,17 +1151,119 @@ class Trie(object):
 
         # if value == '':
         #     return self.delete(key)
-        self.root_node = self._update_and_delete_storage(
-            self.root_node,
-            bin_to_nibbles(to_string(key)),
-            to_string(value))
-        self._update_root_hash()
+        with self.db.write_batch():
+            self.root_node = self._update_and_delete_storage(
+                self.root_node,
+                bin_to_nibbles(to_string(key)),
+                to_string(value))
+            self._update_root_hash()
 
     def root_hash_valid(self):
         if self.root_hash == BLANK_ROOT:
             return True
         return self.root_hash in self.db
 
+    def get_proof(self, key):
+        """get the encoded nodes on the path to a key, root first
+
+        The proof shows the value of the key, or its absence, to anyone
+        knowing the root hash. See `verify_proof`.
+        """
+        return self.get_multiproof([key])
+
+    def get_multiproof(self, keys):
+        """get the encoded nodes on the paths to several keys
+
+        Nodes shared by the paths are included once. See `verify_multiproof`.
+        """
+        if self.root_hash == BLANK_ROOT:
+            return []
+        proof = []
+        nodes = {}
+        for key in keys:
+            self._collect_proof(bin_to_nibbles(to_string(key)), proof, nodes)
+        return proof
+
+    def _collect_proof(self, key, proof, nodes):
+        """append the nodes on the path to key which are not yet in nodes
+
+        :param nodes: decoded nodes of the proof so far, by hash
+        """
+        encoded = self.root_hash
+        while True:
+            if isinstance(encoded, list):
+                # embedded in its parent, which is already in the proof
+                node = encoded
+            elif encoded in nodes:
+                node = nodes[encoded]
+            else:
+                rlpnode = self.db.get(encoded)
+                node = nodes[encoded] = decode_optimized(rlpnode)
+                proof.append(rlpnode)
+
+            node_type = self._get_node_type(node)
+            if node_type == NODE_TYPE_BRANCH:
+                if not key:
+                    return
+                encoded, key = node[key[0]], key[1:]
+            elif node_type == NODE_TYPE_EXTENSION:
+                curr_key = unpack_to_nibbles(node[0])
+                if not starts_with(key, curr_key):
+                    return
+                encoded, key = node[1], key[len(curr_key):]
+            else:
+                return
+            if encoded == BLANK_NODE:
+                return
+
+
+class _NodeLog(object):
+    """records the nodes stored while committing a subtree in a worker"""
+
+    def __init__(self):
+        self.puts = []
+
+    def put(self, key, value):
+        self.puts.append((key, value))
+
+
+def _commit_subtree(node):
+    """commit a dirty subtree in a worker process
+
+    :return: the encoded subtree and the (hash, rlp) pairs to store
+    """
+    log = _NodeLog()
+    encoded = Trie(log, lazy=True)._commit_child(node)
+    return encoded, log.puts
+
+
+def verify_proof(root_hash, key, proof):
+    """check a proof made by `Trie.get_proof`
+
+    :return: the value of key, or BLANK_NODE if the proof shows that the
+        key is not in the trie
+    :raise InvalidProof: if the proof lacks a node on the path to key
+    """
+    return verify_multiproof(root_hash, [key], proof)[0]
+
+
+def verify_multiproof(root_hash, keys, proof):
+    """check a proof made by `Trie.get_multiproof`
+
+    :return: the values of keys, in order, BLANK_NODE for absent keys
+    :raise InvalidProof: if the proof lacks a node on the path to a key
+    """
+    db = EphemDB()
+    for node in proof:
+        if isinstance(node, list):
+            node = rlp_encode(node)
+        db.put(utils.sha3(node), node)
+    try:
+        t = Trie(db, root_hash)
+        return [t.get(key) for key in keys]
+    except KeyError:
+        raise InvalidProof("Proof is missing a node")
+
 
 if __name__ == "__main__":
     import sys
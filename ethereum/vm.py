@@ -7,6 +7,7 @@ import sys
 sys.setrecursionlimit(10000)
 
 import copy
+import importlib
 
 from ethereum.utils import encode_hex, ascii_chr
 from ethereum import utils
@@ -14,11 +15,8 @@ from ethereum.abi import is_numeric
 from ethereum import opcodes
 from ethereum.slogging import get_logger
 from ethereum.utils import to_string, encode_int, zpad, bytearray_to_bytestr, safe_ord
-
-if sys.version_info.major == 2:
-    from repoze.lru import lru_cache
-else:
-    from functools import lru_cache
+from ethereum.code_cache import analyses, register_analysis
+import rlp
 
 log_log = get_logger('eth.vm.log')
 log_msg = get_logger('eth.pb.msg')
@@ -123,7 +121,6 @@ class Compustate():
 
 # Preprocesses code, and determines which locations are in the middle
 # of pushdata and thus invalid
-@lru_cache(128)
 def preprocess_code(code):
     o = 0
     i = 0
@@ -142,6 +139,39 @@ def preprocess_code(code):
     return o, pushcache
 
 
+def _encode_jumpdests(analysis):
+    jumpdest_mask, pushcache = analysis
+    return rlp.encode([encode_int(jumpdest_mask), [
+        [encode_int(i), encode_int(v)] for i, v in pushcache.items()]])
+
+
+def _decode_jumpdests(encoded):
+    jumpdest_mask, pushes = rlp.decode(encoded)
+    return utils.big_endian_to_int(jumpdest_mask), {
+        utils.big_endian_to_int(i): utils.big_endian_to_int(v)
+        for i, v in pushes}
+
+
+# A bit per code byte, and a dict entry per push
+register_analysis(
+    b'jumpdests', preprocess_code,
+    lambda code, analysis: len(code) // 8 + 120 * len(analysis[1]),
+    _encode_jumpdests, _decode_jumpdests)
+
+
+def get_analysis(ext, msg, code, kind):
+    """an analysis of the code being executed, from the code cache if any"""
+    cache = ext.code_cache
+    if cache is None:
+        return analyses[kind].analyze(code)
+    # Init code is not stored under its hash
+    if msg.is_create:
+        code_hash = utils.sha3(code)
+    else:
+        code_hash = ext.get_code_hash(msg.code_address)
+    return cache.get(code_hash, kind, code)
+
+
 # Extends memory, and pays gas for it
 def mem_extend(mem, compustate, op, start, sz):
     if sz and start + sz > len(mem):
@@ -242,20 +272,657 @@ def vm_trace(ext, msg, compustate, opcode, pushcache, tracer=log_vm_op):
     compustate.prev_prev_op = op
 
 
+# Operation handlers. Each takes the compustate and its stack, runs after
+# the base fee is paid and the stack height is checked, and returns None
+# to continue or the result of the execution to exit.
+
+# Arithmetic
+def _op_stop(c, stk):
+    return peaceful_exit('STOP', c.gas, [])
+
+
+def _op_add(c, stk):
+    stk.append((stk.pop() + stk.pop()) & TT256M1)
+
+
+def _op_mul(c, stk):
+    stk.append((stk.pop() * stk.pop()) & TT256M1)
+
+
+def _op_sub(c, stk):
+    stk.append((stk.pop() - stk.pop()) & TT256M1)
+
+
+def _op_div(c, stk):
+    s0, s1 = stk.pop(), stk.pop()
+    stk.append(0 if s1 == 0 else s0 // s1)
+
+
+def _op_sdiv(c, stk):
+    s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
+    stk.append(0 if s1 == 0 else (abs(s0) // abs(s1) *
+                                  (-1 if s0 * s1 < 0 else 1)) & TT256M1)
+
+
+def _op_mod(c, stk):
+    s0, s1 = stk.pop(), stk.pop()
+    stk.append(0 if s1 == 0 else s0 % s1)
+
+
+def _op_smod(c, stk):
+    s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
+    stk.append(0 if s1 == 0 else (abs(s0) % abs(s1) *
+                                  (-1 if s0 < 0 else 1)) & TT256M1)
+
+
+def _op_addmod(c, stk):
+    s0, s1, s2 = stk.pop(), stk.pop(), stk.pop()
+    stk.append((s0 + s1) % s2 if s2 else 0)
+
+
+def _op_mulmod(c, stk):
+    s0, s1, s2 = stk.pop(), stk.pop(), stk.pop()
+    stk.append((s0 * s1) % s2 if s2 else 0)
+
+
+def _op_exp(c, stk):
+    base, exponent = stk.pop(), stk.pop()
+    # fee for exponent is dependent on its bytes
+    # calc n bytes to represent exponent
+    nbytes = len(utils.encode_int(exponent))
+    expfee = nbytes * opcodes.GEXPONENTBYTE
+    if c.ext.post_spurious_dragon_hardfork():
+        expfee += opcodes.EXP_SUPPLEMENTAL_GAS * nbytes
+    if c.gas < expfee:
+        c.gas = 0
+        return vm_exception('OOG EXPONENT')
+    c.gas -= expfee
+    stk.append(pow(base, exponent, TT256))
+
+
+def _op_signextend(c, stk):
+    s0, s1 = stk.pop(), stk.pop()
+    if s0 <= 31:
+        testbit = s0 * 8 + 7
+        if s1 & (1 << testbit):
+            stk.append(s1 | (TT256 - (1 << testbit)))
+        else:
+            stk.append(s1 & ((1 << testbit) - 1))
+    else:
+        stk.append(s1)
+
+
+# Comparisons
+def _op_lt(c, stk):
+    stk.append(1 if stk.pop() < stk.pop() else 0)
+
+
+def _op_gt(c, stk):
+    stk.append(1 if stk.pop() > stk.pop() else 0)
+
+
+def _op_slt(c, stk):
+    s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
+    stk.append(1 if s0 < s1 else 0)
+
+
+def _op_sgt(c, stk):
+    s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
+    stk.append(1 if s0 > s1 else 0)
+
+
+def _op_eq(c, stk):
+    stk.append(1 if stk.pop() == stk.pop() else 0)
+
+
+def _op_iszero(c, stk):
+    stk.append(0 if stk.pop() else 1)
+
+
+def _op_and(c, stk):
+    stk.append(stk.pop() & stk.pop())
+
+
+def _op_or(c, stk):
+    stk.append(stk.pop() | stk.pop())
+
+
+def _op_xor(c, stk):
+    stk.append(stk.pop() ^ stk.pop())
+
+
+def _op_not(c, stk):
+    stk.append(TT256M1 - stk.pop())
+
+
+def _op_byte(c, stk):
+    s0, s1 = stk.pop(), stk.pop()
+    if s0 >= 32:
+        stk.append(0)
+    else:
+        stk.append((s1 // 256 ** (31 - s0)) % 256)
+
+
+# SHA3 and environment info
+def _op_sha3(c, stk):
+    s0, s1 = stk.pop(), stk.pop()
+    c.gas -= opcodes.GSHA3WORD * (utils.ceil32(s1) // 32)
+    if c.gas < 0:
+        return vm_exception('OOG PAYING FOR SHA3')
+    if not mem_extend(c.memory, c, 'SHA3', s0, s1):
+        return vm_exception('OOG EXTENDING MEMORY')
+    data = bytearray_to_bytestr(c.memory[s0: s0 + s1])
+    stk.append(utils.big_endian_to_int(utils.sha3(data)))
+
+
+def _op_address(c, stk):
+    stk.append(utils.coerce_to_int(c.msg.to))
+
+
+def _op_balance(c, stk):
+    if c.ext.post_anti_dos_hardfork():
+        if not eat_gas(c, opcodes.BALANCE_SUPPLEMENTAL_GAS):
+            return vm_exception("OUT OF GAS")
+    addr = utils.coerce_addr_to_hex(stk.pop() % 2**160)
+    stk.append(c.ext.get_balance(addr))
+
+
+def _op_origin(c, stk):
+    stk.append(utils.coerce_to_int(c.ext.tx_origin))
+
+
+def _op_caller(c, stk):
+    stk.append(utils.coerce_to_int(c.msg.sender))
+
+
+def _op_callvalue(c, stk):
+    stk.append(c.msg.value)
+
+
+def _op_calldataload(c, stk):
+    stk.append(c.msg.data.extract32(stk.pop()))
+
+
+def _op_calldatasize(c, stk):
+    stk.append(c.msg.data.size)
+
+
+def _op_calldatacopy(c, stk):
+    mstart, dstart, size = stk.pop(), stk.pop(), stk.pop()
+    if not mem_extend(c.memory, c, 'CALLDATACOPY', mstart, size):
+        return vm_exception('OOG EXTENDING MEMORY')
+    if not data_copy(c, size):
+        return vm_exception('OOG COPY DATA')
+    c.msg.data.extract_copy(c.memory, mstart, dstart, size)
+
+
+def _op_codesize(c, stk):
+    stk.append(c.codelen)
+
+
+def _op_codecopy(c, stk):
+    mstart, dstart, size = stk.pop(), stk.pop(), stk.pop()
+    mem = c.memory
+    if not mem_extend(mem, c, 'CODECOPY', mstart, size):
+        return vm_exception('OOG EXTENDING MEMORY')
+    if not data_copy(c, size):
+        return vm_exception('OOG COPY DATA')
+    code, codelen = c.code, c.codelen
+    for i in range(size):
+        if dstart + i < codelen:
+            mem[mstart + i] = safe_ord(code[dstart + i])
+        else:
+            mem[mstart + i] = 0
+
+
+def _op_gasprice(c, stk):
+    stk.append(c.ext.tx_gasprice)
+
+
+def _op_extcodesize(c, stk):
+    if c.ext.post_anti_dos_hardfork():
+        if not eat_gas(c, opcodes.EXTCODELOAD_SUPPLEMENTAL_GAS):
+            return vm_exception("OUT OF GAS")
+    addr = utils.coerce_addr_to_hex(stk.pop() % 2**160)
+    stk.append(len(c.ext.get_code(addr) or b''))
+
+
+def _op_extcodecopy(c, stk):
+    if c.ext.post_anti_dos_hardfork():
+        if not eat_gas(c, opcodes.EXTCODELOAD_SUPPLEMENTAL_GAS):
+            return vm_exception("OUT OF GAS")
+    addr = utils.coerce_addr_to_hex(stk.pop() % 2**160)
+    start, s2, size = stk.pop(), stk.pop(), stk.pop()
+    extcode = c.ext.get_code(addr) or b''
+    assert utils.is_string(extcode)
+    mem = c.memory
+    if not mem_extend(mem, c, 'EXTCODECOPY', start, size):
+        return vm_exception('OOG EXTENDING MEMORY')
+    if not data_copy(c, size):
+        return vm_exception('OOG COPY DATA')
+    for i in range(size):
+        if s2 + i < len(extcode):
+            mem[start + i] = safe_ord(extcode[s2 + i])
+        else:
+            mem[start + i] = 0
+
+
+def _op_returndatasize(c, stk):
+    stk.append(len(c.last_returned))
+
+
+def _op_returndatacopy(c, stk):
+    mstart, dstart, size = stk.pop(), stk.pop(), stk.pop()
+    if not mem_extend(c.memory, c, 'RETURNDATACOPY', mstart, size):
+        return vm_exception('OOG EXTENDING MEMORY')
+    if not data_copy(c, size):
+        return vm_exception('OOG COPY DATA')
+    if dstart + size > len(c.last_returned):
+        return vm_exception('RETURNDATACOPY out of range')
+    c.memory[mstart: mstart + size] = \
+        c.last_returned[dstart: dstart + size]
+
+
+# Block info
+def _op_blockhash(c, stk):
+    if c.ext.post_constantinople_hardfork() and False:
+        bh_addr = c.ext.blockhash_store
+        stk.append(c.ext.get_storage_data(bh_addr, stk.pop()))
+    else:
+        stk.append(utils.big_endian_to_int(c.ext.block_hash(stk.pop())))
+
+
+def _op_coinbase(c, stk):
+    stk.append(utils.big_endian_to_int(c.ext.block_coinbase))
+
+
+def _op_timestamp(c, stk):
+    stk.append(c.ext.block_timestamp)
+
+
+def _op_number(c, stk):
+    stk.append(c.ext.block_number)
+
+
+def _op_difficulty(c, stk):
+    stk.append(c.ext.block_difficulty)
+
+
+def _op_gaslimit(c, stk):
+    stk.append(c.ext.block_gas_limit)
+
+
+# VM state manipulations
+def _op_pop(c, stk):
+    stk.pop()
+
+
+def _op_mload(c, stk):
+    s0 = stk.pop()
+    if not mem_extend(c.memory, c, 'MLOAD', s0, 32):
+        return vm_exception('OOG EXTENDING MEMORY')
+    stk.append(utils.bytes_to_int(c.memory[s0: s0 + 32]))
+
+
+def _op_mstore(c, stk):
+    s0, s1 = stk.pop(), stk.pop()
+    if not mem_extend(c.memory, c, 'MSTORE', s0, 32):
+        return vm_exception('OOG EXTENDING MEMORY')
+    c.memory[s0: s0 + 32] = utils.encode_int32(s1)
+
+
+def _op_mstore8(c, stk):
+    s0, s1 = stk.pop(), stk.pop()
+    if not mem_extend(c.memory, c, 'MSTORE8', s0, 1):
+        return vm_exception('OOG EXTENDING MEMORY')
+    c.memory[s0] = s1 % 256
+
+
+def _op_sload(c, stk):
+    if c.ext.post_anti_dos_hardfork():
+        if not eat_gas(c, opcodes.SLOAD_SUPPLEMENTAL_GAS):
+            return vm_exception("OUT OF GAS")
+    stk.append(c.ext.get_storage_data(c.msg.to, stk.pop()))
+
+
+def _op_sstore(c, stk):
+    s0, s1 = stk.pop(), stk.pop()
+    msg, ext = c.msg, c.ext
+    if msg.static:
+        return vm_exception('Cannot SSTORE inside a static context')
+    if ext.get_storage_data(msg.to, s0):
+        gascost = opcodes.GSTORAGEMOD if s1 else opcodes.GSTORAGEKILL
+        refund = 0 if s1 else opcodes.GSTORAGEREFUND
+    else:
+        gascost = opcodes.GSTORAGEADD if s1 else opcodes.GSTORAGEMOD
+        refund = 0
+    if c.gas < gascost:
+        return vm_exception('OUT OF GAS')
+    c.gas -= gascost
+    # adds neg gascost as a refund if below zero
+    ext.add_refund(refund)
+    ext.set_storage_data(msg.to, s0, s1)
+
+
+def _op_jump(c, stk):
+    c.pc = stk.pop()
+    if c.pc >= c.codelen or not ((1 << c.pc) & c.jumpdest_mask):
+        return vm_exception('BAD JUMPDEST')
+
+
+def _op_jumpi(c, stk):
+    s0, s1 = stk.pop(), stk.pop()
+    if s1:
+        c.pc = s0
+        if c.pc >= c.codelen or not ((1 << c.pc) & c.jumpdest_mask):
+            return vm_exception('BAD JUMPDEST')
+
+
+def _op_pc(c, stk):
+    stk.append(c.pc - 1)
+
+
+def _op_msize(c, stk):
+    stk.append(len(c.memory))
+
+
+def _op_gas(c, stk):
+    stk.append(c.gas)  # AFTER subtracting cost 1
+
+
+def _op_nothing(c, stk):
+    pass
+
+
+def _mk_push(width):
+    def _op_push(c, stk):
+        stk.append(c.pushcache[c.pc - 1])
+        c.pc += width
+    return _op_push
+
+
+# DUPn (eg. DUP1: a b c -> a b c c, DUP3: a b c -> a b c a)
+def _mk_dup(n):
+    def _op_dup(c, stk):
+        stk.append(stk[-n])
+    return _op_dup
+
+
+# SWAPn (eg. SWAP1: a b c d -> a b d c, SWAP3: a b c d -> d b c a)
+def _mk_swap(n):
+    def _op_swap(c, stk):
+        temp = stk[-n - 1]
+        stk[-n - 1] = stk[-1]
+        stk[-1] = temp
+    return _op_swap
+
+
+# Logs (aka "events")
+def _mk_log(depth):
+    """
+    0xa0 ... 0xa4, 32/64/96/128/160 + len(data) gas
+    a. Opcodes LOG0...LOG4 are added, takes 2-6 stack arguments
+            MEMSTART MEMSZ (TOPIC1) (TOPIC2) (TOPIC3) (TOPIC4)
+    b. Logs are kept track of during tx execution exactly the same way as suicides
+       (except as an ordered list, not a set).
+       Each log is in the form [address, [topic1, ... ], data] where:
+       * address is what the ADDRESS opcode would output
+       * data is mem[MEMSTART: MEMSTART + MEMSZ]
+       * topics are as provided by the opcode
+    c. The ordered list of logs in the transaction are expressed as [log0, log1, ..., logN].
+    """
+    op = 'LOG%d' % depth
+
+    def _op_log(c, stk):
+        mstart, msz = stk.pop(), stk.pop()
+        topics = [stk.pop() for x in range(depth)]
+        c.gas -= msz * opcodes.GLOGBYTE
+        msg = c.msg
+        if msg.static:
+            return vm_exception('Cannot LOG inside a static context')
+        if not mem_extend(c.memory, c, op, mstart, msz):
+            return vm_exception('OOG EXTENDING MEMORY')
+        data = bytearray_to_bytestr(c.memory[mstart: mstart + msz])
+        c.ext.log(msg.to, topics, data)
+        log_log.trace('LOG', to=msg.to, topics=topics,
+                      data=list(map(utils.safe_ord, data)))
+    return _op_log
+
+
+# Create a new contract
+def _op_create(c, stk):
+    value, mstart, msz = stk.pop(), stk.pop(), stk.pop()
+    msg, ext = c.msg, c.ext
+    if not mem_extend(c.memory, c, 'CREATE', mstart, msz):
+        return vm_exception('OOG EXTENDING MEMORY')
+    if msg.static:
+        return vm_exception('Cannot CREATE inside a static context')
+    if ext.get_balance(msg.to) >= value and msg.depth < MAX_DEPTH:
+        cd = CallData(c.memory, mstart, msz)
+        ingas = c.gas
+        if ext.post_anti_dos_hardfork():
+            ingas = all_but_1n(ingas, opcodes.CALL_CHILD_LIMIT_DENOM)
+        create_msg = Message(msg.to, b'', value, ingas, cd, msg.depth + 1)
+        o, gas, data = ext.create(create_msg)
+        if o:
+            stk.append(utils.coerce_to_int(data))
+            c.last_returned = bytearray(b'')
+        else:
+            stk.append(0)
+            c.last_returned = bytearray(data)
+        c.gas = c.gas - ingas + gas
+    else:
+        stk.append(0)
+        c.last_returned = bytearray(b'')
+
+
+# Calls
+def _mk_call(op):
+    def _op_call(c, stk):
+        msg, ext, mem = c.msg, c.ext, c.memory
+        # Pull arguments from the stack
+        if op in ('CALL', 'CALLCODE'):
+            gas, to, value, meminstart, meminsz, memoutstart, memoutsz = \
+                stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop()
+        else:
+            gas, to, meminstart, meminsz, memoutstart, memoutsz = \
+                stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop()
+            value = 0
+        # Static context prohibition
+        if msg.static and value > 0 and op == 'CALL':
+            return vm_exception(
+                'Cannot make a non-zero-value call inside a static context')
+        # Expand memory
+        if not mem_extend(mem, c, op, meminstart, meminsz) or \
+                not mem_extend(mem, c, op, memoutstart, memoutsz):
+            return vm_exception('OOG EXTENDING MEMORY')
+        to = utils.int_to_addr(to)
+        # Extra gas costs based on various factors
+        extra_gas = 0
+        # Creating a new account
+        if op == 'CALL' and not ext.account_exists(to) and (
+                value > 0 or not ext.post_spurious_dragon_hardfork()):
+            extra_gas += opcodes.GCALLNEWACCOUNT
+        # Value transfer
+        if value > 0:
+            extra_gas += opcodes.GCALLVALUETRANSFER
+        # Cost increased from 40 to 700 in Tangerine Whistle
+        if ext.post_anti_dos_hardfork():
+            extra_gas += opcodes.CALL_SUPPLEMENTAL_GAS
+        # Compute child gas limit
+        if ext.post_anti_dos_hardfork():
+            if c.gas < extra_gas:
+                return vm_exception('OUT OF GAS', needed=extra_gas)
+            gas = min(
+                gas,
+                all_but_1n(
+                    c.gas -
+                    extra_gas,
+                    opcodes.CALL_CHILD_LIMIT_DENOM))
+        else:
+            if c.gas < gas + extra_gas:
+                return vm_exception('OUT OF GAS', needed=gas + extra_gas)
+        submsg_gas = gas + opcodes.GSTIPEND * (value > 0)
+        # Verify that there is sufficient balance and depth
+        if ext.get_balance(msg.to) < value or msg.depth >= MAX_DEPTH:
+            c.gas -= (gas + extra_gas - submsg_gas)
+            stk.append(0)
+            c.last_returned = bytearray(b'')
+        else:
+            # Subtract gas from parent
+            c.gas -= (gas + extra_gas)
+            assert c.gas >= 0
+            cd = CallData(mem, meminstart, meminsz)
+            # Generate the message
+            if op == 'CALL':
+                call_msg = Message(msg.to, to, value, submsg_gas, cd,
+                                   msg.depth + 1, code_address=to, static=msg.static)
+            elif ext.post_homestead_hardfork() and op == 'DELEGATECALL':
+                call_msg = Message(msg.sender, msg.to, msg.value, submsg_gas, cd,
+                                   msg.depth + 1, code_address=to, transfers_value=False, static=msg.static)
+            elif ext.post_metropolis_hardfork() and op == 'STATICCALL':
+                call_msg = Message(msg.to, to, value, submsg_gas, cd,
+                                   msg.depth + 1, code_address=to, static=True)
+            elif op in ('DELEGATECALL', 'STATICCALL'):
+                return vm_exception('OPCODE %s INACTIVE' % op)
+            elif op == 'CALLCODE':
+                call_msg = Message(msg.to, msg.to, value, submsg_gas, cd,
+                                   msg.depth + 1, code_address=to, static=msg.static)
+            else:
+                raise Exception("Lolwut")
+            # Get result
+            result, gas, data = ext.msg(call_msg)
+            if result == 0:
+                stk.append(0)
+            else:
+                stk.append(1)
+            # Set output memory
+            for i in range(min(len(data), memoutsz)):
+                mem[memoutstart + i] = data[i]
+            c.gas += gas
+            c.last_returned = bytearray(data)
+    return _op_call
+
+
+# Return opcode
+def _op_return(c, stk):
+    s0, s1 = stk.pop(), stk.pop()
+    if not mem_extend(c.memory, c, 'RETURN', s0, s1):
+        return vm_exception('OOG EXTENDING MEMORY')
+    return peaceful_exit('RETURN', c.gas, c.memory[s0: s0 + s1])
+
+
+# Revert opcode (Metropolis)
+def _op_revert(c, stk):
+    if not c.ext.post_metropolis_hardfork():
+        return vm_exception('Opcode not yet enabled')
+    s0, s1 = stk.pop(), stk.pop()
+    if not mem_extend(c.memory, c, 'REVERT', s0, s1):
+        return vm_exception('OOG EXTENDING MEMORY')
+    return revert(c.gas, c.memory[s0: s0 + s1])
+
+
+# SUICIDE opcode (also called SELFDESTRUCT)
+def _op_suicide(c, stk):
+    msg, ext = c.msg, c.ext
+    if msg.static:
+        return vm_exception('Cannot SUICIDE inside a static context')
+    to = utils.encode_int(stk.pop())
+    to = ((b'\x00' * (32 - len(to))) + to)[12:]
+    xfer = ext.get_balance(msg.to)
+    if ext.post_anti_dos_hardfork():
+        extra_gas = opcodes.SUICIDE_SUPPLEMENTAL_GAS + \
+            (not ext.account_exists(to)) * (xfer >
+                                            0 or not ext.post_spurious_dragon_hardfork()) * opcodes.GCALLNEWACCOUNT
+        if not eat_gas(c, extra_gas):
+            return vm_exception("OUT OF GAS")
+    ext.set_balance(to, ext.get_balance(to) + xfer)
+    ext.set_balance(msg.to, 0)
+    ext.add_suicide(msg.to)
+    log_msg.debug(
+        'SUICIDING',
+        addr=utils.checksum_encode(
+            msg.to),
+        to=utils.checksum_encode(to),
+        xferring=xfer)
+    return peaceful_exit('SUICIDED', c.gas, [])
+
+
+handlers_by_name = {
+    'STOP': _op_stop, 'ADD': _op_add, 'MUL': _op_mul, 'SUB': _op_sub,
+    'DIV': _op_div, 'SDIV': _op_sdiv, 'MOD': _op_mod, 'SMOD': _op_smod,
+    'ADDMOD': _op_addmod, 'MULMOD': _op_mulmod, 'EXP': _op_exp,
+    'SIGNEXTEND': _op_signextend,
+    'LT': _op_lt, 'GT': _op_gt, 'SLT': _op_slt, 'SGT': _op_sgt,
+    'EQ': _op_eq, 'ISZERO': _op_iszero, 'AND': _op_and, 'OR': _op_or,
+    'XOR': _op_xor, 'NOT': _op_not, 'BYTE': _op_byte,
+    'SHA3': _op_sha3,
+    'ADDRESS': _op_address, 'BALANCE': _op_balance, 'ORIGIN': _op_origin,
+    'CALLER': _op_caller, 'CALLVALUE': _op_callvalue,
+    'CALLDATALOAD': _op_calldataload, 'CALLDATASIZE': _op_calldatasize,
+    'CALLDATACOPY': _op_calldatacopy, 'CODESIZE': _op_codesize,
+    'CODECOPY': _op_codecopy, 'GASPRICE': _op_gasprice,
+    'EXTCODESIZE': _op_extcodesize, 'EXTCODECOPY': _op_extcodecopy,
+    'RETURNDATASIZE': _op_returndatasize,
+    'RETURNDATACOPY': _op_returndatacopy,
+    'BLOCKHASH': _op_blockhash, 'COINBASE': _op_coinbase,
+    'TIMESTAMP': _op_timestamp, 'NUMBER': _op_number,
+    'DIFFICULTY': _op_difficulty, 'GASLIMIT': _op_gaslimit,
+    'POP': _op_pop, 'MLOAD': _op_mload, 'MSTORE': _op_mstore,
+    'MSTORE8': _op_mstore8, 'SLOAD': _op_sload, 'SSTORE': _op_sstore,
+    'JUMP': _op_jump, 'JUMPI': _op_jumpi, 'PC': _op_pc, 'MSIZE': _op_msize,
+    'GAS': _op_gas, 'JUMPDEST': _op_nothing,
+    'CREATE': _op_create, 'CALL': _mk_call('CALL'),
+    'CALLCODE': _mk_call('CALLCODE'),
+    'DELEGATECALL': _mk_call('DELEGATECALL'),
+    'STATICCALL': _mk_call('STATICCALL'),
+    # Reserved, executed as a no-op
+    'CALLBLACKBOX': _op_nothing,
+    'RETURN': _op_return, 'REVERT': _op_revert, 'SUICIDE': _op_suicide,
+}
+for i in range(1, 33):
+    handlers_by_name['PUSH%d' % i] = _mk_push(i)
+for i in range(1, 17):
+    handlers_by_name['DUP%d' % i] = _mk_dup(i)
+    handlers_by_name['SWAP%d' % i] = _mk_swap(i)
+for i in range(5):
+    handlers_by_name['LOG%d' % i] = _mk_log(i)
+
+# Dense tables indexed by opcode; the handler is None for invalid opcodes
+OP_NAMES = [None] * 256
+OP_HANDLERS = [None] * 256
+OP_FEES = [0] * 256
+OP_INS = [0] * 256
+# Stack height change
+OP_GROWTH = [0] * 256
+OP_METROPOLIS = [False] * 256
+for opcode, (name, ins, outs, fee) in opcodes.opcodes.items():
+    OP_NAMES[opcode] = name
+    OP_HANDLERS[opcode] = handlers_by_name[name]
+    OP_FEES[opcode] = fee
+    OP_INS[opcode] = ins
+    OP_GROWTH[opcode] = outs - ins
+    OP_METROPOLIS[opcode] = opcode in opcodes.opcodesMetropolis
+
+
 # Main function
 def vm_execute(ext, msg, code):
     # precompute trace flag
     # if we trace vm, we're in slow mode anyway
     trace_vm = log_vm_op.is_active('trace')
 
+    # Compute
+    jumpdest_mask, pushcache = get_analysis(ext, msg, code, b'jumpdests')
+    codelen = len(code)
+    codebytes = bytearray(code)
+
     # Initialize stack, memory, program counter, etc
-    compustate = Compustate(gas=msg.gas)
+    compustate = Compustate(gas=msg.gas, ext=ext, msg=msg, code=code,
+                            codelen=codelen, jumpdest_mask=jumpdest_mask,
+                            pushcache=pushcache)
     stk = compustate.stack
-    mem = compustate.memory
 
-    # Compute
-    jumpdest_mask, pushcache = preprocess_code(code)
-    codelen = len(code)
+    handlers, fees, ins, growth = OP_HANDLERS, OP_FEES, OP_INS, OP_GROWTH
 
     # For tracing purposes
     op = None
@@ -263,21 +930,20 @@ def vm_execute(ext, msg, code):
     steps = 0
     while compustate.pc < codelen:
 
-        opcode = safe_ord(code[compustate.pc])
+        opcode = codebytes[compustate.pc]
+        handler = handlers[opcode]
 
         # Invalid operation
-        if opcode not in opcodes.opcodes:
+        if handler is None:
             return vm_exception('INVALID OP', opcode=opcode)
 
-        if opcode in opcodes.opcodesMetropolis and not ext.post_metropolis_hardfork():
+        if OP_METROPOLIS[opcode] and not ext.post_metropolis_hardfork():
             return vm_exception('INVALID OP (not yet enabled)', opcode=opcode)
 
-        op, in_args, out_args, fee = opcodes.opcodes[opcode]
-
         # Apply operation
         if trace_vm:
             compustate.reset_prev()
-        compustate.gas -= fee
+        compustate.gas -= fees[opcode]
         compustate.pc += 1
 
         # Tracing
@@ -288,6 +954,7 @@ def vm_execute(ext, msg, code):
             i.e. tracing can not be activated by activating a sub
             like 'eth.vm.op.stack'
             """
+            op = OP_NAMES[opcode]
             trace_data = {}
             trace_data['stack'] = list(map(to_string, list(compustate.stack)))
             if _prevop in ('MLOAD', 'MSTORE', 'MSTORE8', 'SHA3', 'CALL',
@@ -303,7 +970,7 @@ def vm_execute(ext, msg, code):
                                                         x in compustate.memory])))
             if _prevop in ('SSTORE',) or steps == 0:
                 trace_data['storage'] = ext.log_storage(msg.to)
-            trace_data['gas'] = to_string(compustate.gas + fee)
+            trace_data['gas'] = to_string(compustate.gas + fees[opcode])
             trace_data['inst'] = opcode
             trace_data['pc'] = to_string(compustate.pc - 1)
             if steps == 0:
@@ -322,455 +989,21 @@ def vm_execute(ext, msg, code):
             return vm_exception('OUT OF GAS')
 
         # empty stack error
-        if in_args > len(compustate.stack):
+        if ins[opcode] > len(stk):
             return vm_exception('INSUFFICIENT STACK',
-                                op=op, needed=to_string(in_args),
-                                available=to_string(len(compustate.stack)))
+                                op=OP_NAMES[opcode],
+                                needed=to_string(ins[opcode]),
+                                available=to_string(len(stk)))
 
         # overfull stack error
-        if len(compustate.stack) - in_args + out_args > 1024:
+        if len(stk) + growth[opcode] > 1024:
             return vm_exception('STACK SIZE LIMIT EXCEEDED',
-                                op=op,
-                                pre_height=to_string(len(compustate.stack)))
-
-        # Valid operations
-        # Pushes first because they are very frequent
-        if 0x60 <= opcode <= 0x7f:
-            stk.append(pushcache[compustate.pc - 1])
-            # Move 1 byte forward for 0x60, up to 32 bytes for 0x7f
-            compustate.pc += opcode - 0x5f
-        # Arithmetic
-        elif opcode < 0x10:
-            if op == 'STOP':
-                return peaceful_exit('STOP', compustate.gas, [])
-            elif op == 'ADD':
-                stk.append((stk.pop() + stk.pop()) & TT256M1)
-            elif op == 'SUB':
-                stk.append((stk.pop() - stk.pop()) & TT256M1)
-            elif op == 'MUL':
-                stk.append((stk.pop() * stk.pop()) & TT256M1)
-            elif op == 'DIV':
-                s0, s1 = stk.pop(), stk.pop()
-                stk.append(0 if s1 == 0 else s0 // s1)
-            elif op == 'MOD':
-                s0, s1 = stk.pop(), stk.pop()
-                stk.append(0 if s1 == 0 else s0 % s1)
-            elif op == 'SDIV':
-                s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
-                stk.append(0 if s1 == 0 else (abs(s0) // abs(s1) *
-                                              (-1 if s0 * s1 < 0 else 1)) & TT256M1)
-            elif op == 'SMOD':
-                s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
-                stk.append(0 if s1 == 0 else (abs(s0) % abs(s1) *
-                                              (-1 if s0 < 0 else 1)) & TT256M1)
-            elif op == 'ADDMOD':
-                s0, s1, s2 = stk.pop(), stk.pop(), stk.pop()
-                stk.append((s0 + s1) % s2 if s2 else 0)
-            elif op == 'MULMOD':
-                s0, s1, s2 = stk.pop(), stk.pop(), stk.pop()
-                stk.append((s0 * s1) % s2 if s2 else 0)
-            elif op == 'EXP':
-                base, exponent = stk.pop(), stk.pop()
-                # fee for exponent is dependent on its bytes
-                # calc n bytes to represent exponent
-                nbytes = len(utils.encode_int(exponent))
-                expfee = nbytes * opcodes.GEXPONENTBYTE
-                if ext.post_spurious_dragon_hardfork():
-                    expfee += opcodes.EXP_SUPPLEMENTAL_GAS * nbytes
-                if compustate.gas < expfee:
-                    compustate.gas = 0
-                    return vm_exception('OOG EXPONENT')
-                compustate.gas -= expfee
-                stk.append(pow(base, exponent, TT256))
-            elif op == 'SIGNEXTEND':
-                s0, s1 = stk.pop(), stk.pop()
-                if s0 <= 31:
-                    testbit = s0 * 8 + 7
-                    if s1 & (1 << testbit):
-                        stk.append(s1 | (TT256 - (1 << testbit)))
-                    else:
-                        stk.append(s1 & ((1 << testbit) - 1))
-                else:
-                    stk.append(s1)
-        # Comparisons
-        elif opcode < 0x20:
-            if op == 'LT':
-                stk.append(1 if stk.pop() < stk.pop() else 0)
-            elif op == 'GT':
-                stk.append(1 if stk.pop() > stk.pop() else 0)
-            elif op == 'SLT':
-                s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
-                stk.append(1 if s0 < s1 else 0)
-            elif op == 'SGT':
-                s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
-                stk.append(1 if s0 > s1 else 0)
-            elif op == 'EQ':
-                stk.append(1 if stk.pop() == stk.pop() else 0)
-            elif op == 'ISZERO':
-                stk.append(0 if stk.pop() else 1)
-            elif op == 'AND':
-                stk.append(stk.pop() & stk.pop())
-            elif op == 'OR':
-                stk.append(stk.pop() | stk.pop())
-            elif op == 'XOR':
-                stk.append(stk.pop() ^ stk.pop())
-            elif op == 'NOT':
-                stk.append(TT256M1 - stk.pop())
-            elif op == 'BYTE':
-                s0, s1 = stk.pop(), stk.pop()
-                if s0 >= 32:
-                    stk.append(0)
-                else:
-                    stk.append((s1 // 256 ** (31 - s0)) % 256)
-        # SHA3 and environment info
-        elif opcode < 0x40:
-            if op == 'SHA3':
-                s0, s1 = stk.pop(), stk.pop()
-                compustate.gas -= opcodes.GSHA3WORD * (utils.ceil32(s1) // 32)
-                if compustate.gas < 0:
-                    return vm_exception('OOG PAYING FOR SHA3')
-                if not mem_extend(mem, compustate, op, s0, s1):
-                    return vm_exception('OOG EXTENDING MEMORY')
-                data = bytearray_to_bytestr(mem[s0: s0 + s1])
-                stk.append(utils.big_endian_to_int(utils.sha3(data)))
-            elif op == 'ADDRESS':
-                stk.append(utils.coerce_to_int(msg.to))
-            elif op == 'BALANCE':
-                if ext.post_anti_dos_hardfork():
-                    if not eat_gas(compustate,
-                                   opcodes.BALANCE_SUPPLEMENTAL_GAS):
-                        return vm_exception("OUT OF GAS")
-                addr = utils.coerce_addr_to_hex(stk.pop() % 2**160)
-                stk.append(ext.get_balance(addr))
-            elif op == 'ORIGIN':
-                stk.append(utils.coerce_to_int(ext.tx_origin))
-            elif op == 'CALLER':
-                stk.append(utils.coerce_to_int(msg.sender))
-            elif op == 'CALLVALUE':
-                stk.append(msg.value)
-            elif op == 'CALLDATALOAD':
-                stk.append(msg.data.extract32(stk.pop()))
-            elif op == 'CALLDATASIZE':
-                stk.append(msg.data.size)
-            elif op == 'CALLDATACOPY':
-                mstart, dstart, size = stk.pop(), stk.pop(), stk.pop()
-                if not mem_extend(mem, compustate, op, mstart, size):
-                    return vm_exception('OOG EXTENDING MEMORY')
-                if not data_copy(compustate, size):
-                    return vm_exception('OOG COPY DATA')
-                msg.data.extract_copy(mem, mstart, dstart, size)
-            elif op == 'CODESIZE':
-                stk.append(codelen)
-            elif op == 'CODECOPY':
-                mstart, dstart, size = stk.pop(), stk.pop(), stk.pop()
-                if not mem_extend(mem, compustate, op, mstart, size):
-                    return vm_exception('OOG EXTENDING MEMORY')
-                if not data_copy(compustate, size):
-                    return vm_exception('OOG COPY DATA')
-                for i in range(size):
-                    if dstart + i < codelen:
-                        mem[mstart + i] = safe_ord(code[dstart + i])
-                    else:
-                        mem[mstart + i] = 0
-            elif op == 'RETURNDATACOPY':
-                mstart, dstart, size = stk.pop(), stk.pop(), stk.pop()
-                if not mem_extend(mem, compustate, op, mstart, size):
-                    return vm_exception('OOG EXTENDING MEMORY')
-                if not data_copy(compustate, size):
-                    return vm_exception('OOG COPY DATA')
-                if dstart + size > len(compustate.last_returned):
-                    return vm_exception('RETURNDATACOPY out of range')
-                mem[mstart: mstart + size] = compustate.last_returned[dstart: dstart + size]
-            elif op == 'RETURNDATASIZE':
-                stk.append(len(compustate.last_returned))
-            elif op == 'GASPRICE':
-                stk.append(ext.tx_gasprice)
-            elif op == 'EXTCODESIZE':
-                if ext.post_anti_dos_hardfork():
-                    if not eat_gas(compustate,
-                                   opcodes.EXTCODELOAD_SUPPLEMENTAL_GAS):
-                        return vm_exception("OUT OF GAS")
-                addr = utils.coerce_addr_to_hex(stk.pop() % 2**160)
-                stk.append(len(ext.get_code(addr) or b''))
-            elif op == 'EXTCODECOPY':
-                if ext.post_anti_dos_hardfork():
-                    if not eat_gas(compustate,
-                                   opcodes.EXTCODELOAD_SUPPLEMENTAL_GAS):
-                        return vm_exception("OUT OF GAS")
-                addr = utils.coerce_addr_to_hex(stk.pop() % 2**160)
-                start, s2, size = stk.pop(), stk.pop(), stk.pop()
-                extcode = ext.get_code(addr) or b''
-                assert utils.is_string(extcode)
-                if not mem_extend(mem, compustate, op, start, size):
-                    return vm_exception('OOG EXTENDING MEMORY')
-                if not data_copy(compustate, size):
-                    return vm_exception('OOG COPY DATA')
-                for i in range(size):
-                    if s2 + i < len(extcode):
-                        mem[start + i] = safe_ord(extcode[s2 + i])
-                    else:
-                        mem[start + i] = 0
-        # Block info
-        elif opcode < 0x50:
-            if op == 'BLOCKHASH':
-                if ext.post_constantinople_hardfork() and False:
-                    bh_addr = ext.blockhash_store
-                    stk.append(ext.get_storage_data(bh_addr, stk.pop()))
-                else:
-                    stk.append(
-                        utils.big_endian_to_int(
-                            ext.block_hash(
-                                stk.pop())))
-            elif op == 'COINBASE':
-                stk.append(utils.big_endian_to_int(ext.block_coinbase))
-            elif op == 'TIMESTAMP':
-                stk.append(ext.block_timestamp)
-            elif op == 'NUMBER':
-                stk.append(ext.block_number)
-            elif op == 'DIFFICULTY':
-                stk.append(ext.block_difficulty)
-            elif op == 'GASLIMIT':
-                stk.append(ext.block_gas_limit)
-        # VM state manipulations
-        elif opcode < 0x60:
-            if op == 'POP':
-                stk.pop()
-            elif op == 'MLOAD':
-                s0 = stk.pop()
-                if not mem_extend(mem, compustate, op, s0, 32):
-                    return vm_exception('OOG EXTENDING MEMORY')
-                stk.append(utils.bytes_to_int(mem[s0: s0 + 32]))
-            elif op == 'MSTORE':
-                s0, s1 = stk.pop(), stk.pop()
-                if not mem_extend(mem, compustate, op, s0, 32):
-                    return vm_exception('OOG EXTENDING MEMORY')
-                mem[s0: s0 + 32] = utils.encode_int32(s1)
-            elif op == 'MSTORE8':
-                s0, s1 = stk.pop(), stk.pop()
-                if not mem_extend(mem, compustate, op, s0, 1):
-                    return vm_exception('OOG EXTENDING MEMORY')
-                mem[s0] = s1 % 256
-            elif op == 'SLOAD':
-                if ext.post_anti_dos_hardfork():
-                    if not eat_gas(compustate, opcodes.SLOAD_SUPPLEMENTAL_GAS):
-                        return vm_exception("OUT OF GAS")
-                stk.append(ext.get_storage_data(msg.to, stk.pop()))
-            elif op == 'SSTORE':
-                s0, s1 = stk.pop(), stk.pop()
-                if msg.static:
-                    return vm_exception(
-                        'Cannot SSTORE inside a static context')
-                if ext.get_storage_data(msg.to, s0):
-                    gascost = opcodes.GSTORAGEMOD if s1 else opcodes.GSTORAGEKILL
-                    refund = 0 if s1 else opcodes.GSTORAGEREFUND
-                else:
-                    gascost = opcodes.GSTORAGEADD if s1 else opcodes.GSTORAGEMOD
-                    refund = 0
-                if compustate.gas < gascost:
-                    return vm_exception('OUT OF GAS')
-                compustate.gas -= gascost
-                # adds neg gascost as a refund if below zero
-                ext.add_refund(refund)
-                ext.set_storage_data(msg.to, s0, s1)
-            elif op == 'JUMP':
-                compustate.pc = stk.pop()
-                if compustate.pc >= codelen or not (
-                        (1 << compustate.pc) & jumpdest_mask):
-                    return vm_exception('BAD JUMPDEST')
-            elif op == 'JUMPI':
-                s0, s1 = stk.pop(), stk.pop()
-                if s1:
-                    compustate.pc = s0
-                    if compustate.pc >= codelen or not (
-                            (1 << compustate.pc) & jumpdest_mask):
-                        return vm_exception('BAD JUMPDEST')
-            elif op == 'PC':
-                stk.append(compustate.pc - 1)
-            elif op == 'MSIZE':
-                stk.append(len(mem))
-            elif op == 'GAS':
-                stk.append(compustate.gas)  # AFTER subtracting cost 1
-        # DUPn (eg. DUP1: a b c -> a b c c, DUP3: a b c -> a b c a)
-        elif op[:3] == 'DUP':
-            # 0x7f - opcode is a negative number, -1 for 0x80 ... -16 for 0x8f
-            stk.append(stk[0x7f - opcode])
-        # SWAPn (eg. SWAP1: a b c d -> a b d c, SWAP3: a b c d -> d b c a)
-        elif op[:4] == 'SWAP':
-            # 0x8e - opcode is a negative number, -2 for 0x90 ... -17 for 0x9f
-            temp = stk[0x8e - opcode]
-            stk[0x8e - opcode] = stk[-1]
-            stk[-1] = temp
-        # Logs (aka "events")
-        elif op[:3] == 'LOG':
-            """
-            0xa0 ... 0xa4, 32/64/96/128/160 + len(data) gas
-            a. Opcodes LOG0...LOG4 are added, takes 2-6 stack arguments
-                    MEMSTART MEMSZ (TOPIC1) (TOPIC2) (TOPIC3) (TOPIC4)
-            b. Logs are kept track of during tx execution exactly the same way as suicides
-               (except as an ordered list, not a set).
-               Each log is in the form [address, [topic1, ... ], data] where:
-               * address is what the ADDRESS opcode would output
-               * data is mem[MEMSTART: MEMSTART + MEMSZ]
-               * topics are as provided by the opcode
-            c. The ordered list of logs in the transaction are expressed as [log0, log1, ..., logN].
-            """
-            depth = int(op[3:])
-            mstart, msz = stk.pop(), stk.pop()
-            topics = [stk.pop() for x in range(depth)]
-            compustate.gas -= msz * opcodes.GLOGBYTE
-            if msg.static:
-                return vm_exception('Cannot LOG inside a static context')
-            if not mem_extend(mem, compustate, op, mstart, msz):
-                return vm_exception('OOG EXTENDING MEMORY')
-            data = bytearray_to_bytestr(mem[mstart: mstart + msz])
-            ext.log(msg.to, topics, data)
-            log_log.trace('LOG', to=msg.to, topics=topics,
-                          data=list(map(utils.safe_ord, data)))
-            # print('LOG', msg.to, topics, list(map(ord, data)))
-        # Create a new contract
-        elif op == 'CREATE':
-            value, mstart, msz = stk.pop(), stk.pop(), stk.pop()
-            if not mem_extend(mem, compustate, op, mstart, msz):
-                return vm_exception('OOG EXTENDING MEMORY')
-            if msg.static:
-                return vm_exception('Cannot CREATE inside a static context')
-            if ext.get_balance(msg.to) >= value and msg.depth < MAX_DEPTH:
-                cd = CallData(mem, mstart, msz)
-                ingas = compustate.gas
-                if ext.post_anti_dos_hardfork():
-                    ingas = all_but_1n(ingas, opcodes.CALL_CHILD_LIMIT_DENOM)
-                create_msg = Message(msg.to, b'', value, ingas, cd, msg.depth + 1)
-                o, gas, data = ext.create(create_msg)
-                if o:
-                    stk.append(utils.coerce_to_int(data))
-                    compustate.last_returned = bytearray(b'')
-                else:
-                    stk.append(0)
-                    compustate.last_returned = bytearray(data)
-                compustate.gas = compustate.gas - ingas + gas
-            else:
-                stk.append(0)
-                compustate.last_returned = bytearray(b'')
-        # Calls
-        elif op in ('CALL', 'CALLCODE', 'DELEGATECALL', 'STATICCALL'):
-            # Pull arguments from the stack
-            if op in ('CALL', 'CALLCODE'):
-                gas, to, value, meminstart, meminsz, memoutstart, memoutsz = \
-                    stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop()
-            else:
-                gas, to, meminstart, meminsz, memoutstart, memoutsz = \
-                    stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop()
-                value = 0
-            # Static context prohibition
-            if msg.static and value > 0 and op == 'CALL':
-                return vm_exception(
-                    'Cannot make a non-zero-value call inside a static context')
-            # Expand memory
-            if not mem_extend(mem, compustate, op, meminstart, meminsz) or \
-                    not mem_extend(mem, compustate, op, memoutstart, memoutsz):
-                return vm_exception('OOG EXTENDING MEMORY')
-            to = utils.int_to_addr(to)
-            # Extra gas costs based on various factors
-            extra_gas = 0
-            # Creating a new account
-            if op == 'CALL' and not ext.account_exists(to) and (
-                    value > 0 or not ext.post_spurious_dragon_hardfork()):
-                extra_gas += opcodes.GCALLNEWACCOUNT
-            # Value transfer
-            if value > 0:
-                extra_gas += opcodes.GCALLVALUETRANSFER
-            # Cost increased from 40 to 700 in Tangerine Whistle
-            if ext.post_anti_dos_hardfork():
-                extra_gas += opcodes.CALL_SUPPLEMENTAL_GAS
-            # Compute child gas limit
-            if ext.post_anti_dos_hardfork():
-                if compustate.gas < extra_gas:
-                    return vm_exception('OUT OF GAS', needed=extra_gas)
-                gas = min(
-                    gas,
-                    all_but_1n(
-                        compustate.gas -
-                        extra_gas,
-                        opcodes.CALL_CHILD_LIMIT_DENOM))
-            else:
-                if compustate.gas < gas + extra_gas:
-                    return vm_exception('OUT OF GAS', needed=gas + extra_gas)
-            submsg_gas = gas + opcodes.GSTIPEND * (value > 0)
-            # Verify that there is sufficient balance and depth
-            if ext.get_balance(msg.to) < value or msg.depth >= MAX_DEPTH:
-                compustate.gas -= (gas + extra_gas - submsg_gas)
-                stk.append(0)
-                compustate.last_returned = bytearray(b'')
-            else:
-                # Subtract gas from parent
-                compustate.gas -= (gas + extra_gas)
-                assert compustate.gas >= 0
-                cd = CallData(mem, meminstart, meminsz)
-                # Generate the message
-                if op == 'CALL':
-                    call_msg = Message(msg.to, to, value, submsg_gas, cd,
-                                       msg.depth + 1, code_address=to, static=msg.static)
-                elif ext.post_homestead_hardfork() and op == 'DELEGATECALL':
-                    call_msg = Message(msg.sender, msg.to, msg.value, submsg_gas, cd,
-                                       msg.depth + 1, code_address=to, transfers_value=False, static=msg.static)
-                elif ext.post_metropolis_hardfork() and op == 'STATICCALL':
-                    call_msg = Message(msg.to, to, value, submsg_gas, cd,
-                                       msg.depth + 1, code_address=to, static=True)
-                elif op in ('DELEGATECALL', 'STATICCALL'):
-                    return vm_exception('OPCODE %s INACTIVE' % op)
-                elif op == 'CALLCODE':
-                    call_msg = Message(msg.to, msg.to, value, submsg_gas, cd,
-                                       msg.depth + 1, code_address=to, static=msg.static)
-                else:
-                    raise Exception("Lolwut")
-                # Get result
-                result, gas, data = ext.msg(call_msg)
-                if result == 0:
-                    stk.append(0)
-                else:
-                    stk.append(1)
-                # Set output memory
-                for i in range(min(len(data), memoutsz)):
-                    mem[memoutstart + i] = data[i]
-                compustate.gas += gas
-                compustate.last_returned = bytearray(data)
-        # Return opcode
-        elif op == 'RETURN':
-            s0, s1 = stk.pop(), stk.pop()
-            if not mem_extend(mem, compustate, op, s0, s1):
-                return vm_exception('OOG EXTENDING MEMORY')
-            return peaceful_exit('RETURN', compustate.gas, mem[s0: s0 + s1])
-        # Revert opcode (Metropolis)
-        elif op == 'REVERT':
-            if not ext.post_metropolis_hardfork():
-                return vm_exception('Opcode not yet enabled')
-            s0, s1 = stk.pop(), stk.pop()
-            if not mem_extend(mem, compustate, op, s0, s1):
-                return vm_exception('OOG EXTENDING MEMORY')
-            return revert(compustate.gas, mem[s0: s0 + s1])
-        # SUICIDE opcode (also called SELFDESTRUCT)
-        elif op == 'SUICIDE':
-            if msg.static:
-                return vm_exception('Cannot SUICIDE inside a static context')
-            to = utils.encode_int(stk.pop())
-            to = ((b'\x00' * (32 - len(to))) + to)[12:]
-            xfer = ext.get_balance(msg.to)
-            if ext.post_anti_dos_hardfork():
-                extra_gas = opcodes.SUICIDE_SUPPLEMENTAL_GAS + \
-                    (not ext.account_exists(to)) * (xfer >
-                                                    0 or not ext.post_spurious_dragon_hardfork()) * opcodes.GCALLNEWACCOUNT
-                if not eat_gas(compustate, extra_gas):
-                    return vm_exception("OUT OF GAS")
-            ext.set_balance(to, ext.get_balance(to) + xfer)
-            ext.set_balance(msg.to, 0)
-            ext.add_suicide(msg.to)
-            log_msg.debug(
-                'SUICIDING',
-                addr=utils.checksum_encode(
-                    msg.to),
-                to=utils.checksum_encode(to),
-                xferring=xfer)
-            return peaceful_exit('SUICIDED', compustate.gas, [])
+                                op=OP_NAMES[opcode],
+                                pre_height=to_string(len(stk)))
+
+        result = handler(compustate, stk)
+        if result is not None:
+            return result
 
         if trace_vm:
             vm_trace(ext, msg, compustate, opcode, pushcache)
@@ -781,12 +1014,31 @@ def vm_execute(ext, msg, code):
     return peaceful_exit('CODE OUT OF RANGE', compustate.gas, [])
 
 
+# Interpreters selectable with the VM_ENGINE setting, by module. All give
+# the same results.
+VM_ENGINES = {
+    'vm': 'ethereum.vm',
+    # Checks gas and stack bounds once per basic block
+    'fastvm': 'ethereum.fastvm',
+    # Compiles the blocks of code run often to Python functions
+    'jitvm': 'ethereum.jitvm',
+}
+
+
+def get_vm_engine(name):
+    """the vm_execute function of an engine in VM_ENGINES, or of a module"""
+    module = importlib.import_module(VM_ENGINES.get(name, name))
+    return module.vm_execute
+
+
 # A stub that's mainly here to show what you would need to implement to
 # hook into the EVM
 class VmExtBase():
 
     def __init__(self):
         self.get_code = lambda addr: b''
+        self.get_code_hash = lambda addr: utils.sha3(b'')
+        self.code_cache = None
         self.get_balance = lambda addr: 0
         self.set_balance = lambda addr, balance: 0
         self.set_storage_data = lambda addr, key, value: 0
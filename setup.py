@@ -37,6 +37,7 @@ setup(
         #    'pytest-runner==2.7'
     ],
     version=version,
+    python_requires='>=3.4',
     classifiers=[
         'Intended Audience :: Developers',
         'Natural Language :: English',